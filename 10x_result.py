@@ -8,6 +8,7 @@ from scipy.ndimage import gaussian_filter
 from scipy.optimize import minimize
 from scipy.ndimage import map_coordinates
 from cnn_io import *
+from inference_client import RemoteInpainter
 from hough_utils import *
 from scipy.spatial.transform import Rotation as R
 import numpy as np
@@ -85,9 +86,11 @@ def get_inpainting_result(mask):
     return cur_res
 
 def run_geometric(img,position,return_radius=False):
-    circles = run_circle_threhold(img, 10, circle_threshold=30, step=5)
+    # the second pass reuses the planes of the 10 radii of the first one
+    session = HoughSession(img, max_planes=10)
+    circles = session.detect(10, circle_threshold=30, step=5)
     re_r = statistics.mode(circles[:,2])
-    circles = run_circle_threhold(img, re_r, circle_threshold=int(2.2*re_r), step=1)
+    circles = session.detect(re_r, circle_threshold=int(2.2*re_r), step=1)
     new_circles=[]
     for x,y,r in circles:
         if position[y,x]>0.1:
@@ -134,6 +137,11 @@ def get_imgnp(image_path):
     img_np = np.array(img_pil)
     return img_np
 
+# ------ arguments handling -------
+parser = argparse.ArgumentParser()
+parser.add_argument('--server', type=str, default='', help='address of a running inference_server, the models are not loaded here')
+args = parser.parse_args()
+
 # ------ device handling -------
 cuda = True if torch.cuda.is_available() else False
 torch.cuda.set_device(0)
@@ -145,16 +153,10 @@ else:
 Tensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
 
 # Initial image inpainter
-inpainter_model_path = '/home/huifang/workspace/code/lama/big-lama'
-train_config_path = inpainter_model_path+'/config.yaml'
-with open(train_config_path, 'r') as f:
-    train_config = OmegaConf.create(yaml.safe_load(f))
-
-train_config.training_model.predict_only = True
-train_config.visualizer.kind = 'noop'
-inpainter = getLamaInpainter(train_config,inpainter_model_path+'/models/best.ckpt', strict=False, map_location='cpu')
-inpainter.freeze()
-inpainter.to(device)
+if args.server:
+    inpainter = RemoteInpainter(args.server)
+else:
+    inpainter = get_lama_inpainter(device)
 # ------ main process -------
 
 test_image_path = '/home/huifang/workspace/data/imagelists/st_image_with_aligned_fiducial.txt'
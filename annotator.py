@@ -166,7 +166,25 @@ def run_self(imagepath):
 
 
 
-def run_hough(image, imagepath, aligned_path,shrink):
+# Only searches around the fiducials predicted by the mouse frame template, the
+# full image Hough is replaced by a downscaled pass that finds the seed circles.
+def run_lattice(image,shrink):
+    he_radius = he_radius_base
+    seeds = run_circle_coarse(image, he_radius, circle_threshold=18, step=3, scale=0.5)
+    circles_f, fiducialcenter_x, fiducialcenter_y, fiducial_scale = fiducial_utils.mouse_para()
+    if shrink > 0:
+        print('Use user provided scale ' + str(shrink) + '.')
+        circles_f[:, :2] = circles_f[:, :2] * shrink
+    else:
+        circles_f = get_translated_circles(image, seeds, circles_f, fiducialcenter_x, fiducialcenter_y, fiducial_scale)
+    circles, likelihoods, transposed_fiducial = run_circle_lattice(image, he_radius, circles_f, 18, seeds=seeds,
+                                                                   step=2, crop_size=2 * he_radius - 4)
+    found = likelihoods >= 5
+    easy_circles = list(circles[found])
+    manual_positions = list(transposed_fiducial[~found, :2].astype(int))
+    return easy_circles, manual_positions, he_radius
+
+def run_hough(image, imagepath, aligned_path,shrink,lattice=False):
 
     if aligned_path:
         print('Using user provided fiducials.')
@@ -182,6 +200,8 @@ def run_hough(image, imagepath, aligned_path,shrink):
         return [],[],[]
     else:
         print('Using mouse fiducials.')
+        if lattice:
+            return run_lattice(image, shrink)
         he_radius = he_radius_base
         crop_size = 2 * he_radius
 
@@ -208,7 +228,7 @@ def run_hough(image, imagepath, aligned_path,shrink):
             circles_f = get_translated_circles(image, circles,circles_f, fiducialcenter_x, fiducialcenter_y, fiducial_scale)
 
         circles_f_copy = circles_f.copy()
-        transposed_fiducial = get_transposed_fiducials(circles, circles_f, iter=200)
+        transposed_fiducial = get_transposed_fiducials(circles, circles_f)
         c_indices, distance = find_nearest_points(circles[:, :2], transposed_fiducial[:, :2])
         f_indices = np.arange(c_indices.shape[0])
     DEBUG=True
@@ -252,17 +272,14 @@ def run_hough(image, imagepath, aligned_path,shrink):
     ###########   automatically save easy circles  ********
     # redect circles
     #     for id in hard_circles_f:
-    crop_circles=[]
-    likelihoods=[]
+    crop_images=[]
     for id in hard_circles_f:
         xf = transposed_fiducial[id, 0]
         yf = transposed_fiducial[id, 1]
         x_min, y_min, x_max, y_max = fiducial_utils.getCropCoor(xf,yf,crop_size-4,image.shape[1],image.shape[0])
         crop_image = image[y_min:y_max, x_min:x_max, :]
-
-        crop_circle, likelihood = run_circle_max(crop_image, radius=he_radius, max_n=1, step=2)
-        crop_circles.append(crop_circle)
-        likelihoods.append(likelihood)
+        crop_images.append(crop_image)
+    crop_circles, likelihoods = run_circle_max_batch(crop_images, radius=he_radius, step=2)
 
     easy_positions_f = []
     easy_circles = []
@@ -294,14 +311,14 @@ def run_hough(image, imagepath, aligned_path,shrink):
 
 
 
-def run(imagepath,aligned_path,save_file=True,shrink=0.0):
+def run(imagepath,aligned_path,save_file=True,shrink=0.0,lattice=False):
 
 
     image = plt.imread(imagepath)
 
 
     # easy_circles, manual_positions, he_radius = run_self(imagepath)
-    easy_circles, manual_positions, he_radius = run_hough(image, imagepath, aligned_path,shrink)
+    easy_circles, manual_positions, he_radius = run_hough(image, imagepath, aligned_path,shrink,lattice)
     # print(str(len(easy_circles))+' auto detected circles, '+str(len(manual_positions)) + ' need manual annotation.')
     return
     #easy circles visuailization
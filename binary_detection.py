@@ -11,6 +11,7 @@ from hough_utils import *
 import fiducial_utils
 from fiducial_utils import read_tissue_image as read_image
 import cv2
+from pix2pix.patch_annotation import annotate_patches as rasterize_patches, upsample_blocks
 
 SAVE_ROOT = '/media/huifang/data/fiducial/annotation/'
 
@@ -64,50 +65,10 @@ def show_grids(image, cnt):
 
 
 def annotate_patches(image_size, step, circles):
-    w,h = image_size
-    num_patches_w = w // step
-    num_patches_h = h // step
-
-    annotation = np.zeros((num_patches_w, num_patches_h), dtype=int)
-    for i in range(num_patches_w):
-        for j in range(num_patches_h):
-            patch_x = i * step
-            patch_y = j * step
-            patch_rect = (patch_x, patch_y, step, step)
-
-            for circle in circles:
-                circle_x, circle_y, circle_radius = circle[:3]
-                circle_radius = circle_radius+4
-                circle_rect = (circle_y - circle_radius,circle_x - circle_radius,  2 * circle_radius, 2 * circle_radius)
-
-
-                if rectangles_intersect(patch_rect, circle_rect):
-                    annotation[i, j] = 1
-                    # plt.imshow(image[patch_x:patch_x + step, patch_y:patch_y + step])
-                    # print(annotation[i, j])
-                    # plt.show()
-                    break
-
-
-    return annotation
+    return rasterize_patches(image_size, step, circles, padding=4, dtype=int)
 
 def get_image_mask_from_annotation(image_size,annotation,step):
-    image_mask = np.zeros(image_size)
-
-    for i in range(annotation.shape[0]):
-        for j in range(annotation.shape[1]):
-            patch_x = i * step
-            patch_y = j * step
-            image_mask[patch_x:patch_x + step, patch_y:patch_y + step,:] = annotation[i, j,:]
-    return image_mask
-
-def rectangles_intersect(rect1, rect2):
-    x1, y1, w1, h1 = rect1
-    x2, y2, w2, h2 = rect2
-
-    return not (x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1)
-
-
+    return upsample_blocks(annotation, step, image_size, dtype=float)
 
 def get_annotation_path(imagepath):
     dataset = imagepath.split('/')[6]
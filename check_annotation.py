@@ -4,6 +4,8 @@ import numpy as np
 from matplotlib import pyplot as plt
 import cv2
 from scipy.signal import convolve2d
+from pix2pix.patch_annotation import annotate_patches as rasterize_patches, annotate_continuous_patches, \
+    upsample_blocks
 import fiducial_utils
 from hough_utils import *
 from fiducial_utils import *
@@ -74,18 +76,6 @@ def calculate_distance(point1, point2):
     """Calculate the distance between two points."""
     return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
 
-def unique_pairs_below_threshold(circle_list, threshold):
-    """Find unique pairs of circles with distance below a given threshold."""
-    result = []
-    for i in range(len(circle_list)):
-        for j in range(i+1, len(circle_list)):
-            distance = calculate_distance(circle_list[i][:2], circle_list[j][:2])
-            if distance < threshold:
-                result.append((str(circle_list[i][1])+'_'+str(circle_list[i][0])+'_'+str(circle_list[i][2]),
-                               str(circle_list[j][1])+'_'+str(circle_list[j][0])+'_'+str(circle_list[j][2])))
-    return result
-
-
 def pairwise_distances(matrix):
     """Compute pairwise distances using matrix operations."""
     diff = matrix[:, np.newaxis, :] - matrix[np.newaxis, :, :]
@@ -93,57 +83,8 @@ def pairwise_distances(matrix):
     return distances
 
 
-def remove_overlapping_circles(circle_list, threshold):
-    """Remove circles until there are no pairs with distance below the threshold."""
-    matrix = np.array([circle[:2] for circle in circle_list])
-
-    while True:
-        distances = pairwise_distances(matrix)
-        # Set the diagonal to a large value to exclude self-comparison
-        np.fill_diagonal(distances, float('inf'))
-
-        # Check if there's any distance below the threshold
-        i, j = np.where(distances < threshold)
-
-        if len(i) == 0:
-            break
-
-        # Remove one random circle from a pair that violates the threshold
-        if circle_list[i[0]][2]>circle_list[j[0]][2]:
-            to_remove = j[0]
-        elif circle_list[i[0]][2]<circle_list[j[0]][2]:
-            to_remove = i[0]
-        else:
-            to_remove = random.choice([i[0], j[0]])
-        matrix = np.delete(matrix, to_remove, axis=0)
-        circle_list.pop(to_remove)
-
-    return circle_list
 def annotate_patches(image_size, patch_size, circles):
-    w,h = image_size
-    num_patches_w = w // patch_size
-    num_patches_h = h // patch_size
-
-    annotation = np.zeros((num_patches_w, num_patches_h), dtype=int)
-    for i in range(num_patches_w):
-        for j in range(num_patches_h):
-            patch_x = i * patch_size
-            patch_y = j * patch_size
-            patch_rect = (patch_x, patch_y, patch_size, patch_size)
-
-            for circle in circles:
-                circle_x, circle_y, circle_radius = circle[:3]
-                circle_radius = circle_radius+1
-                circle_rect = (circle_y - circle_radius,circle_x - circle_radius,  2 * circle_radius, 2 * circle_radius)
-
-
-                if rectangles_intersect(patch_rect, circle_rect):
-                    annotation[i, j] = 1
-                    # plt.imshow(image[patch_x:patch_x + step, patch_y:patch_y + step])
-                    # print(annotation[i, j])
-                    # plt.show()
-                    break
-    return annotation
+    return rasterize_patches(image_size, patch_size, circles, padding=1, dtype=int)
 
 def get_shape_from_annotation_path(fileid):
     # Replace with the path to your JSON file
@@ -247,52 +188,8 @@ def get_circles_from_file(image_name):
     hard_circles = [circle for circle in circles if circle[-1] == 2]
     return in_tissue_circles,out_tissue_circles,hard_circles,circles
 
-def annotate_continuous_patches(image_size, patch_size, circles):
-
-    # Initialize the mask with zeros
-    mask = np.zeros(image_size, dtype=np.uint8)
-
-    half_patch = patch_size // 2
-    for circle in circles:
-        x, y, _, _ = circle
-
-        # Calculate the top-left and bottom-right corners of the square patch
-        top_left_x = max(0, int(x - half_patch))
-        top_left_y = max(0, int(y - half_patch))
-        bottom_right_x = min(image_size[1], int(x + half_patch))
-        bottom_right_y = min(image_size[0], int(y + half_patch))
-
-        # Set the square patch to 1 in the mask
-        mask[top_left_y:bottom_right_y, top_left_x:bottom_right_x] = 1
-    # filling holes
-    # kernel = np.ones((9, 9), np.uint8)
-    #
-    # # Apply closing operation
-    # closed_mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-    #
-    # # Detect border pixels in the original mask
-    # border = cv2.filter2D(mask, -1, kernel)
-    # border_mask = (border >= 3) & (border < 8)
-    #
-    # # Restore the border pixels in the closed mask
-    # closed_mask[border_mask] = mask[border_mask]
-    return mask
-
 def get_image_mask_from_annotation(image_size,annotation,step):
-    image_mask = np.zeros(image_size)
-
-    for i in range(annotation.shape[0]):
-        for j in range(annotation.shape[1]):
-            patch_x = i * step
-            patch_y = j * step
-            image_mask[patch_x:patch_x + step, patch_y:patch_y + step] = annotation[i, j]
-    return image_mask
-
-def rectangles_intersect(rect1, rect2):
-    x1, y1, w1, h1 = rect1
-    x2, y2, w2, h2 = rect2
-
-    return not (x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1)
+    return upsample_blocks(annotation, step, image_size, dtype=float)
 
 def random_select_percentage_elements(input_array, percent_to_select):
     num_to_select = int((percent_to_select / 100) * input_array.shape[0])
@@ -3,32 +3,156 @@ import matplotlib.pyplot as plt
 from pix2pix.models import *
 from pix2pix.datasets import *
 import numpy as np
+import os
+import copy
 from dip.models.unet import UNet
 from dip.models.skip import skip
 import torch
 import torch.optim
 from dip.utils.inpainting_utils import *
 import seaborn as sns
+import yaml
+from omegaconf import OmegaConf
 from saicinpainting.training.trainers.default import DefaultInpaintingTrainingModule
 
 BASE_PATH = '/home/huifang/workspace/'
-def get_circle_Generator():
+EXPORT_DIR = './exported'
+
+def get_exported_path(name, backend, export_dir=EXPORT_DIR):
+    extensions = {'onnx': '.onnx', 'torchscript': '.pt', 'int8': '_int8.pth'}
+    return os.path.join(export_dir, name + extensions[backend])
+
+# Runs a generator exported by export_generators.py on the CPU, called like the
+# eager model. The eager model is kept for the memoized position encodings,
+# which the exported graphs take as a second input.
+class ExportedGenerator:
+    def __init__(self, generator, path, backend, num_threads=None):
+        self.generator = generator.eval()
+        self.backend = backend
+        num_threads = num_threads or os.cpu_count()
+        if backend == 'onnx':
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = num_threads
+            self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        else:
+            assert(backend == 'torchscript')
+            torch.set_num_threads(num_threads)
+            self.module = torch.jit.load(path, map_location='cpu')
+
+    def get_inputs(self, x):
+        x = x.detach().cpu().float()
+        if not hasattr(self.generator, 'pos_embed'):
+            return (x,)
+        return x, get_pos_encoding(self.generator, x.shape[2], x.shape[3]).detach().cpu()
+
+    def __call__(self, x):
+        inputs = self.get_inputs(x)
+        if self.backend == 'onnx':
+            names = [node.name for node in self.session.get_inputs()]
+            outputs = self.session.run(None, {name: value.numpy() for name, value in zip(names, inputs)})
+            outputs = tuple(torch.from_numpy(output) for output in outputs)
+        else:
+            with torch.no_grad():
+                outputs = self.module(*inputs)
+            outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        outputs = tuple(output.to(x.device) for output in outputs)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+    # the scripts call generator.eval() and generator.to(device) on any backend
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+# Static int8 wrapper of a UNetDown / UNetUp layer stack, the skip concatenation
+# of UNetUp stays in float
+class QuantizedStack(nn.Module):
+    def __init__(self, model):
+        super(QuantizedStack, self).__init__()
+        self.quant = torch.quantization.QuantStub()
+        self.model = model
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.model(self.quant(x)))
+
+# Copy of the generator with observers around the UNet layers, run calibration
+# images through it before convert_int8_generator
+def prepare_int8_generator(generator):
+    torch.backends.quantized.engine = 'fbgemm'
+    generator = copy.deepcopy(generator).cpu().eval()
+    for module in generator.modules():
+        if isinstance(module, (UNetDown, UNetUp)):
+            module.model = QuantizedStack(module.model)
+            if isinstance(module, UNetDown):
+                module.model.qconfig = torch.quantization.get_default_qconfig('fbgemm')
+            else:
+                # transposed convolutions only have per tensor weight observers
+                module.model.qconfig = torch.quantization.QConfig(
+                    activation=torch.quantization.get_default_qconfig('fbgemm').activation,
+                    weight=torch.quantization.default_weight_observer)
+    return torch.quantization.prepare(generator)
+
+# Static int8 UNet convolutions from the observers and dynamic int8 for every
+# nn.Linear of the attention blocks and heads. CPU only.
+def convert_int8_generator(generator):
+    generator = torch.quantization.convert(generator.eval())
+    return torch.quantization.quantize_dynamic(generator, {nn.Linear}, dtype=torch.qint8)
+
+# The quantized kernels only exist on the CPU. The int8 generator stays there when
+# the scripts move it to their device, inputs from any device run on the CPU and
+# the outputs go back to the device of the input.
+class Int8Generator(nn.Module):
+    def __init__(self, generator):
+        super(Int8Generator, self).__init__()
+        self.generator = generator
+
+    def forward(self, x):
+        with torch.no_grad():
+            outputs = self.generator(x.detach().cpu().float())
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        outputs = tuple(output.to(x.device) for output in outputs)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def cuda(self, device=None):
+        return self
+
+# backend is "torch" for the eager model, "onnx" / "torchscript" for the graphs
+# written by export_generators.py, or "int8" for the weights of quantize_generators.py
+def get_generator_backend(generator, name, backend="torch", num_threads=None):
+    if backend == "torch":
+        return generator
+    if backend == "int8":
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        # the quantized modules are rebuilt and then take the calibrated scales
+        generator = convert_int8_generator(prepare_int8_generator(generator))
+        generator.load_state_dict(torch.load(get_exported_path(name, backend), map_location='cpu'))
+        return Int8Generator(generator)
+    return ExportedGenerator(generator, get_exported_path(name, backend), backend, num_threads)
+
+def get_circle_Generator(backend="torch", num_threads=None):
     generator = Generator()
-    generator.load_state_dict(torch.load('/media/huifang/data/experiment/pix2pix/saved_models/final_circle_width2_unet_with_aug_mse/g_600.pth'))
+    generator.load_state_dict(torch.load('/media/huifang/data/experiment/pix2pix/saved_models/final_circle_width2_unet_with_aug_mse/g_600.pth', map_location='cpu'))
     # generator.load_state_dict(torch.load('/media/huifang/data/experiment/pix2pix/saved_models/width2_downsample_nocondition_lamda10_with_0.125negative/g_400.pth'))
 
     # generator = Dot_Generator()
     # generator.load_state_dict(torch.load(
     #     '/media/huifang/data/experiment/pix2pix/saved_models/transformer-dot-sigmoid-mse-5pe-noskip/g_800.pth'))
-    return generator
-def get_position_Generator():
+    return get_generator_backend(generator, 'circle', backend, num_threads)
+def get_position_Generator(backend="torch", num_threads=None):
     generator = Patch_Binary_Generator()
-    generator.load_state_dict(torch.load('/media/huifang/data/experiment/pix2pix/saved_models/binary-square-alltrain-5-pe/g_400.pth'))
+    generator.load_state_dict(torch.load('/media/huifang/data/experiment/pix2pix/saved_models/binary-square-alltrain-5-pe/g_400.pth', map_location='cpu'))
     # generator.load_state_dict(
     #     torch.load('/media/huifang/data/experiment/pix2pix/saved_models/binary-square-5pe-with-aug-nocrop/g_800.pth'))
-    return generator
+    return get_generator_backend(generator, 'position', backend, num_threads)
 
-def get_combined_Generator():
+def get_combined_Generator(backend="torch", num_threads=None):
     # generator = CNN_in_parrel_Generator()
     # generator.load_state_dict((torch.load(
     #     '/media/huifang/data/experiment/pix2pix/saved_models/auto_pure_cnn_0layer_with_binary_with_spatial/g_1400.pth')))
@@ -43,13 +167,50 @@ def get_combined_Generator():
     # generator.load_state_dict((torch.load(
     #     '/media/huifang/data/experiment/pix2pix/saved_models/auto_circle_binary_spatial_selected_mask_5layer_renewed/g_1600.pth')))
     generator.load_state_dict((torch.load(
-        '/media/huifang/data/experiment/pix2pix/saved_models/ground_truth_circle_only/g_600.pth')))
+        '/media/huifang/data/experiment/pix2pix/saved_models/ground_truth_circle_only/g_600.pth', map_location='cpu')))
 
     # generator.load_state_dict((torch.load(
     #     '/media/huifang/data/experiment/pix2pix/saved_models/auto_circle_binary_selected_mask_5layer/g_800.pth')))
 
 
-    return generator
+    return get_generator_backend(generator, 'combined', backend, num_threads)
+
+# Runs the generator once per group of images with the same size (the multiple
+# of 32 from get_image_var), at most max_batch images at a time. Returns the
+# output tuple of every image in input order, each with batch size 1.
+def run_generator_buckets(generator, image_vars, max_batch=8):
+    buckets = {}
+    for i, image_var in enumerate(image_vars):
+        buckets.setdefault(tuple(image_var.shape[1:]), []).append(i)
+    outputs = [None] * len(image_vars)
+    with torch.no_grad():
+        for indices in buckets.values():
+            for start in range(0, len(indices), max_batch):
+                chunk = indices[start:start + max_batch]
+                batch_outputs = generator(torch.cat([image_vars[i] for i in chunk]))
+                if not isinstance(batch_outputs, tuple):
+                    batch_outputs = (batch_outputs,)
+                for j, i in enumerate(chunk):
+                    outputs[i] = tuple(output[j:j + 1] for output in batch_outputs)
+    return outputs
+
+# The n most common generator input sizes (w, h) = x.shape[2:] of an image list,
+# with the multiple of 32 resize of get_image_var. Only the image headers are read.
+def get_common_image_sizes(image_list_path, n=8):
+    f = open(image_list_path, 'r')
+    files = f.readlines()
+    f.close()
+    counts = {}
+    for line in files:
+        width, height = Image.open(line.split(' ')[0].rstrip('\n')).size
+        size = (find_nearest_multiple_of_32(height), find_nearest_multiple_of_32(width))
+        counts[size] = counts.get(size, 0) + 1
+    return sorted(counts, key=counts.get, reverse=True)[:n]
+
+# Precomputes the position encodings of the common sizes of an image list, load
+# them with load_pos_encodings(generator, path) before inference
+def export_pos_encodings(generator, image_list_path, path, n=8):
+    save_pos_encodings(generator, get_common_image_sizes(image_list_path, n), path)
 
 def getInpainter(input_channel,output_channel):
 
@@ -172,6 +333,19 @@ def getLamaInpainter(train_config, path, map_location='cuda', strict=True):
     model.on_load_checkpoint(state)
     return model
 
+LAMA_PATH = '/home/huifang/workspace/code/lama/big-lama'
+
+# The predict-only big-lama setup shared by the remover scripts and the inference server
+def get_lama_inpainter(device, model_path=LAMA_PATH):
+    with open(model_path + '/config.yaml', 'r') as f:
+        train_config = OmegaConf.create(yaml.safe_load(f))
+    train_config.training_model.predict_only = True
+    train_config.visualizer.kind = 'noop'
+    inpainter = getLamaInpainter(train_config, model_path + '/models/best.ckpt', strict=False, map_location='cpu')
+    inpainter.freeze()
+    inpainter.to(device)
+    return inpainter
+
 
 
 
@@ -0,0 +1,109 @@
+import argparse
+import os
+import time
+import torch
+from cnn_io import get_circle_Generator, get_position_Generator, get_combined_Generator, get_exported_path, \
+    get_generator_backend, EXPORT_DIR
+from pix2pix.models import get_pos_encoding
+
+GENERATORS = {'circle': get_circle_Generator, 'position': get_position_Generator, 'combined': get_combined_Generator}
+
+
+# The attention generators take the position encoding as a second input, the
+# bicubic interpolation of pos_embed depends on the image size and cannot be traced.
+def get_example_inputs(generator, size, batch_size=1):
+    x = torch.rand(batch_size, 3, size[0], size[1]) * 2 - 1
+    if not hasattr(generator, 'pos_embed'):
+        return (x,)
+    return x, get_pos_encoding(generator, size[0], size[1]).detach().clone()
+
+
+def export_generator(generator, name, backend, size=(512, 512), export_dir=EXPORT_DIR):
+    generator.eval()
+    inputs = get_example_inputs(generator, size)
+    path = get_exported_path(name, backend, export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    with torch.no_grad():
+        if backend == 'torchscript':
+            torch.jit.trace(generator, inputs, check_trace=False).save(path)
+            return path
+        assert(backend == 'onnx')
+        outputs = generator(*inputs)
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        input_names = ['image', 'pos_embed'][:len(inputs)]
+        output_names = ['output_%d' % i for i in range(len(outputs))]
+        dynamic_axes = {'image': {0: 'batch', 2: 'height', 3: 'width'}, 'pos_embed': {1: 'patches'}}
+        for output_name, output in zip(output_names, outputs):
+            dynamic_axes[output_name] = {axis: output_name + '_%d' % axis for axis in range(output.dim())}
+        torch.onnx.export(generator, inputs, path, input_names=input_names, output_names=output_names,
+                          dynamic_axes={key: dynamic_axes[key] for key in input_names + output_names},
+                          opset_version=17)
+    return path
+
+
+def run_eager(generator, x):
+    with torch.no_grad():
+        outputs = generator(x)
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+def run_exported(runtime, x):
+    outputs = runtime(x)
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+# Largest absolute difference between the eager and the exported outputs per size
+def check_parity(generator, runtime, sizes):
+    errors = {}
+    for size in sizes:
+        x = get_example_inputs(generator, size)[0]
+        eager = run_eager(generator, x)
+        exported = run_exported(runtime, x)
+        assert len(eager) == len(exported)
+        errors[size] = max(float((a - b).abs().max()) for a, b in zip(eager, exported))
+    return errors
+
+
+# Mean seconds per image of the eager and the exported generator per size
+def benchmark(generator, runtime, sizes, repeats=5):
+    timings = {}
+    for size in sizes:
+        x = get_example_inputs(generator, size)[0]
+        timing = []
+        for run in (lambda: run_eager(generator, x), lambda: run_exported(runtime, x)):
+            run()
+            start_time = time.time()
+            for _ in range(repeats):
+                run()
+            timing.append((time.time() - start_time) / repeats)
+        timings[size] = tuple(timing)
+    return timings
+
+
+def parse_sizes(sizes):
+    return [tuple(int(v) for v in size.split('x')) for size in sizes.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='combined', choices=sorted(GENERATORS), help='generator to export')
+    parser.add_argument('--backend', type=str, default='onnx', choices=['onnx', 'torchscript'], help='export format')
+    parser.add_argument('--sizes', type=str, default='512x512,1024x1024,2048x2048',
+                        help='image sizes (multiples of 32) checked and benchmarked, the first one is traced')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='largest allowed output difference')
+    parser.add_argument('--repeats', type=int, default=5, help='runs per size in the benchmark')
+    parser.add_argument('--num_threads', type=int, default=None, help='runtime threads, all cores by default')
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    generator = GENERATORS[args.model]().eval()
+    path = export_generator(generator, args.model, args.backend, sizes[0])
+    print('Exported ' + args.model + ' to ' + path)
+
+    runtime = get_generator_backend(generator, args.model, args.backend, args.num_threads)
+    errors = check_parity(generator, runtime, sizes)
+    for size, error in errors.items():
+        print('%dx%d max abs error %.2e' % (size[0], size[1], error))
+    for size, (eager_time, exported_time) in benchmark(generator, runtime, sizes, args.repeats).items():
+        print('%dx%d eager %.3fs %s %.3fs' % (size[0], size[1], eager_time, args.backend, exported_time))
+    assert max(errors.values()) <= args.tolerance, 'Exported outputs differ from the eager model!'
@@ -7,7 +7,11 @@ from scipy.ndimage import gaussian_filter
 from scipy.optimize import minimize
 from scipy.ndimage import map_coordinates
 from cnn_io import *
+from inference_client import RemoteGenerator, RemoteInpainter
 from hough_utils import *
+from geo_utils.rectangle import largest_empty_rectangle
+from geo_utils.square import fit_square_to_mask
+from mask_utils import *
 from scipy.spatial.transform import Rotation as R
 from scipy import ndimage
 from backgroundremover.bg import remove
@@ -95,16 +99,6 @@ def segregate(img):
     overlay = label2rgb(labeled_mask, image=rgb_image, bg_label=0, alpha=0.5, kind='overlay')
     return overlay,num_features
 
-def get_image_mask_from_annotation(image_size,annotation,step):
-    image_mask = np.zeros(image_size)
-    for i in range(annotation.shape[0]):
-        for j in range(annotation.shape[1]):
-            patch_x = i * step
-            patch_y = j * step
-            image_mask[patch_x:patch_x + step, patch_y:patch_y + step] = annotation[i, j]
-    return image_mask
-
-
 def apply_gaussian_kernel(image, sigma=1.0):
     """
     Apply Gaussian kernel to the input image
@@ -196,6 +190,8 @@ def get_cnn_mask(img_var,circle_generator):
     cnn_mask = normalize_array(cnn_mask)
     return cnn_mask
 
+# The position masks stay on the grid of patch_size patches, run_masks upsamples
+# them to the image size once the cnn position mask is built block-wise
 def get_position_mask(img_var,position_generator, use_gaussian=True):
     position_var = position_generator(img_var)
     position = position_var.cpu().detach().numpy().squeeze()
@@ -203,14 +199,20 @@ def get_position_mask(img_var,position_generator, use_gaussian=True):
 
     if use_gaussian:
         position = apply_gaussian_kernel(position, sigma=1.5)
-    _, _, w, h = img_var.shape
-    position = get_image_mask_from_annotation([w, h], position, patch_size)
     position = normalize_array(position)
     return position.astype(np.float32)
 
 def get_circle_and_position_mask(img_var,generator,use_gaussian=True):
-    cnn_mask_var, position_var,attn_var = generator(img_var)
-    # cnn_mask_var = generator(img_var)
+    return get_circle_and_position_from_outputs(generator(img_var),use_gaussian)
+
+# Masks of several images, the images of the same size go through the generator
+# together in batches of at most max_batch
+def get_circle_and_position_masks(img_vars,generator,use_gaussian=True,max_batch=8):
+    outputs = run_generator_buckets(generator, img_vars, max_batch)
+    return [get_circle_and_position_from_outputs(output, use_gaussian) for output in outputs]
+
+def get_circle_and_position_from_outputs(outputs,use_gaussian=True):
+    cnn_mask_var, position_var = outputs[0], outputs[1]
     cnn_mask = cnn_mask_var.cpu().detach().numpy().squeeze()
     cnn_mask = np.transpose(cnn_mask, (0, 1))
     cnn_mask = binarize_array(cnn_mask, 0.5)
@@ -219,8 +221,6 @@ def get_circle_and_position_mask(img_var,generator,use_gaussian=True):
     position = np.transpose(position, (0, 1))
     if use_gaussian:
         position = apply_gaussian_kernel(position, sigma=0.8)
-    _, _, w, h = img_var.shape
-    position = get_image_mask_from_annotation([w, h], position, patch_size)
     position = normalize_array(position)
 
     # position = normalize_array(cnn_mask)
@@ -238,27 +238,6 @@ def morphological_closing(binary_mask):
 
     return opened_mask
 
-def get_binary_mask(network_mask):
- #   Apply Gaussian blur
-    blurred_mask = cv2.GaussianBlur(network_mask, (3, 3), 0)
-
-    threshold = 0.2  # This can be adjusted based on your observations
-    _, binary_mask = cv2.threshold(blurred_mask, threshold, 1, cv2.THRESH_BINARY)
-    binary_mask = binary_mask.astype(np.uint8)
-    return binary_mask
-
-def get_cnn_position_mask(cnn_mask,position):
-
-    cnn_position_mask = cnn_mask*position
-    # cnn_position_mask = cnn_mask
-    binary_mask = get_binary_mask(cnn_position_mask)
-    # final_mask = morphological_closing(binary_mask)
-
-    # plt.imshow(1 - binary_mask, cmap='gray')
-    # plt.show()
-    return binary_mask
-
-
 def get_inpainting_result(inpainter_image,mask):
     mask = torch.from_numpy(mask).unsqueeze(0).unsqueeze(0).to(device)
     inpainter_image_var = torch.from_numpy(inpainter_image).unsqueeze(0).to(device)
@@ -308,10 +287,18 @@ def fit_points_to_square(points):
         [avg_center[0] - avg_side / 2, avg_center[1] + avg_side / 2]
     ])
     return central_square
-def run_geometric(img,position,run_square=True,return_radius=False):
-    circles = run_circle_threhold(img, 10, circle_threshold=20, step=5)
-    re_r = statistics.mode(circles[:,2])
-    circles = run_circle_threhold(img, re_r, circle_threshold=int(2*re_r), step=3)
+# pyramid_scale < 1 finds the radius and rough centers at that scale (0.5 or 0.25)
+# and only refines windows around them at full resolution
+def run_geometric(img,position,run_square=True,return_radius=False,pyramid_scale=1):
+    if pyramid_scale < 1:
+        circles, re_r = run_circle_pyramid(img, 10, circle_threshold=20, step=5, scale=pyramid_scale)
+    else:
+        # both passes share the edge map and the vote planes of the overlapping radii,
+        # the first pass votes for 10 radii
+        session = HoughSession(img, max_planes=10)
+        circles = session.detect(10, circle_threshold=20, step=5)
+        re_r = statistics.mode(circles[:,2])
+        circles = session.detect(re_r, circle_threshold=int(2*re_r), step=3)
     new_circles=[]
     for x,y,r in circles:
         # if position[y,x]>0.1:
@@ -332,68 +319,6 @@ def run_geometric(img,position,run_square=True,return_radius=False):
             return circles, hough_mask
 
 
-def objective_function(params, mask):
-    cx, cy, s = params
-    s = abs(s)  # Ensure positive side length
-    coords = np.array([
-        [cx - s / 2, cy - s / 2],
-        [cx + s / 2, cy - s / 2],
-        [cx + s / 2, cy + s / 2],
-        [cx - s / 2, cy + s / 2]
-    ])
-
-    num_points = 100
-    edge_points = []
-    for i in range(4):
-        x_vals = np.linspace(coords[i, 0], coords[(i + 1) % 4, 0], num_points)
-        y_vals = np.linspace(coords[i, 1], coords[(i + 1) % 4, 1], num_points)
-        edge_points.append(np.vstack([x_vals, y_vals]))
-    edge_points = np.hstack(edge_points)
-
-
-    values = map_coordinates(mask, edge_points, order=1, mode='constant')
-    return -np.mean(values)
-
-def fit_square_to_mask(mask):
-    kernel_size = 5  # Adjust based on your requirement
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    pad_size = 10  # Adjust as needed
-
-    # Perform padding
-    padded_mask = cv2.copyMakeBorder(mask, pad_size, pad_size, pad_size, pad_size, cv2.BORDER_CONSTANT, value=0)
-
-    # Perform erosion on padded mask
-    eroded_mask = cv2.erode(padded_mask, kernel, iterations=3)
-
-    # Optionally, remove padding from the eroded mask if required
-    eroded_mask = eroded_mask[pad_size:-pad_size, pad_size:-pad_size]
-    # plt.imshow(eroded_mask)
-    # plt.show()
-
-    # Threshold the mask
-    threshold = 0.5  # or any value that you find suitable
-    _, thresh_mask = cv2.threshold(eroded_mask, threshold, 0.5, cv2.THRESH_BINARY)
-
-    # Find contours
-    contours, _ = cv2.findContours((thresh_mask * 255).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        raise ValueError("No contours found!")
-
-    # Get a bounding box around the detected contour
-    x, y, w, h = cv2.boundingRect(np.vstack(contours))
-
-    # Set initial parameters
-    initial_params = [x + w / 2, y + h / 2, min(w, h)]  # corrected the side length
-
-    # Run the optimization
-    # Use a Gaussian kernel to weigh the contributions of neighboring pixels
-    sigma = 1.5  # Standard deviation of the Gaussian kernel, adjust as needed
-    gaussian_mask = gaussian_filter(mask, sigma=sigma)
-    result = minimize(objective_function, initial_params, args=(gaussian_mask,), method='Nelder-Mead')
-    cx, cy, s = result.x
-    return [cx, cy, s]
-
-
 def transform_points(points, tx, ty, scale_x, scale_y, angle):
     scaling_matrix = np.array([[scale_x, 0], [0, scale_y]])
     rotation_matrix = R.from_euler('z', angle, degrees=True).as_matrix()[:2, :2]
@@ -407,7 +332,9 @@ def split_array(arr, cond):
   return arr[cond], arr[~cond]
 
 
-def process_and_visualize_mask(mask):
+# method: "erode" peels the mask in steps of 16 pixels, "exact" finds the largest
+# empty rectangle inside the frame instead
+def process_and_visualize_mask(mask, method="erode"):
     # Find the smallest rectangle that contains all the 1's
     y_indices, x_indices = np.where(mask == 1)
     x_min, x_max, y_min, y_max = np.min(x_indices), np.max(x_indices), np.min(y_indices), np.max(y_indices)
@@ -415,6 +342,18 @@ def process_and_visualize_mask(mask):
     # Crop the mask to the smallest rectangle
     cropped_mask = mask[y_min:y_max + 1, x_min:x_max + 1].copy()
 
+    if method == "exact":
+        r0, c0, r1, c1 = largest_empty_rectangle(cropped_mask != 0)
+        if r1 < r0:
+            raise ValueError("No empty rectangle found!")
+        inner_x_min, inner_y_min, inner_x_max, inner_y_max = x_min + c0, y_min + r0, x_min + c1, y_min + r1
+        rec1 = (x_min, y_min, inner_x_min, inner_y_max)
+        rec2 = (inner_x_min, y_min, x_max, inner_y_min)
+        rec3 = (inner_x_max, inner_y_min, x_max, y_max)
+        rec4 = (x_min, inner_y_max, inner_x_max, y_max)
+        return [rec1, rec2, rec3, rec4]
+    assert(method == "erode")
+
     # Erode the mask incrementally and find the largest rectangle that contains only 0's
     step = 16 # Define step size for eroding
     last_non_empty = cropped_mask.copy()
@@ -523,7 +462,7 @@ def divide_cytassist_and_process(image_name):
                 img_np[mid_h:, :mid_w,:], img_np[mid_h:, mid_w:,:]]
 
     # Process each patch and store the 5 results
-    results = [run(var_patch,np_patch) for var_patch,np_patch in zip(var_patches,np_patches)]
+    results = run_batch(var_patches,np_patches)
 
     # Stack results of the same type from each patch
     final_results = []
@@ -547,7 +486,14 @@ def run(image_var,image_np,recovery=True):
     # position = get_position_mask(img_var,use_gaussian=True)
 
     cnn_mask, position = get_circle_and_position_mask(image_var,generator,use_gaussian=True)
+    return run_masks(cnn_mask,position,image_np,recovery)
 
+# run for several images, the generator runs once per batch of same size images
+def run_batch(image_vars,image_nps,recovery=True,max_batch=8):
+    masks = get_circle_and_position_masks(image_vars,generator,use_gaussian=True,max_batch=max_batch)
+    return [run_masks(cnn_mask,position,image_np,recovery) for (cnn_mask,position),image_np in zip(masks,image_nps)]
+
+def run_masks(cnn_mask,position,image_np,recovery=True):
 
     # position = binarize_array(position,0.6)
     # cnn_mask = get_binary_mask(cnn_mask)
@@ -564,7 +510,7 @@ def run(image_var,image_np,recovery=True):
     # s = abs(s)
 
     # single_cnn_position_mask = get_cnn_position_mask(single_cnn_mask ,position)
-    cnn_position_mask = get_cnn_position_mask(cnn_mask, position)
+    cnn_mask, position, cnn_position_mask = get_image_masks(cnn_mask, position, patch_size)
     # cnn_mask_circles, cnn_mask_circle_figure, radius = run_geometric(cnn_mask,position, run_square=False,
     #                                                                   return_radius=True)
     # cnn_mask=cnn_mask_circle_figure
@@ -598,6 +544,7 @@ parser.add_argument('--pack_size', type=int, default=4, help='size of deep a ima
 parser.add_argument('--img_height', type=int, default=32, help='size of image height')
 parser.add_argument('--img_width', type=int, default=32, help='size of image width')
 parser.add_argument('--channel', type=int, default=3, help='number of image channel')
+parser.add_argument('--server', type=str, default='', help='address of a running inference_server, the models are not loaded here')
 args = parser.parse_args()
 os.makedirs('./test/', exist_ok=True)
 
@@ -618,20 +565,15 @@ Tensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
 # # Initialize position generator
 # position_generator = get_position_Generator()
 # position_generator.to(device)
-generator = get_combined_Generator()
-generator.eval()
-generator.to(device)
-# Initial image inpainter
-inpainter_model_path = '/home/huifang/workspace/code/lama/big-lama'
-train_config_path = inpainter_model_path+'/config.yaml'
-with open(train_config_path, 'r') as f:
-    train_config = OmegaConf.create(yaml.safe_load(f))
-
-train_config.training_model.predict_only = True
-train_config.visualizer.kind = 'noop'
-inpainter = getLamaInpainter(train_config,inpainter_model_path+'/models/best.ckpt', strict=False, map_location='cpu')
-inpainter.freeze()
-inpainter.to(device)
+if args.server:
+    generator = RemoteGenerator(args.server)
+    inpainter = RemoteInpainter(args.server)
+else:
+    generator = get_combined_Generator()
+    generator.eval()
+    generator.to(device)
+    # Initial image inpainter
+    inpainter = get_lama_inpainter(device)
 # ------ main process -------
 # manage input
 patch_size = 32
@@ -12,7 +12,10 @@ from scipy.ndimage import gaussian_filter
 from scipy.optimize import minimize
 from scipy.ndimage import map_coordinates
 from cnn_io import *
+from inference_client import RemoteGenerator, RemoteInpainter
 from hough_utils import *
+from geo_utils.rectangle import largest_empty_rectangle
+from pix2pix.patch_annotation import upsample_blocks
 from scipy.spatial.transform import Rotation as R
 import numpy as np
 from scipy import ndimage
@@ -24,13 +27,7 @@ from concurrent.futures import ThreadPoolExecutor
 Image.MAX_IMAGE_PIXELS = 3000000000
 import cv2
 def get_image_mask_from_annotation(image_size,annotation,step):
-    image_mask = np.zeros(image_size)
-    for i in range(annotation.shape[0]):
-        for j in range(annotation.shape[1]):
-            patch_x = i * step
-            patch_y = j * step
-            image_mask[patch_x:patch_x + step, patch_y:patch_y + step] = annotation[i, j]
-    return image_mask
+    return upsample_blocks(annotation, step, image_size, dtype=float)
 
 
 def apply_gaussian_kernel(image, sigma=1.0):
@@ -206,7 +203,9 @@ def split_array(arr, cond):
   return arr[cond], arr[~cond]
 
 
-def process_and_visualize_mask(mask):
+# method: "erode" peels the mask in steps of 16 pixels, "exact" finds the largest
+# empty rectangle inside the frame instead
+def process_and_visualize_mask(mask, method="erode"):
     # Find the smallest rectangle that contains all the 1's
     y_indices, x_indices = np.where(mask == 1)
     x_min, x_max, y_min, y_max = np.min(x_indices), np.max(x_indices), np.min(y_indices), np.max(y_indices)
@@ -214,6 +213,18 @@ def process_and_visualize_mask(mask):
     # Crop the mask to the smallest rectangle
     cropped_mask = mask[y_min:y_max + 1, x_min:x_max + 1].copy()
 
+    if method == "exact":
+        r0, c0, r1, c1 = largest_empty_rectangle(cropped_mask != 0)
+        if r1 < r0:
+            raise ValueError("No empty rectangle found!")
+        inner_x_min, inner_y_min, inner_x_max, inner_y_max = x_min + c0, y_min + r0, x_min + c1, y_min + r1
+        rec1 = (x_min, y_min, inner_x_min, inner_y_max)
+        rec2 = (inner_x_min, y_min, x_max, inner_y_min)
+        rec3 = (inner_x_max, inner_y_min, x_max, y_max)
+        rec4 = (x_min, inner_y_max, inner_x_max, y_max)
+        return [rec1, rec2, rec3, rec4]
+    assert(method == "erode")
+
     # Erode the mask incrementally and find the largest rectangle that contains only 0's
     step = 16 # Define step size for eroding
     last_non_empty = cropped_mask.copy()
@@ -435,6 +446,7 @@ parser.add_argument('--pack_size', type=int, default=4, help='size of deep a ima
 parser.add_argument('--img_height', type=int, default=32, help='size of image height')
 parser.add_argument('--img_width', type=int, default=32, help='size of image width')
 parser.add_argument('--channel', type=int, default=3, help='number of image channel')
+parser.add_argument('--server', type=str, default='', help='address of a running inference_server, the models are not loaded here')
 args = parser.parse_args()
 os.makedirs('./test/', exist_ok=True)
 
@@ -449,20 +461,15 @@ else:
 Tensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
 
 # ------ Configure model -------
-generator = get_combined_Generator()
-generator.eval()
-generator.to(device)
-# Initial image inpainter
-inpainter_model_path = '/home/huifang/workspace/code/lama/big-lama'
-train_config_path = inpainter_model_path+'/config.yaml'
-with open(train_config_path, 'r') as f:
-    train_config = OmegaConf.create(yaml.safe_load(f))
-
-train_config.training_model.predict_only = True
-train_config.visualizer.kind = 'noop'
-inpainter = getLamaInpainter(train_config,inpainter_model_path+'/models/best.ckpt', strict=False, map_location='cpu')
-inpainter.freeze()
-inpainter.to(device)
+if args.server:
+    generator = RemoteGenerator(args.server)
+    inpainter = RemoteInpainter(args.server)
+else:
+    generator = get_combined_Generator()
+    generator.eval()
+    generator.to(device)
+    # Initial image inpainter
+    inpainter = get_lama_inpainter(device)
 # ------ main process -------
 # manage input
 transforms_rgb = transforms.Compose([transforms.ToTensor(),
@@ -474,11 +481,18 @@ tiff_image_path = '/media/huifang/data/fiducial/tiff/Visium_Mouse_Olfactory_Bulb
 tiff_image = plt.imread(tiff_image_path)
 
 
-img_var,_ = get_image_var(high_res_image_path)
+img_var,img_np = get_image_var(high_res_image_path)
 cnn_mask = get_circle_and_position_mask(img_var,generator)
 zoom_factors = (tiff_image.shape[0] / cnn_mask.shape[0], tiff_image.shape[1] / cnn_mask.shape[1])
 cnn_mask = zoom(cnn_mask, zoom_factors, order=0)
 save_gray_image(cnn_mask,tiff_image_path[:-4]+'_mask.tif')
+# full resolution fiducial circles: the radius is found on the hires image and
+# scaled to the tiff, the tiled detector never builds a tiff sized accumulator
+hires_circles = run_circle_threhold(cv2.cvtColor(img_np[:, :, :3], cv2.COLOR_RGB2GRAY), 10, circle_threshold=20, step=5)
+tiff_radius = int(round(statistics.mode(hires_circles[:, 2]) * zoom_factors[0]))
+tiff_gray = cv2.cvtColor(tiff_image[:, :, :3], cv2.COLOR_RGB2GRAY)
+tiff_circles = run_circle_threhold_tiled(tiff_gray, tiff_radius, circle_threshold=int(2 * tiff_radius), step=3)
+np.save(tiff_image_path[:-4]+'_circles.npy', tiff_circles)
 print('done')
 test = input()
 
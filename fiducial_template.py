@@ -0,0 +1,95 @@
+from __future__ import division
+import functools
+import os
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Bump when the stored fields change, older files are rebuilt instead of loaded.
+TEMPLATE_VERSION = 1
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template')
+
+
+def get_template_path(name):
+    return os.path.join(TEMPLATE_DIR, name + '.npz')
+
+
+# Dense grid over the template where every cell holds the index of the circle in
+# it or -1. Cells are half the lattice spacing, so no cell holds two circles.
+def build_cell_table(xy, cell_size):
+    origin = xy.min(axis=0) - cell_size
+    cells = np.floor((xy - origin) / cell_size).astype(np.int64)
+    table = -np.ones(cells.max(axis=0) + 2, dtype=np.int32)
+    assert(np.unique(cells, axis=0).shape[0] == xy.shape[0])
+    table[cells[:, 0], cells[:, 1]] = np.arange(xy.shape[0])
+    return origin, table
+
+
+def save_template(name, circles_f, framecenter_x, framecenter_y, square_scale):
+    circles_f = np.asarray(circles_f, dtype=np.float64).reshape(-1, 3)
+    distance, _ = cKDTree(circles_f[:, :2]).query(circles_f[:, :2], k=2)
+    spacing = np.median(distance[:, 1])
+    origin, table = build_cell_table(circles_f[:, :2], 0.5 * spacing)
+    np.savez_compressed(get_template_path(name), version=TEMPLATE_VERSION, circles=circles_f,
+                        frame=np.array([framecenter_x, framecenter_y, square_scale], dtype=np.float64),
+                        spacing=spacing, cell_origin=origin, cell_table=table)
+    load_template.cache_clear()
+
+
+class FiducialTemplate:
+    def __init__(self, name, circles, frame, spacing, cell_origin, cell_table):
+        self.name = name
+        self.circles = circles
+        self.framecenter_x, self.framecenter_y, self.square_scale = frame
+        self.spacing = spacing
+        self.cell_size = 0.5 * spacing
+        self.cell_origin = cell_origin
+        self.cell_table = cell_table
+        self.circles.flags.writeable = False
+
+    # KD-tree of the template circles, built on first use. load_template caches the
+    # template per name, so the tree is built once per process.
+    @functools.cached_property
+    def tree(self):
+        return cKDTree(self.circles[:, :2])
+
+    # Same tuple as fiducial_utils.mouse_para, callers scale the circles in place
+    # so they get a copy.
+    def get_para(self):
+        return self.circles.copy(), self.framecenter_x, self.framecenter_y, self.square_scale
+
+    # Index of the template circle within distance of every point, -1 if none.
+    # Only the 3 x 3 cells around a point are read, distance is capped at one cell.
+    def match(self, points, distance=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        distance = self.cell_size if distance is None else min(distance, self.cell_size)
+        cells = np.floor((points - self.cell_origin) / self.cell_size).astype(np.int64)
+        best = -np.ones(points.shape[0], dtype=np.int64)
+        best_distance = np.full(points.shape[0], np.inf)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cx = cells[:, 0] + dx
+                cy = cells[:, 1] + dy
+                inside = (cx >= 0) & (cx < self.cell_table.shape[0]) & (cy >= 0) & (cy < self.cell_table.shape[1])
+                index = -np.ones(points.shape[0], dtype=np.int64)
+                index[inside] = self.cell_table[cx[inside], cy[inside]]
+                found = index >= 0
+                d = np.full(points.shape[0], np.inf)
+                d[found] = np.linalg.norm(points[found] - self.circles[index[found], :2], axis=1)
+                better = (d <= distance) & (d < best_distance)
+                best[better] = index[better]
+                best_distance[better] = d[better]
+        return best
+
+
+# Loaded once per process and name. Raises FileNotFoundError when the template has
+# not been built, see fiducial_utils.get_template.
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+    path = get_template_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError("No fiducial template " + path + " !")
+    data = np.load(path)
+    if int(data['version']) != TEMPLATE_VERSION:
+        raise FileNotFoundError("Fiducial template " + path + " is outdated !")
+    return FiducialTemplate(name, data['circles'], data['frame'], float(data['spacing']),
+                            data['cell_origin'], data['cell_table'])
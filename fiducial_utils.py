@@ -5,6 +5,7 @@ from PIL import Image
 import os
 import seaborn as sns
 from hough_utils import *
+import fiducial_template
 F_RADIUS = 15
 
 def get_fiducial_template():
@@ -72,19 +73,30 @@ def get_aligned_fiducial(path):
     # plt.show()
     return img_f, scale
 
-def mouse_para():
-    circle_path = './template/mouse_circles_f.txt'
-    square_path = './template/mouse_square_f.txt'
-
-    if not os.path.exists(circle_path):
-        circles_f, framecenter_x, framecenter_y, square_scale = runSquare(
-            '/home/huifang/workspace/data/mouse/posterior_v1/spatial/aligned_fiducials.jpg')
-        np.savetxt(circle_path, circles_f)
-        np.savetxt(square_path, np.array([framecenter_x, framecenter_y, square_scale]))
-    else:
+# Aligned fiducial images the templates are built from, one per slide type. Other
+# slide types are added with get_template(name, fiducial_path).
+TEMPLATE_SOURCES = {
+    'mouse': '/home/huifang/workspace/data/mouse/posterior_v1/spatial/aligned_fiducials.jpg',
+}
+
+def get_template(name, fiducial_path=None):
+    try:
+        return fiducial_template.load_template(name)
+    except FileNotFoundError:
+        pass
+    circle_path = os.path.join(fiducial_template.TEMPLATE_DIR, name + '_circles_f.txt')
+    square_path = os.path.join(fiducial_template.TEMPLATE_DIR, name + '_square_f.txt')
+    if fiducial_path is None and os.path.exists(circle_path):
+        # convert the text files of older checkouts
         circles_f = np.loadtxt(circle_path)
         [framecenter_x, framecenter_y, square_scale] = np.loadtxt(square_path)
-    return circles_f, framecenter_x, framecenter_y, square_scale
+    else:
+        circles_f, framecenter_x, framecenter_y, square_scale = runSquare(fiducial_path or TEMPLATE_SOURCES[name])
+    fiducial_template.save_template(name, circles_f, framecenter_x, framecenter_y, square_scale)
+    return fiducial_template.load_template(name)
+
+def mouse_para():
+    return get_template('mouse').get_para()
 
 def runCircle(fiducial_path):
     aligned_fiducials, scale = get_aligned_fiducial(fiducial_path)
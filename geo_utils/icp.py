@@ -1,4 +1,5 @@
 import numpy as np
+from scipy.spatial import cKDTree
 from sklearn.neighbors import NearestNeighbors
 
 def rotation_matrix(axis, theta):
@@ -73,64 +74,144 @@ def nearest_neighbor(src, dst, same_shape=True):
     return distances.ravel(), indices.ravel()
 
 
-def icp(A, B, init_pose=None, max_iterations=20, tolerance=0.001):
+def icp(A, B, init_pose=None, max_iterations=20, tolerance=0.001, transform_tolerance=0, tree=None):
     '''
     The Iterative Closest Point method: finds best-fit transform that maps points A on to points B
     Input:
         A: Nxm numpy array of source mD points
-        B: Nxm numpy array of destination mD point
+        B: Mxm numpy array of destination mD point
         init_pose: (m+1)x(m+1) homogeneous transformation
         max_iterations: exit algorithm after max_iterations
         tolerance: convergence criteria
+        transform_tolerance: also stop once the update moves no entry of the transform more than this
+        tree: cKDTree of B, built once and reused by calls with the same destination
     Output:
         T: final homogeneous transformation that maps A on to B
         distances: Euclidean distances (errors) of the nearest neighbor
         i: number of iterations to converge
     '''
 
-    assert A.shape == B.shape
+    if tree is None:
+        tree = cKDTree(B)
 
     # get number of dimensions
     m = A.shape[1]
+    dst = tree.data
 
-    # make points homogeneous, copy them to maintain the originals
-    src = np.ones((m + 1, A.shape[0]))
-    dst = np.ones((m + 1, B.shape[0]))
-    src[:m, :] = np.copy(A.T)
-    dst[:m, :] = np.copy(B.T)
+    # make points homogeneous in preallocated buffers, the source is moved in place
+    src = np.ones((m + 1, A.shape[0]), dtype=np.float32)
+    moved = np.empty_like(src)
+    src[:m, :] = A.T
+    identity = np.identity(m + 1)
 
     # apply the initial pose estimation
     if init_pose is not None:
-        src = np.dot(init_pose, src)
+        np.dot(init_pose.astype(np.float32), src, out=moved)
+        src, moved = moved, src
 
     prev_error = 0
 
     for i in range(max_iterations):
         # find the nearest neighbors between the current source and destination points
-        distances, indices = nearest_neighbor(src[:m, :].T, dst[:m, :].T)
+        distances, indices = tree.query(src[:m, :].T)
 
         # compute the transformation between the current source and nearest destination points
-        T, _, _ = best_fit_transform(src[:m, :].T, dst[:m, indices].T)
+        T, _, _ = best_fit_transform(src[:m, :].T, dst[indices])
 
         # update the current source
-        src = np.dot(T, src)
+        np.dot(T.astype(np.float32), src, out=moved)
+        src, moved = moved, src
 
         # check error
         mean_error = np.mean(distances)
-        if np.abs(prev_error - mean_error) < tolerance:
+        if np.abs(prev_error - mean_error) < tolerance or np.abs(T - identity).max() < transform_tolerance:
             break
         prev_error = mean_error
 
     # calculate final transformation
-    T, _, _ = best_fit_transform(A, src[:m, :].T)
+    T, _, _ = best_fit_transform(A, src[:m, :].T.astype(np.float64))
 
     return T, mean_error
 
 
-# B:source A:target
-def get_icp_transformation(A, B):
+def get_pair_transforms(a0, a1, b0, b1):
+    '''
+    Rigid 2D transforms that map every point pair (a0, a1) on to the pair (b0, b1)
+    Input:
+        a0, a1, b0, b1: Nx2 numpy arrays
+    Returns:
+        T: Nx3x3 homogeneous transformation matrices
+    '''
+    va = a1 - a0
+    vb = b1 - b0
+    angle = np.arctan2(vb[:, 1], vb[:, 0]) - np.arctan2(va[:, 1], va[:, 0])
+    T = np.zeros((a0.shape[0], 3, 3))
+    T[:, 0, 0] = np.cos(angle)
+    T[:, 0, 1] = -np.sin(angle)
+    T[:, 1, 0] = np.sin(angle)
+    T[:, 1, 1] = np.cos(angle)
+    T[:, 2, 2] = 1
+    T[:, :2, 2] = b0 - np.einsum('nij,nj->ni', T[:, :2, :2], a0)
+    return T
+
+
+def ransac_pose(A, B, inlier_distance, n_hypotheses=2000, n_neighbors=4, max_angle=np.pi / 8, tree=None, seed=0,
+                chunk=256):
+    '''
+    Robust initial pose for icp. A point of A with its nearest neighbour and a point of B with one of its
+    n_neighbors nearest neighbours give a rigid hypothesis, and the hypothesis that moves the most points
+    of A within inlier_distance of B wins. Pairs of different length and rotations above max_angle are
+    skipped, lattices are symmetric so A has to be roughly oriented already
+    Input:
+        A: Nx2 numpy array of source points
+        B: Mx2 numpy array of destination points
+        inlier_distance: distance under which a moved point of A counts as an inlier
+        n_hypotheses: number of sampled hypotheses, the cost is linear in it
+        max_angle: largest rotation in radians
+        tree: cKDTree of B
+        seed: seed of the sampling, the result is deterministic for a seed
+        chunk: number of hypotheses scored at once
+    Output:
+        T: 3x3 homogeneous transformation that maps A on to B
+        inliers: number of inliers of T
+    '''
+    if tree is None:
+        tree = cKDTree(B)
+    B = tree.data
+    if A.shape[0] < 2 or B.shape[0] < 2:
+        return np.identity(3), 0
+    rng = np.random.default_rng(seed)
+    n_neighbors = min(n_neighbors, B.shape[0] - 1)
+
+    _, a_next = cKDTree(A).query(A, k=2)
+    _, b_next = tree.query(B, k=n_neighbors + 1)
+    i = rng.integers(A.shape[0], size=n_hypotheses)
+    j = rng.integers(B.shape[0], size=n_hypotheses)
+    k = rng.integers(1, n_neighbors + 1, size=n_hypotheses)
+    va = A[a_next[i, 1]] - A[i]
+    vb = B[b_next[j, k]] - B[j]
+    T = get_pair_transforms(A[i], A[a_next[i, 1]], B[j], B[b_next[j, k]])
+    valid = (np.abs(np.linalg.norm(va, axis=1) - np.linalg.norm(vb, axis=1)) < inlier_distance) & \
+            (np.abs(np.arctan2(T[:, 1, 0], T[:, 0, 0])) <= max_angle)
+    T = T[valid]
+    if T.shape[0] == 0:
+        return np.identity(3), 0
+
+    inliers = np.zeros(T.shape[0], dtype=np.int64)
+    for start in range(0, T.shape[0], chunk):
+        T_chunk = T[start:start + chunk]
+        moved = np.einsum('nij,pj->npi', T_chunk[:, :2, :2], A) + T_chunk[:, np.newaxis, :2, 2]
+        distances, _ = tree.query(moved.reshape(-1, 2), distance_upper_bound=inlier_distance, workers=-1)
+        inliers[start:start + chunk] = np.isfinite(distances).reshape(T_chunk.shape[0], -1).sum(axis=1)
+    best = np.argmax(inliers)
+    return T[best], inliers[best]
+
+
+# B:source A:target, tree: optional cKDTree of A
+def get_icp_transformation(A, B, tree=None, init_pose=None):
     # Run ICP
-    T, mean_error = icp(B, A, max_iterations=100, tolerance=0.000001)
+    T, mean_error = icp(B, A, init_pose=init_pose, max_iterations=100, tolerance=0.000001, transform_tolerance=1e-6,
+                        tree=tree)
     return T, mean_error
 def apply_icp_transformation(source,T):
     # Make a copy of circle centers
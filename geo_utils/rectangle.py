@@ -0,0 +1,38 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def largest_empty_rectangle(occupied):
+    '''
+    Largest axis-aligned rectangle without occupied pixels, with the histogram and stack method in O(H*W)
+    Input:
+        occupied: HxW boolean numpy array
+    Output:
+        r0, c0, r1, c1: first and last row and column of the rectangle, r1 < r0 when every pixel is occupied
+    '''
+    rows, cols = occupied.shape
+    heights = np.zeros(cols + 1, dtype=np.int64)
+    stack = np.zeros(cols + 1, dtype=np.int64)
+    best_area = 0
+    best = (0, 0, -1, -1)
+    for r in range(rows):
+        for c in range(cols):
+            if occupied[r, c]:
+                heights[c] = 0
+            else:
+                heights[c] += 1
+        # heights[cols] stays 0 and empties the stack at the end of the row
+        top = 0
+        for c in range(cols + 1):
+            while top > 0 and heights[stack[top - 1]] >= heights[c]:
+                height = heights[stack[top - 1]]
+                top -= 1
+                left = stack[top - 1] + 1 if top > 0 else 0
+                area = height * (c - left)
+                if area > best_area:
+                    best_area = area
+                    best = (r - height + 1, left, r, c - 1)
+            stack[top] = c
+            top += 1
+    return best
@@ -0,0 +1,118 @@
+import numpy as np
+import cv2
+from scipy.ndimage import gaussian_filter, map_coordinates
+from scipy.optimize import minimize
+
+
+def objective_function(params, mask):
+    cx, cy, s = params
+    s = abs(s)  # Ensure positive side length
+    coords = np.array([
+        [cx - s / 2, cy - s / 2],
+        [cx + s / 2, cy - s / 2],
+        [cx + s / 2, cy + s / 2],
+        [cx - s / 2, cy + s / 2]
+    ])
+
+    num_points = 100
+    edge_points = []
+    for i in range(4):
+        x_vals = np.linspace(coords[i, 0], coords[(i + 1) % 4, 0], num_points)
+        y_vals = np.linspace(coords[i, 1], coords[(i + 1) % 4, 1], num_points)
+        edge_points.append(np.vstack([x_vals, y_vals]))
+    edge_points = np.hstack(edge_points)
+
+
+    values = map_coordinates(mask, edge_points, order=1, mode='constant')
+    return -np.mean(values)
+
+# Mean mask value along the border of the squares with top left corners (x0, y0) and
+# side lengths side, from cumulative sums along the rows and the columns.
+def get_square_border_scores(row_sums, col_sums, x0, y0, side):
+    x1 = x0 + side
+    y1 = y0 + side
+    top = row_sums[y0, x1 + 1] - row_sums[y0, x0]
+    bottom = row_sums[y1, x1 + 1] - row_sums[y1, x0]
+    left = col_sums[y1 + 1, x0] - col_sums[y0, x0]
+    right = col_sums[y1 + 1, x1] - col_sums[y0, x1]
+    return (top + bottom + left + right) / (4 * (side + 1))
+
+# Grid search over integer squares around initial_params = (cx, cy, s), every square
+# is scored in O(1). A coarse pass is followed by a pass at one pixel.
+def fit_square_with_integral(mask, initial_params, search=0.2):
+    cx, cy, s = initial_params
+    coarse = max(int(s // 50), 1)
+    extent = int(np.ceil(search * s)) + coarse
+    x0 = int(round(cx - s / 2))
+    y0 = int(round(cy - s / 2))
+    side = int(round(s))
+
+    # only the window the squares can reach is summed, zeros outside the mask play
+    # the role of mode='constant' in map_coordinates. The one pixel pass can step
+    # another coarse pixels past the coarse window, on both the corner and the side.
+    lo_x, lo_y = x0 - 2 * extent - coarse, y0 - 2 * extent - coarse
+    size = side + 4 * extent + 4 * coarse + 2
+    window = np.zeros((size, size))
+    rows = slice(max(lo_y, 0), min(lo_y + size, mask.shape[0]))
+    cols = slice(max(lo_x, 0), min(lo_x + size, mask.shape[1]))
+    if rows.stop > rows.start and cols.stop > cols.start:
+        window[rows.start - lo_y:rows.stop - lo_y, cols.start - lo_x:cols.stop - lo_x] = mask[rows, cols]
+    row_sums = np.zeros((size, size + 1))
+    row_sums[:, 1:] = np.cumsum(window, axis=1)
+    col_sums = np.zeros((size + 1, size))
+    col_sums[1:, :] = np.cumsum(window, axis=0)
+
+    x0, y0 = x0 - lo_x, y0 - lo_y
+    for stride, reach in [(coarse, extent), (1, coarse)]:
+        offsets = np.arange(-reach, reach + 1, stride)
+        dx, dy, ds = np.meshgrid(offsets, offsets, offsets, indexing='ij')
+        sides = np.maximum(side + ds.ravel(), 1)
+        scores = get_square_border_scores(row_sums, col_sums, x0 + dx.ravel(), y0 + dy.ravel(), sides)
+        best = np.argmax(scores)
+        x0, y0, side = x0 + dx.ravel()[best], y0 + dy.ravel()[best], sides[best]
+    return [x0 + lo_x + side / 2, y0 + lo_y + side / 2, float(side)]
+
+# method: "nelder-mead" optimizes objective_function, "integral" runs the grid search
+# of fit_square_with_integral on the same smoothed mask and gives integer squares
+def fit_square_to_mask(mask, method="nelder-mead"):
+    kernel_size = 5  # Adjust based on your requirement
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    pad_size = 10  # Adjust as needed
+
+    # Perform padding
+    padded_mask = cv2.copyMakeBorder(mask, pad_size, pad_size, pad_size, pad_size, cv2.BORDER_CONSTANT, value=0)
+
+    # Perform erosion on padded mask
+    eroded_mask = cv2.erode(padded_mask, kernel, iterations=3)
+
+    # Optionally, remove padding from the eroded mask if required
+    eroded_mask = eroded_mask[pad_size:-pad_size, pad_size:-pad_size]
+    # plt.imshow(eroded_mask)
+    # plt.show()
+
+    # Threshold the mask
+    threshold = 0.5  # or any value that you find suitable
+    _, thresh_mask = cv2.threshold(eroded_mask, threshold, 0.5, cv2.THRESH_BINARY)
+
+    # Find contours
+    contours, _ = cv2.findContours((thresh_mask * 255).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        raise ValueError("No contours found!")
+
+    # Get a bounding box around the detected contour
+    x, y, w, h = cv2.boundingRect(np.vstack(contours))
+
+    # Set initial parameters
+    initial_params = [x + w / 2, y + h / 2, min(w, h)]  # corrected the side length
+
+    # Run the optimization
+    # Use a Gaussian kernel to weigh the contributions of neighboring pixels
+    sigma = 1.5  # Standard deviation of the Gaussian kernel, adjust as needed
+    gaussian_mask = gaussian_filter(mask, sigma=sigma)
+    if method == "integral":
+        # objective_function samples (cx, cy) as (row, column), keep that convention
+        return fit_square_with_integral(gaussian_mask.T, initial_params)
+    assert(method == "nelder-mead")
+    result = minimize(objective_function, initial_params, args=(gaussian_mask,), method='Nelder-Mead')
+    cx, cy, s = result.x
+    return [cx, cy, s]
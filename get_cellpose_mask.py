@@ -3,12 +3,7 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
-
-def rectangles_intersect(rect1, rect2):
-    x1, y1, w1, h1 = rect1
-    x2, y2, w2, h2 = rect2
-
-    return not (x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1)
+from pix2pix.patch_annotation import annotate_patches as rasterize_patches
 
 def save_image(array,filename,format="RGB"):
     if array.max()<1.1:
@@ -23,30 +18,7 @@ def save_image(array,filename,format="RGB"):
     array.save(filename)
 
 def annotate_patches(image_size, patch_size, circles):
-    w,h = image_size
-    num_patches_w = w // patch_size
-    num_patches_h = h // patch_size
-
-    annotation = np.zeros((num_patches_w, num_patches_h), dtype=int)
-    for i in range(num_patches_w):
-        for j in range(num_patches_h):
-            patch_x = i * patch_size
-            patch_y = j * patch_size
-            patch_rect = (patch_x, patch_y, patch_size, patch_size)
-
-            for circle in circles:
-                circle_x, circle_y, circle_radius = circle[:3]
-                circle_radius = circle_radius+1
-                circle_rect = (circle_y - circle_radius,circle_x - circle_radius,  2 * circle_radius, 2 * circle_radius)
-
-
-                if rectangles_intersect(patch_rect, circle_rect):
-                    annotation[i, j] = 1
-                    # plt.imshow(image[patch_x:patch_x + step, patch_y:patch_y + step])
-                    # print(annotation[i, j])
-                    # plt.show()
-                    break
-    return annotation
+    return rasterize_patches(image_size, patch_size, circles, padding=1, dtype=int)
 
 def calculate_centers_and_scales_from_outlines(outlines):
     properties = []
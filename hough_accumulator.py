@@ -0,0 +1,296 @@
+from __future__ import division
+import functools
+import numpy as np
+from numba import njit, prange, get_num_threads
+from scipy import fft
+from scipy.spatial import cKDTree
+
+
+# Offsets visited by the midpoint circle walk. Duplicated offsets are kept on
+# purpose, so the vote counts match the octant loop used before.
+@functools.lru_cache(maxsize=None)
+def get_circle_stencil(radius):
+    radius = int(radius)
+    offsets = []
+    x = radius
+    y = 0
+    while (y < x):
+        offsets += [(x, y), (y, x), (-x, y), (-y, x), (-x, -y), (-y, -x), (x, -y), (y, -x)]
+        if x * x + (y + 1) * (y + 1) > radius * radius:
+            x = x - 1
+        y = y + 1
+    stencil = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    stencil.flags.writeable = False
+    return stencil
+
+
+def get_radius_stencils(radius_range):
+    stencils = [get_circle_stencil(r) for r in radius_range]
+    starts = np.zeros(len(stencils) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([s.shape[0] for s in stencils])
+    offsets = np.concatenate(stencils) if stencils else np.zeros((0, 2), dtype=np.int64)
+    return offsets, starts
+
+
+@njit(nogil=True, cache=True)
+def _scatter_chunk(acc_array, row_offset, rows, cols, weights, offsets, starts, start, end, height, width):
+    for i in range(start, end):
+        x0 = rows[i]
+        y0 = cols[i]
+        w0 = weights[i]
+        for j in range(starts.shape[0] - 1):
+            for k in range(starts[j], starts[j + 1]):
+                x = x0 + offsets[k, 0]
+                y = y0 + offsets[k, 1]
+                if x >= 0 and x < height and y >= 0 and y < width:
+                    acc_array[x - row_offset, y, j] += w0
+
+
+@njit(parallel=True, cache=True)
+def _scatter_votes(acc_array, rows, cols, weights, offsets, starts, n_chunks):
+    height, width, n_radius = acc_array.shape
+    n_edges = rows.shape[0]
+    pad = 0
+    for k in range(offsets.shape[0]):
+        pad = max(pad, abs(offsets[k, 0]))
+    chunk = (n_edges + n_chunks - 1) // n_chunks
+    n_chunks = (n_edges + chunk - 1) // chunk
+
+    # every chunk votes into its own band of rows, so threads never share memory
+    band_lo = np.empty(n_chunks, dtype=np.int64)
+    band_hi = np.empty(n_chunks, dtype=np.int64)
+    band_base = np.empty(n_chunks, dtype=np.int64)
+    total = 0
+    for t in range(n_chunks):
+        lo = rows[t * chunk]
+        hi = lo
+        for i in range(t * chunk, min((t + 1) * chunk, n_edges)):
+            lo = min(lo, rows[i])
+            hi = max(hi, rows[i])
+        band_lo[t] = max(lo - pad, 0)
+        band_hi[t] = min(hi + pad + 1, height)
+        band_base[t] = total
+        total += band_hi[t] - band_lo[t]
+
+    partial = np.zeros((total, width, n_radius), dtype=acc_array.dtype)
+    for t in prange(n_chunks):
+        _scatter_chunk(partial, band_lo[t] - band_base[t], rows, cols, weights, offsets, starts,
+                       t * chunk, min((t + 1) * chunk, n_edges), height, width)
+
+    for x in prange(height):
+        for t in range(n_chunks):
+            if band_lo[t] <= x < band_hi[t]:
+                acc_array[x, :, :] += partial[band_base[t] + x - band_lo[t], :, :]
+
+
+def fill_acc_array_with_weight(acc_array, edges, height, width, radius_range, weight):
+    assert acc_array.shape == (height, width, len(radius_range))
+    rows = np.ascontiguousarray(edges[0], dtype=np.int64)
+    cols = np.ascontiguousarray(edges[1], dtype=np.int64)
+    if rows.shape[0] == 0:
+        return
+    weights = np.ascontiguousarray(weight[rows, cols])
+    offsets, starts = get_radius_stencils(radius_range)
+    n_chunks = min(get_num_threads(), rows.shape[0])
+    if n_chunks > 1:
+        _scatter_votes(acc_array, rows, cols, weights, offsets, starts, n_chunks)
+    else:
+        _scatter_chunk(acc_array, 0, rows, cols, weights, offsets, starts, 0, rows.shape[0], height, width)
+
+
+@njit(parallel=True, cache=True)
+def _scatter_batch(acc_array, weight_maps, offsets, starts):
+    n_batch, height, width, n_radius = acc_array.shape
+    for b in prange(n_batch):
+        for x0 in range(height):
+            for y0 in range(width):
+                w0 = weight_maps[b, x0, y0]
+                if w0 > 0:
+                    for j in range(n_radius):
+                        for k in range(starts[j], starts[j + 1]):
+                            x = x0 + offsets[k, 0]
+                            y = y0 + offsets[k, 1]
+                            if x >= 0 and x < height and y >= 0 and y < width:
+                                acc_array[b, x, y, j] += w0
+
+
+# Votes for a stack of equal-size weight maps in one call, every positive pixel
+# is an edge. Returns an N x H x W x R accumulator.
+def accumulate_votes_batch(weight_maps, radius_range, dtype=np.float64):
+    weight_maps = np.ascontiguousarray(weight_maps)
+    n_batch, height, width = weight_maps.shape
+    acc_array = np.zeros((n_batch, height, width, len(radius_range)), dtype=dtype)
+    offsets, starts = get_radius_stencils(radius_range)
+    _scatter_batch(acc_array, weight_maps, offsets, starts)
+    return acc_array
+
+
+def get_ring_kernel(radius):
+    radius = max(int(radius), 0)
+    stencil = get_circle_stencil(radius)
+    kernel = np.zeros((2 * radius + 1, 2 * radius + 1))
+    np.add.at(kernel, (stencil[:, 0] + radius, stencil[:, 1] + radius), 1)
+    return kernel
+
+
+def get_edge_spectrum(edges, weight, height, width, radius_range):
+    weight_map = np.zeros((height, width))
+    weight_map[edges] = weight[edges]
+    pad = max(max(int(r) for r in radius_range), 0)
+    fshape = (fft.next_fast_len(height + 2 * pad, real=True), fft.next_fast_len(width + 2 * pad, real=True))
+    return fft.rfft2(weight_map, fshape, workers=-1), fshape
+
+
+def get_fft_plane(spectrum, fshape, radius, height, width):
+    radius = max(int(radius), 0)
+    plane = fft.irfft2(spectrum * fft.rfft2(get_ring_kernel(radius), fshape, workers=-1), fshape, workers=-1)
+    # drop the floating point noise so thresholds behave like the scatter votes
+    return np.round(plane[radius:radius + height, radius:radius + width], 6)
+
+
+# Scattering votes from every edge pixel is the same as convolving the weighted
+# edge map with a ring kernel, so the cost only depends on the image size.
+def fill_acc_array_with_fft(acc_array, edges, height, width, radius_range, weight):
+    assert acc_array.shape == (height, width, len(radius_range))
+    spectrum, fshape = get_edge_spectrum(edges, weight, height, width, radius_range)
+    for i, r in enumerate(radius_range):
+        acc_array[:, :, i] = get_fft_plane(spectrum, fshape, r, height, width)
+
+
+def accumulate_votes(edges, weight, shape, radius_range, dtype=np.float64, method="scatter"):
+    height, width = shape[:2]
+    acc_array = np.zeros((height, width, len(radius_range)), dtype=dtype)
+    if method == "scatter":
+        fill_acc_array_with_weight(acc_array, edges, height, width, radius_range, weight)
+    else:
+        assert(method == "fft")
+        fill_acc_array_with_fft(acc_array, edges, height, width, radius_range, weight)
+    return acc_array
+
+
+# Votes of a single radius. Pass the edge spectrum to convolve in the frequency domain.
+def get_vote_plane(edges, weight, shape, radius, dtype=np.float32, spectrum=None, fshape=None):
+    height, width = shape[:2]
+    if spectrum is not None:
+        return get_fft_plane(spectrum, fshape, radius, height, width).astype(dtype)
+    plane = np.zeros((height, width, 1), dtype=dtype)
+    fill_acc_array_with_weight(plane, edges, height, width, [radius], weight)
+    return plane[:, :, 0]
+
+
+# Running max and argmax over an iterable of radius planes.
+def reduce_planes(planes, shape, dtype=np.float32):
+    height, width = shape[:2]
+    candidate_centers = np.zeros((height, width), dtype=dtype)
+    candidate_radius = np.zeros((height, width), dtype=np.int64)
+    better = np.zeros((height, width), dtype=bool)
+    for i, votes in enumerate(planes):
+        if i == 0:
+            candidate_centers[:] = votes
+        else:
+            # strict comparison keeps the first radius on ties, like argmax
+            np.greater(votes, candidate_centers, out=better)
+            np.copyto(candidate_centers, votes, where=better)
+            np.copyto(candidate_radius, i, where=better)
+    return candidate_centers, candidate_radius
+
+
+# Computes one radius plane at a time and only keeps the running max and argmax,
+# so the H x W x R accumulator is never allocated.
+def reduce_votes(edges, weight, shape, radius_range, dtype=np.float32, method="scatter"):
+    spectrum, fshape = None, None
+    if method == "fft":
+        spectrum, fshape = get_edge_spectrum(edges, weight, shape[0], shape[1], radius_range)
+    else:
+        assert(method == "scatter")
+    planes = (get_vote_plane(edges, weight, shape, r, dtype, spectrum, fshape) for r in radius_range)
+    return reduce_planes(planes, shape, dtype)
+
+
+def get_candidate_planes(edges, weight, shape, radius_range, method="scatter", reduction="full", dtype=None):
+    if reduction == "full":
+        acc_array = accumulate_votes(edges, weight, shape, radius_range, dtype=dtype or np.float64, method=method)
+        return acc_array.max(axis=2), acc_array.argmax(axis=2)
+    assert(reduction == "stream")
+    return reduce_votes(edges, weight, shape, radius_range, dtype=dtype or np.float32, method=method)
+
+
+# Edge weights in [0, 1] as integers in [0, levels]. Votes of quantized weights
+# are levels times the float votes, up to 0.5 per edge pixel of rounding, and
+# exact for binary weights such as the Canny edges.
+def quantize_weights(weight, levels=255):
+    assert(levels <= 255)
+    return np.round(np.clip(weight, 0, 1) * levels).astype(np.uint8)
+
+
+# Smallest unsigned type that cannot overflow: a center gets at most one vote of
+# levels from every offset of the stencil.
+def get_vote_dtype(radius_range, levels=255):
+    bound = max([get_circle_stencil(r).shape[0] for r in radius_range] + [0]) * levels
+    return np.uint16 if bound <= np.iinfo(np.uint16).max else np.uint32
+
+
+# Greedy suppression: points are visited by decreasing score (input order on ties)
+# and every kept point removes the points within distance of it.
+def suppress_close_points(points, scores, distance, p=2):
+    keep = np.zeros(len(scores), dtype=bool)
+    if len(scores) == 0:
+        return keep
+    points = np.asarray(points, dtype=np.float64).reshape(len(scores), -1)
+    pairs = cKDTree(points).query_pairs(distance, p=p, output_type='ndarray')
+    if pairs.shape[0] == 0:
+        keep[:] = True
+        return keep
+    pairs = np.concatenate((pairs, pairs[:, ::-1]))
+    pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+    bounds = np.searchsorted(pairs[:, 0], np.arange(len(scores) + 1))
+    suppressed = np.zeros(len(scores), dtype=bool)
+    # scores may be unsigned votes, negate them as floats
+    for i in np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable'):
+        if suppressed[i]:
+            continue
+        keep[i] = True
+        suppressed[pairs[bounds[i]:bounds[i + 1], 1]] = True
+    return keep
+
+
+# maxpooling_in_position compiled: candidates are visited in raster order and the
+# window [x - k, x + k) x [y - k, y + k), clipped to the image, keeps only its first
+# maximum in raster order. Later windows see the values cleared by earlier ones.
+@njit(nogil=True, cache=True)
+def _maxpool_candidates(image, rows, cols, kernel_size):
+    height, width = image.shape
+    for i in range(rows.shape[0]):
+        x = rows[i]
+        y = cols[i]
+        x0 = x - kernel_size if x > kernel_size else 0
+        y0 = y - kernel_size if y > kernel_size else 0
+        x1 = x + kernel_size if x < height - kernel_size else height
+        y1 = y + kernel_size if y < width - kernel_size else width
+        if x1 <= x0 or y1 <= y0:
+            continue
+        best = image[x0, y0]
+        best_x = x0
+        best_y = y0
+        for a in range(x0, x1):
+            for b in range(y0, y1):
+                if image[a, b] > best:
+                    best = image[a, b]
+                    best_x = a
+                    best_y = b
+        for a in range(x0, x1):
+            for b in range(y0, y1):
+                image[a, b] = 0
+        image[best_x, best_y] = best
+
+
+# Non-maximum suppression of maxpooling_in_position, without changing
+# candidate_centers. Returns the kept positions in raster order, like np.where.
+def get_peak_positions(candidate_centers, circle_threshold, kernel_size):
+    kernel_size = max(int(kernel_size), 0)
+    rows, cols = np.nonzero(candidate_centers > circle_threshold)
+    image = np.array(candidate_centers, copy=True)
+    _maxpool_candidates(image, rows.astype(np.int64), cols.astype(np.int64), kernel_size)
+    # every candidate lies in its own window, the kept ones are still above the threshold
+    keep = image[rows, cols] > circle_threshold
+    return rows[keep], cols[keep]
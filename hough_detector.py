@@ -43,29 +43,11 @@ def run(imagepath,dataset_name,circle_likelihood=None,shrink=0.87):
             circles_f[:,:2] = circles_f[:,:2]*square_scale/fiducial_scale
 
         # find alignment to fiducial based on ICP
-        transposed_fiducial = get_transposed_fiducials(circles, circles_f, iter=20)
+        transposed_fiducial = get_transposed_fiducials(circles, circles_f)
 
-    f_indices = np.arange(transposed_fiducial.shape[0])
-    crop_circles=[]
-    likelihoods=[]
-    for id in f_indices:
-        xf = transposed_fiducial[id, 0]
-        yf = transposed_fiducial[id, 1]
-        crop_image = image[yf - crop_size:yf + crop_size, xf - crop_size:xf + crop_size, :]
-        crop_circle, likelihood = run_circle_max(crop_image, radius=he_radius, max_n=1, step=2)
-        crop_circles.append(crop_circle)
-        likelihoods.append(likelihood)
-    if circle_likelihood is None:
-        circle_likelihood = np.median(np.asarray(likelihood))
-    detected_circles=[]
-    for id in f_indices:
-        crop_circle = crop_circles[id]
-        likelihood = likelihoods[id]
-        if likelihood > circle_likelihood:
-            crop_circle[0] = crop_circle[0] + transposed_fiducial[id, 0] - crop_size
-            crop_circle[1] = crop_circle[1] + transposed_fiducial[id, 1] - crop_size
-            detected_circles.append(crop_circle)
-    return image, detected_circles
+    detected_circles = get_fiducial_circles(image, transposed_fiducial, crop_size, he_radius,
+                                            circle_likelihood=circle_likelihood, step=2)
+    return image, list(detected_circles)
 
 
 # ------------------------------------------
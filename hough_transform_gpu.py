@@ -2,7 +2,8 @@ from __future__ import division
 import cv2
 import numpy as np
 import time
-from numba import jit
+from hough_accumulator import fill_acc_array_with_weight, get_peak_positions
+from hough_utils import run_circle_max_batch, get_padded_crop, find_nearest_points
 from matplotlib import pyplot as plt
 # import utils.icp as icp
 from PIL import Image, ImageFilter
@@ -11,36 +12,6 @@ from PIL import Image
 import seaborn as sns
 
 
-@jit
-def fill_acc_array_with_weight(acc_array,edges,height,width,radius_range, weight):
-    for i in range(0, len(edges[0])):
-        x0 = edges[0][i]
-        y0 = edges[1][i]
-        w0 = weight[x0,y0]
-        for i in range(len(radius_range)):
-            x = radius_range[i]
-            y = 0
-            while (y < x):
-                if (x + x0 < height and y + y0 < width):
-                    acc_array[x + x0, y + y0, i] += w0;  # Octant 1
-                if (y + x0 < height and x + y0 < width):
-                    acc_array[y + x0, x + y0, i] += w0;  # Octant 2
-                if (-x + x0 < height and y + y0 < width):
-                    acc_array[-x + x0, y + y0, i] += w0;  # Octant 4
-                if (-y + x0 < height and x + y0 < width):
-                    acc_array[-y + x0, x + y0, i] += w0;  # Octant 3
-                if (-x + x0 < height and -y + y0 < width):
-                    acc_array[-x + x0, -y + y0, i] += w0;  # Octant 5
-                if (-y + x0 < height and -x + y0 < width):
-                    acc_array[-y + x0, -x + y0, i] += w0;  # Octant 6
-                if (x + x0 < height and -y + y0 < width):
-                    acc_array[x + x0, -y + y0, i] += w0;  # Octant 8
-                if (y + x0 < height and -x + y0 < width):
-                    acc_array[y + x0, -x + y0, i] += w0;  # Octant 7
-                if np.power(x,2) + np.power(y+1,2) > np.power(radius_range[i],2):
-                    x = x-1
-                y = y+1
-
 def get_circle_pixels(circle_center,radius):
     x0 = circle_center[0]
     y0 = circle_center[1]
@@ -63,30 +34,6 @@ def get_circle_pixels(circle_center,radius):
     pixels = np.asarray(pixels)
     return [pixels[:,0],pixels[:,1]]
 
-# @jit
-def maxpooling_in_position(image,position,kernel_size):
-    height, width = image.shape
-    for i in range(position[0].shape[0]):
-        x = position[0][i]
-        y = position[1][i]
-        lower_bound_x = x-kernel_size if x>kernel_size else 0
-        lower_bound_y = y-kernel_size if y>kernel_size else 0
-
-        bound_x = x+kernel_size if x<height-kernel_size else height
-        bound_y = y+kernel_size if y<width-kernel_size else width
-
-        temp = image[lower_bound_x:bound_x,lower_bound_y:bound_y]
-
-        circle_temp = np.where(temp == temp.max())
-        if len(circle_temp[0]) > 1:
-            circle_center = (np.array([circle_temp[0][0]]), np.array([circle_temp[1][0]]))
-        else:
-            circle_center = circle_temp
-
-        temp2 = np.zeros(temp.shape)
-        temp2[circle_center] = temp.max()
-        image[lower_bound_x:bound_x, lower_bound_y:bound_y] = temp2
-
 def normalize_array(input):
     min_value = input.min()
     max_value = input.max()
@@ -131,11 +78,9 @@ def run_circle_threhold(original_image,radius,circle_threshold,step=2):
     candidate_radius= acc_array.argmax(axis=2)
 
 
-    circle_center = np.where(candidate_centers>circle_threshold)
 
-    # remove near centers with maxpooling
-    maxpooling_in_position(candidate_centers,circle_center,fiducial_radius)
-    circle_center = np.where(candidate_centers > circle_threshold)
+    # remove near centers with non-maximum suppression
+    circle_center = get_peak_positions(candidate_centers, circle_threshold, fiducial_radius)
 
     # find corresponding radius for detected circles
     radius_index = candidate_radius[circle_center]
@@ -151,79 +96,6 @@ def run_circle_threhold(original_image,radius,circle_threshold,step=2):
     return circles
 
 
-def run_circle_max(image,crop_image,radius,max_n,step=1):
-    crop_image = normalize_array(crop_image)
-    blur_image = getBluredImg(crop_image)
-
-    LOCAL_DEBUG=False
-
-    blur_image= blur_image * 255
-    edged_image = getEdgedImg(blur_image,"Image")
-
-    edged_image = normalize_array(edged_image)
-    edged_image[0,:]=0
-    edged_image[-1, :] = 0
-    edged_image[:, 0] = 0
-    edged_image[:, -1] = 0
-    edges = np.where(edged_image > 0)
-
-    # edged_image = crop_image
-
-    radius_range = np.arange(radius - step, radius+1)
-    height, width = edged_image.shape
-    acc_array = np.zeros(((height, width, len(radius_range))))
-    fill_acc_array_with_weight(acc_array, edges, height, width, radius_range,edged_image)
-
-
-    candidate_radius_index = acc_array.argmax(axis=2)
-    candidate_centers = acc_array.max(axis=2)
-    # candidate_centers = np.where(candidate_centers == candidate_centers.max(),candidate_centers,0)
-
-    ##fiduicial circle shape mask
-    # column=np.arange(0,candidate_centers.shape[0])
-    # columns = np.repeat(column[:,np.newaxis],candidate_centers.shape[1],axis=1)
-    # rows = columns.transpose()
-    # columns = columns-fiducial_radius
-    # rows = rows-fiducial_radius
-    # distance = np.power(columns, 2) + np.power(rows, 2)
-    # distance = np.sqrt(distance)
-    # candidate_centers = np.where(distance<fiducial_radius+1,candidate_centers,0)
-
-
-    #find top n elements in candidate_centers
-    # candidate_centers_vector = np.asarray(candidate_centers).copy()
-    # candidate_centers_vector = candidate_centers_vector.reshape(-1)
-    # ind = np.argpartition(candidate_centers_vector, -max_n)[-max_n:]
-    # max_values = candidate_centers_vector[ind]
-
-    circle_center = np.where(candidate_centers == candidate_centers.max())
-    if len(circle_center[0])>1:
-        circle_center = (np.array([circle_center[0][0]]),np.array([circle_center[1][0]]))
-
-
-    # find corresponding radius for detected circles
-    radius_index = candidate_radius_index[circle_center]
-    radius_index = np.asarray(radius_index)
-    radius = radius_index.copy()
-    for i in range(len(radius_range)):
-        radius = np.where(radius_index == i, radius_range[i], radius)
-    circle_center = np.array(circle_center).transpose()
-    circle_center = np.flip(circle_center, 1)
-    radius = radius[:, np.newaxis]
-    circles = np.concatenate((circle_center, radius), axis=1)
-
-    if LOCAL_DEBUG:
-        f, axarr = plt.subplots(2, 2)
-        axarr[0, 0].imshow(image)
-        axarr[0, 1].imshow(crop_image)
-        axarr[1, 0].imshow(candidate_centers)
-        cv2.circle(image, (circles[0, 0], circles[0, 1]),circles[0,2], (0, 0, 250), 1)
-        axarr[1, 1].imshow(image)
-        print(circles[0, 0],circles[0, 1],circles[0,2])
-        plt.show()
-    return circles
-
-
 # def get_transposed_fiducials(circles,circles_f,shrink_scale = 0.87, iter=1):
 #     transform=[]
 #     mean_error = 999
@@ -246,17 +118,6 @@ def run_circle_max(image,crop_image,radius,max_n,step=1):
 #     transposed_circle = icp.apply_icp_transformation(circles_f, transform)
 #     return transposed_circle.astype(int)
 
-def find_nearest_points(src,dst):
-    dst_array = np.repeat(dst[:, :, np.newaxis], src.shape[0], axis=2)
-    src_array = np.repeat(src[:, :, np.newaxis], dst.shape[0], axis=2)
-    src_array = np.transpose(src_array, [2, 1, 0])
-
-    distance = np.power((dst_array - src_array), 2)
-    distance = distance[:, 0, :] + distance[:, 1, :]
-    distance = np.sqrt(distance)
-    indices = np.argmin(distance, axis=1)
-    return indices, distance
-
 def save_image(array,filename,format="RGB"):
     if array.max()<1.1:
         array = 255 * array
@@ -284,15 +145,26 @@ def get_refined_centers(circle_center,transposed_fiducial,distance,indices,dista
     if SAVE_FILE:
         fileid=0
         testid=34
+    # refine the fiducials without a close circle in one batched call. Crops at the
+    # image border are padded to the full size, crops outside the image and crops
+    # without any votes count as missed circles
+    crop_size = fiducial_radius
+    refine_ids = [i for i in range(distance.shape[0]) if not distance[i] < 0]
+    crop_images = [get_padded_crop(image, x, y, crop_size) for x, y in transposed_fiducial[refine_ids, :2]]
+    batch_ids = [i for i, crop_image in zip(refine_ids, crop_images) if crop_image is not None]
+    batch_circles, likelihoods = run_circle_max_batch(
+        [crop_image for crop_image in crop_images if crop_image is not None], radius=he_radius, step=2)
+    refined_circles = {i: circle for i, circle, likelihood in zip(batch_ids, batch_circles, likelihoods)
+                       if likelihood > 0}
     for i,idx in zip(np.arange(distance.shape[0]),indices):
         if LOCAL_DEBUG:
-            all_distance.append(distance[i, idx])
-        if distance[i,idx]<0:
-        # if distance[i,idx]<distance_threshold:
+            all_distance.append(distance[i])
+        if distance[i]<0:
+        # if distance[i]<distance_threshold:
             new_center.append(circle_center[idx,:])
             distance_aligned_center.append(circle_center[idx,:])
             if LOCAL_DEBUG:
-                true_positive_distance.append(distance[i,idx])
+                true_positive_distance.append(distance[i])
         else:
             crop_size = fiducial_radius
             x = transposed_fiducial[i, 0]
@@ -309,11 +181,11 @@ def get_refined_centers(circle_center,transposed_fiducial,distance,indices,dista
             # a[0].imshow(crop_image)
             # a[1].imshow(crop_tiff)
             # plt.show()
-            crop_circles = run_circle_max(crop_image,crop_image,radius=he_radius, max_n=1,step=2)
+            crop_circles = refined_circles[i][np.newaxis] if i in refined_circles else np.zeros((0, 3), dtype=int)
             if crop_circles.size == 0:
                 missed_circle += 1
             else:
-                if SAVE_FILE & (distance[i,idx]<distance_threshold):
+                if SAVE_FILE & (distance[i]<distance_threshold):
                 # if SAVE_FILE:
                     crop_image_show = crop_image.copy()
                     mask = np.ones(crop_image.shape[0:2])
@@ -1,12 +1,19 @@
 from __future__ import division
 import cv2
 import numpy as np
+import os
 import time
-from numba import jit
+import statistics
+import numba
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from hough_accumulator import fill_acc_array_with_weight, accumulate_votes, accumulate_votes_batch, \
+    get_candidate_planes, get_peak_positions, suppress_close_points, get_edge_spectrum, get_vote_plane, reduce_planes, \
+    quantize_weights, get_vote_dtype
 from matplotlib import pyplot as plt
 import geo_utils.icp as icp
 from PIL import Image, ImageFilter
 from scipy import stats
+from scipy.spatial import cKDTree
 from PIL import Image
 import seaborn as sns
 import numpy as np
@@ -19,36 +26,6 @@ import matplotlib.pyplot as plt
 from matplotlib import cm
 
 
-@jit
-def fill_acc_array_with_weight(acc_array,edges,height,width,radius_range, weight):
-    for i in range(0, len(edges[0])):
-        x0 = edges[0][i]
-        y0 = edges[1][i]
-        w0 = weight[x0,y0]
-        for i in range(len(radius_range)):
-            x = radius_range[i]
-            y = 0
-            while (y < x):
-                if (x + x0 < height and y + y0 < width):
-                    acc_array[x + x0, y + y0, i] += w0;  # Octant 1
-                if (y + x0 < height and x + y0 < width):
-                    acc_array[y + x0, x + y0, i] += w0;  # Octant 2
-                if (-x + x0 < height and y + y0 < width):
-                    acc_array[-x + x0, y + y0, i] += w0;  # Octant 4
-                if (-y + x0 < height and x + y0 < width):
-                    acc_array[-y + x0, x + y0, i] += w0;  # Octant 3
-                if (-x + x0 < height and -y + y0 < width):
-                    acc_array[-x + x0, -y + y0, i] += w0;  # Octant 5
-                if (-y + x0 < height and -x + y0 < width):
-                    acc_array[-y + x0, -x + y0, i] += w0;  # Octant 6
-                if (x + x0 < height and -y + y0 < width):
-                    acc_array[x + x0, -y + y0, i] += w0;  # Octant 8
-                if (y + x0 < height and -x + y0 < width):
-                    acc_array[y + x0, -x + y0, i] += w0;  # Octant 7
-                if np.power(x,2) + np.power(y+1,2) > np.power(radius_range[i],2):
-                    x = x-1
-                y = y+1
-
 def get_circle_pixels(circle_center,radius):
     x0 = circle_center[0]
     y0 = circle_center[1]
@@ -259,30 +236,6 @@ def get_square_paras(img_height,img_width,circles,image):
 
     return framecenter_x,framecenter_y,scale
 
-# @jit
-def maxpooling_in_position(image,position,kernel_size):
-    height, width = image.shape
-    for i in range(position[0].shape[0]):
-        x = position[0][i]
-        y = position[1][i]
-        lower_bound_x = x-kernel_size if x>kernel_size else 0
-        lower_bound_y = y-kernel_size if y>kernel_size else 0
-
-        bound_x = x+kernel_size if x<height-kernel_size else height
-        bound_y = y+kernel_size if y<width-kernel_size else width
-
-        temp = image[lower_bound_x:bound_x,lower_bound_y:bound_y]
-
-        circle_temp = np.where(temp == temp.max())
-        if len(circle_temp[0]) > 1:
-            circle_center = (np.array([circle_temp[0][0]]), np.array([circle_temp[1][0]]))
-        else:
-            circle_center = circle_temp
-
-        temp2 = np.zeros(temp.shape)
-        temp2[circle_center] = temp.max()
-        image[lower_bound_x:bound_x, lower_bound_y:bound_y] = temp2
-
 def normalize_array(input):
     min_value = input.min()
     max_value = input.max()
@@ -340,35 +293,57 @@ def get_edge_pixels(img):
     return re
 
 
-def run_circle_threhold(original_image,_radius_,circle_threshold,edgemethod="canny",step=3):
+# method: "scatter" votes from every edge pixel, "fft" convolves the edge map with
+# a ring per radius and is faster on dense edge maps from large, tissue-heavy images
+# reduction: "full" builds the H x W x R accumulator, "stream" keeps one float32 plane
+# roi: optional boolean mask, only centers inside it are searched for
+# value_range: (min, max) used for normalization instead of the image's own range
+# quantize: vote with uint8 weights into integer accumulators, circle_threshold is
+# rescaled to match. Exact for the canny edges, see quantize_weights otherwise.
+def run_circle_threhold(original_image,_radius_,circle_threshold,edgemethod="canny",step=3,method="scatter",
+                        reduction="full",roi=None,value_range=None,quantize=False):
     if edgemethod == 'self':
         edged_image = get_edge_pixels(original_image)
         # plt.imshow(edged_image)
         # plt.show()
     # # Gaussian Blurring of Gray Image
     else:
-        original_image = normalize_array(original_image)
+        if value_range is None:
+            original_image = normalize_array(original_image)
+        else:
+            original_image = (original_image - value_range[0]) / (value_range[1] - value_range[0])
         blur_image=getBluredImg(original_image)
         edged_image = getEdgedImg(blur_image,"canny")
         # plt.imshow(edged_image)
         # plt.show()
 
 
-    edges = np.where(edged_image == 255)
     height, width = edged_image.shape
     radius_range = np.arange(_radius_-step,_radius_+step)
+    if roi is None:
+        edges = np.where(edged_image == 255)
+    else:
+        # only edge pixels that can vote into the roi are needed
+        reach = 2 * max(int(radius_range.max()), 0) + 1
+        near_roi = cv2.dilate(roi.astype(np.uint8), np.ones((reach, reach), np.uint8))
+        edges = np.where((edged_image == 255) & (near_roi > 0))
 
     edged_image = normalize_array(edged_image)
-    acc_array = np.zeros((height, width, len(radius_range)))
-    fill_acc_array_with_weight(acc_array, edges, height, width, radius_range,edged_image)
-
-    candidate_centers = acc_array.max(axis=2)
-    candidate_radius= acc_array.argmax(axis=2)
-    circle_center = np.where(candidate_centers>circle_threshold)
-
-    # remove near centers with maxpooling
-    maxpooling_in_position(candidate_centers,circle_center,_radius_)
-    circle_center = np.where(candidate_centers > circle_threshold)
+    dtype = None
+    if quantize:
+        assert(method == "scatter")
+        edged_image = quantize_weights(edged_image)
+        dtype = get_vote_dtype(radius_range)
+        circle_threshold = circle_threshold * 255
+    candidate_centers, candidate_radius = get_candidate_planes(edges, edged_image, (height, width), radius_range,
+                                                               method=method, reduction=reduction, dtype=dtype)
+    if roi is not None:
+        candidate_centers[~roi.astype(bool)] = 0
+    return get_circles_from_planes(candidate_centers, candidate_radius, radius_range, _radius_, circle_threshold)
+
+def get_circles_from_planes(candidate_centers,candidate_radius,radius_range,_radius_,circle_threshold):
+    # remove near centers with non-maximum suppression
+    circle_center = get_peak_positions(candidate_centers, circle_threshold, _radius_)
 
     # find corresponding radius for detected circles
     radius_index = candidate_radius[circle_center]
@@ -383,6 +358,170 @@ def run_circle_threhold(original_image,_radius_,circle_threshold,edgemethod="can
 
     return circles
 
+# Caches the edge map of one image for several queries. detect() gives the same
+# circles as run_circle_threhold with reduction="stream". By default the vote
+# planes are streamed like there, with max_planes the most recently used planes
+# are kept so that overlapping radius ranges of later queries are not voted
+# again. Every cached plane is a float32 image, or uint16/uint32 with quantize,
+# call clear() to free them.
+class HoughSession:
+    def __init__(self,original_image,method="scatter",quantize=False,max_planes=0):
+        original_image = normalize_array(original_image)
+        blur_image = getBluredImg(original_image)
+        edged_image = getEdgedImg(blur_image, "canny")
+        self.shape = edged_image.shape
+        self.edges = np.where(edged_image == 255)
+        self.weight = normalize_array(edged_image)
+        self.method = method
+        self.quantize = quantize
+        if quantize:
+            assert(method == "scatter")
+            self.weight = quantize_weights(self.weight)
+        self.max_planes = max_planes
+        self.planes = {}
+        self.spectrum = None
+        self.fshape = None
+        self.fft_radius = -1
+
+    def update_spectrum(self,radius):
+        # the padding of the spectrum has to cover the largest radius
+        if self.method == "fft" and radius > self.fft_radius:
+            self.spectrum, self.fshape = get_edge_spectrum(self.edges, self.weight, self.shape[0], self.shape[1],
+                                                           [radius])
+            self.fft_radius = radius
+
+    def get_plane(self,radius):
+        radius = int(radius)
+        if radius in self.planes:
+            # reinserted planes are evicted last
+            self.planes[radius] = self.planes.pop(radius)
+            return self.planes[radius]
+        assert(self.method in ("scatter", "fft"))
+        self.update_spectrum(radius)
+        dtype = get_vote_dtype([radius]) if self.quantize else np.float32
+        plane = get_vote_plane(self.edges, self.weight, self.shape, radius, dtype=dtype,
+                               spectrum=self.spectrum, fshape=self.fshape)
+        if self.max_planes > 0:
+            self.planes[radius] = plane
+            while len(self.planes) > self.max_planes:
+                del self.planes[next(iter(self.planes))]
+        return plane
+
+    def detect(self,_radius_,circle_threshold,step=3):
+        radius_range = np.arange(_radius_ - step, _radius_ + step)
+        self.update_spectrum(int(radius_range.max()))
+        dtype = np.float32
+        if self.quantize:
+            dtype = get_vote_dtype(radius_range)
+            circle_threshold = circle_threshold * 255
+        candidate_centers, candidate_radius = reduce_planes((self.get_plane(r) for r in radius_range), self.shape,
+                                                            dtype=dtype)
+        return get_circles_from_planes(candidate_centers, candidate_radius, radius_range, _radius_,
+                                       circle_threshold)
+
+    def clear(self):
+        self.planes = {}
+
+# Circles found on a downscaled copy, returned in full resolution coordinates.
+def run_circle_coarse(original_image,_radius_,circle_threshold,step=5,scale=0.5):
+    small_image = cv2.resize(original_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_radius = max(int(round(_radius_ * scale)), 1)
+    small_step = max(int(round(step * scale)), 1)
+    circles = run_circle_threhold(small_image, small_radius, circle_threshold=circle_threshold * scale,
+                                  step=small_step, reduction="stream")
+    return np.round(circles / scale).astype(int)
+
+# Coarse-to-fine search. Rough centers come from a downscaled copy, then both the
+# radius search and the refined pass only look at small windows around them.
+def run_circle_pyramid(original_image,_radius_,circle_threshold,step=5,scale=0.5,refine_step=3,refine_factor=2):
+    coarse_circles = run_circle_coarse(original_image, _radius_, circle_threshold, step=step, scale=scale)
+    if coarse_circles.shape[0] == 0:
+        return coarse_circles, _radius_
+
+    # a coarse center is off by at most one low resolution pixel plus the radius change
+    window = int(np.ceil(1 / scale)) + step
+    roi = np.zeros(original_image.shape[:2], np.uint8)
+    centers = coarse_circles[:, :2].copy()
+    centers[:, 0] = np.clip(centers[:, 0], 0, roi.shape[1] - 1)
+    centers[:, 1] = np.clip(centers[:, 1], 0, roi.shape[0] - 1)
+    roi[centers[:, 1], centers[:, 0]] = 1
+    roi = cv2.dilate(roi, np.ones((2 * window + 1, 2 * window + 1), np.uint8)) > 0
+
+    circles = run_circle_threhold(original_image, _radius_, circle_threshold=circle_threshold, step=step,
+                                  reduction="stream", roi=roi)
+    if circles.shape[0] == 0:
+        return circles, _radius_
+    re_r = statistics.mode(circles[:, 2])
+    circles = run_circle_threhold(original_image, re_r, circle_threshold=int(refine_factor * re_r),
+                                  step=refine_step, reduction="stream", roi=roi)
+    return circles, re_r
+
+def get_tiles(height,width,tile_size,halo):
+    tiles = []
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            core = (y, min(y + tile_size, height), x, min(x + tile_size, width))
+            box = (max(y - halo, 0), min(y + tile_size + halo, height), max(x - halo, 0), min(x + tile_size + halo, width))
+            tiles.append((core, box))
+    return tiles
+
+# Every worker thread already runs one tile per core, so the numba loops inside a
+# tile run on that thread only (set_num_threads is per thread) instead of
+# oversubscribing the CPU.
+def _init_tile_worker():
+    numba.set_num_threads(1)
+
+def _run_circle_tile(tile,core,box,value_range,_radius_,circle_threshold,step,method,quantize):
+    circles = run_circle_threhold(tile, _radius_, circle_threshold, step=step, method=method, reduction="stream",
+                                  value_range=value_range, quantize=quantize)
+    if circles.shape[0] == 0:
+        return np.zeros((0, 3), dtype=int)
+    circles[:, 0] += box[2]
+    circles[:, 1] += box[0]
+    # the halo only provides context, the neighbouring tile owns those centers
+    in_core = (circles[:, 1] >= core[0]) & (circles[:, 1] < core[1]) & \
+              (circles[:, 0] >= core[2]) & (circles[:, 0] < core[3])
+    return circles[in_core]
+
+# Tiled run_circle_threhold for images too large to process at once. Every tile
+# carries a halo wide enough for the votes, the blur and the suppression window,
+# so centers in the tile core see the same neighbourhood as on the whole image.
+# image can be any array that supports slicing (np.memmap, zarr, ...). At most
+# 2 * max_workers tiles are in flight, which bounds the memory. The tiles run in
+# threads, the numba votes, the peak picking and cv2 release the GIL, so it can be
+# called from scripts without a __main__ guard.
+def run_circle_threhold_tiled(image,_radius_,circle_threshold,step=3,tile_size=2048,max_workers=None,
+                              method="scatter",quantize=False):
+    height, width = image.shape[:2]
+    halo = 2 * _radius_ + step + 4
+    tiles = get_tiles(height, width, tile_size, halo)
+    max_workers = max_workers or os.cpu_count()
+
+    # normalize every tile with the range of the whole image
+    vmin = min(np.min(image[c[0]:c[1], c[2]:c[3]]) for c, _ in tiles)
+    vmax = max(np.max(image[c[0]:c[1], c[2]:c[3]]) for c, _ in tiles)
+
+    circles = []
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=_init_tile_worker) as executor:
+        pending = set()
+        for core, box in tiles:
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                circles += [f.result() for f in done]
+            tile = np.asarray(image[box[0]:box[1], box[2]:box[3]])
+            # background tiles have no edges and therefore no circles
+            if vmax <= vmin or np.min(tile) == np.max(tile):
+                continue
+            pending.add(executor.submit(_run_circle_tile, tile, core, box, (vmin, vmax), _radius_,
+                                        circle_threshold, step, method, quantize))
+        circles += [f.result() for f in wait(pending)[0]]
+
+    circles = np.concatenate(circles) if circles else np.zeros((0, 3), dtype=int)
+    # raster order like run_circle_threhold, then drop duplicates across tile borders
+    circles = circles[np.lexsort((circles[:, 0], circles[:, 1]))]
+    keep = suppress_close_points(circles[:, :2], np.zeros(circles.shape[0]), _radius_, p=np.inf)
+    return circles[keep]
+
 def generate_mask(image_size,circles,circle_width):
     mask = np.zeros(image_size)
     for i in range(circles.shape[0]):
@@ -399,7 +538,7 @@ def generate_weighted_mask(image_size,in_tissue_circles,out_tissue_circles,circl
         cv2.circle(mask, (x, y), r, 1, -1)
     return mask
 
-def run_circle_max(crop_image,radius,max_n,step=1):
+def get_crop_edge_weight(crop_image):
     crop_image = normalize_array(crop_image)
     blur_image = getBluredImg(crop_image)
     blur_image= blur_image * 255
@@ -410,18 +549,19 @@ def run_circle_max(crop_image,radius,max_n,step=1):
     edged_image[-1, :] = 0
     edged_image[:, 0] = 0
     edged_image[:, -1] = 0
+    return edged_image
+
+def run_circle_max(crop_image,radius,max_n,step=1,reduction="full"):
+    crop_image = normalize_array(crop_image)
+    edged_image = get_crop_edge_weight(crop_image)
     edges = np.where(edged_image > 0)
 
     # edged_image = crop_image
 
     radius_range = np.arange(radius - step, radius+1)
     height, width = edged_image.shape
-    acc_array = np.zeros(((height, width, len(radius_range))))
-    fill_acc_array_with_weight(acc_array, edges, height, width, radius_range,edged_image)
-
-
-    candidate_radius_index = acc_array.argmax(axis=2)
-    candidate_centers = acc_array.max(axis=2)
+    candidate_centers, candidate_radius_index = get_candidate_planes(edges, edged_image, (height, width),
+                                                                     radius_range, reduction=reduction)
     # candidate_centers = np.where(candidate_centers == candidate_centers.max(),candidate_centers,0)
 
     ##fiduicial circle shape mask
@@ -474,42 +614,151 @@ def run_circle_max(crop_image,radius,max_n,step=1):
     return circles[0], max_value
 
 
-def get_transposed_fiducials(circles,circles_f,iter=1):
-    transform=[]
-    mean_error = 999
-    for i in range(iter):
-        num_circle_in_fiducials = circles_f.shape[0]
-        num_circle_in_tissue = circles.shape[0]
-        if num_circle_in_tissue > num_circle_in_fiducials:
-            np.random.shuffle(circles)
-            circle_center_select = circles[:num_circle_in_fiducials, :]
-            circle_center_f_select = circles_f
+# Same result as calling run_circle_max on every crop, but crops of equal size are
+# stacked and voted in one parallel pass. Returns (circles, likelihoods).
+# quantize votes with uint8 weights, likelihoods are scaled back to the float range
+# and the best center can differ from the float votes on near ties.
+def run_circle_max_batch(crops,radius,step=1,quantize=False):
+    circles = np.zeros((len(crops), 3), dtype=int)
+    likelihoods = np.zeros(len(crops))
+    radius_range = np.arange(radius - step, radius + 1)
+    groups = {}
+    for i, crop_image in enumerate(crops):
+        groups.setdefault(crop_image.shape[:2], []).append(i)
+    for shape, ids in groups.items():
+        weight_maps = np.stack([get_crop_edge_weight(crops[i]) for i in ids])
+        if quantize:
+            acc_array = accumulate_votes_batch(quantize_weights(weight_maps), radius_range,
+                                               dtype=get_vote_dtype(radius_range))
         else:
-            np.random.shuffle(circles_f)
-            circle_center_f_select = circles_f[:num_circle_in_tissue, :]
-            circle_center_select = circles
-            # use icp find alignment
-        temp_transform, temp_error = icp.get_icp_transformation(circle_center_select[:,:2], circle_center_f_select[:,:2])
-        if temp_error<mean_error:
-           transform = temp_transform
+            acc_array = accumulate_votes_batch(weight_maps, radius_range)
+        acc_array = acc_array.reshape(len(ids), -1, len(radius_range))
+        candidate_centers = acc_array.max(axis=2)
+        # argmax picks the first maximum in raster order, as run_circle_max does
+        best = candidate_centers.argmax(axis=1)
+        rows, cols = np.unravel_index(best, shape)
+        radius_index = acc_array[np.arange(len(ids)), best].argmax(axis=1)
+        circles[ids] = np.stack((cols, rows, radius_range[radius_index]), axis=1)
+        likelihoods[ids] = candidate_centers[np.arange(len(ids)), best]
+    if quantize:
+        likelihoods = likelihoods / 255
+    return circles, likelihoods
+
+# The template circles_f is moved on to the detected circles. A sampled rigid
+# hypothesis with the most inliers (icp.ransac_pose) starts a single ICP, so wrong
+# lattice shifts are ruled out by the inlier count instead of random restarts.
+# inlier_distance defaults to half the spacing of the template circles.
+def get_transposed_fiducials(circles,circles_f,n_hypotheses=2000,inlier_distance=None,seed=0):
+    tree = cKDTree(circles[:, :2])
+    if inlier_distance is None:
+        spacing, _ = cKDTree(circles_f[:, :2]).query(circles_f[:, :2], k=2)
+        inlier_distance = 0.5 * np.median(spacing[:, 1])
+    init_pose, _ = icp.ransac_pose(circles_f[:, :2].astype(float), tree.data, inlier_distance,
+                                   n_hypotheses=n_hypotheses, tree=tree, seed=seed)
+    # use icp find alignment
+    transform, _ = icp.get_icp_transformation(circles[:, :2], circles_f[:, :2], tree=tree, init_pose=init_pose)
     transposed_circle = icp.apply_icp_transformation(circles_f, transform)
     return transposed_circle.astype(int)
 
-def find_nearest_points(src,dst,is_same=False):
-    dst_array = np.repeat(dst[:, :, np.newaxis], src.shape[0], axis=2)
-    src_array = np.repeat(src[:, :, np.newaxis], dst.shape[0], axis=2)
-    src_array = np.transpose(src_array, [2, 1, 0])
-
-    distance = np.power((dst_array - src_array), 2)
-    distance = distance[:, 0, :] + distance[:, 1, :]
-    distance = np.sqrt(distance)
-    if is_same:
-        maxvalue = np.max(distance)
-        for i in range(distance.shape[0]):
-            distance[i,i]=maxvalue
-    indices = np.argmin(distance, axis=1)
-    distance = np.min(distance,axis=1)
-    return indices, distance
+# Equal size crops of 2 * crop_size around every position, shifted inside the image
+# near the borders like getCropCoor. Returns the crops and their top left corners.
+def get_position_crops(image,positions,crop_size):
+    height, width = image.shape[:2]
+    x_min = np.clip(np.round(positions[:, 0]).astype(int) - crop_size, 0, max(width - 2 * crop_size, 0))
+    y_min = np.clip(np.round(positions[:, 1]).astype(int) - crop_size, 0, max(height - 2 * crop_size, 0))
+    crops = [image[y:y + 2 * crop_size, x:x + 2 * crop_size] for x, y in zip(x_min, y_min)]
+    return crops, x_min, y_min
+
+# Crop [y - crop_size, y + crop_size) x [x - crop_size, x + crop_size). The part
+# outside the image repeats the border pixels, so crops at the border keep the full
+# size and their circles the offset (x - crop_size, y - crop_size). None when the
+# crop lies completely outside the image.
+def get_padded_crop(image,x,y,crop_size):
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = x - crop_size, y - crop_size, x + crop_size, y + crop_size
+    crop = image[max(y0, 0):max(min(y1, height), 0), max(x0, 0):max(min(x1, width), 0)]
+    if crop.shape[0] == 0 or crop.shape[1] == 0:
+        return None
+    padding = [(max(-y0, 0), max(y1 - height, 0)), (max(-x0, 0), max(x1 - width, 0))]
+    return np.pad(crop, padding + [(0, 0)] * (crop.ndim - 2), mode='edge')
+
+# Best circle in an equal size crop around every predicted fiducial, in image
+# coordinates. Only circles with a likelihood above circle_likelihood are kept,
+# the median likelihood of all crops by default.
+def get_fiducial_circles(image,positions,crop_size,radius,circle_likelihood=None,step=2):
+    if len(positions) == 0:
+        return np.zeros((0, 3), dtype=int)
+    crops, x_min, y_min = get_position_crops(image, np.asarray(positions), crop_size)
+    circles, likelihoods = run_circle_max_batch(crops, radius=radius, step=step)
+    if circle_likelihood is None:
+        circle_likelihood = np.median(np.asarray(likelihoods))
+    circles[:, 0] += x_min
+    circles[:, 1] += y_min
+    return circles[likelihoods > circle_likelihood]
+
+# Fiducial search that uses the frame geometry instead of a full image Hough. The
+# template circles_f (already scaled to the image, e.g. by get_translated_circles)
+# is aligned to a handful of strong circles, and circles are only scored in small
+# windows around the predicted fiducials. seeds default to the circles found on a
+# downscaled copy. Returns (circles, likelihoods, predicted fiducials), one row per
+# template circle.
+def run_circle_lattice(image,_radius_,circles_f,circle_threshold,seeds=None,scale=0.25,step=2,crop_size=None):
+    if seeds is None:
+        seeds = run_circle_coarse(image, _radius_, circle_threshold, step=step, scale=scale)
+    transposed_fiducial = get_transposed_fiducials(seeds, np.array(circles_f, dtype=float))
+    crop_size = crop_size or 2 * _radius_
+    crops, x_min, y_min = get_position_crops(image, transposed_fiducial, crop_size)
+    circles, likelihoods = run_circle_max_batch(crops, radius=_radius_, step=step)
+    circles[:, 0] += x_min
+    circles[:, 1] += y_min
+    return circles, likelihoods, transposed_fiducial
+
+# For every point of dst, the index of and the distance to the nearest point of src,
+# from a KD-tree instead of the full distance matrix. is_same: dst is src and a point
+# does not match itself. Points without a neighbour within distance_upper_bound get
+# index src.shape[0] and distance inf.
+def find_nearest_points(src,dst,is_same=False,distance_upper_bound=np.inf):
+    tree = cKDTree(src)
+    if not is_same:
+        distance, indices = tree.query(dst, distance_upper_bound=distance_upper_bound, workers=-1)
+        return indices, distance
+    distance, indices = tree.query(dst, k=2, distance_upper_bound=distance_upper_bound, workers=-1)
+    # duplicated points can come before the point itself
+    other = (indices[:, 0] != np.arange(dst.shape[0])).astype(int)
+    rows = np.arange(dst.shape[0])
+    return indices[rows, 1 - other], distance[rows, 1 - other]
+
+# For every point of dst, the indices of the points of src within radius.
+def find_points_within(src,dst,radius):
+    return cKDTree(src).query_ball_point(dst, radius, workers=-1)
+
+def unique_pairs_below_threshold(circle_list, threshold):
+    """Find unique pairs of circles with distance below a given threshold."""
+    if len(circle_list) < 2:
+        return []
+    matrix = np.array([circle[:2] for circle in circle_list], dtype=float)
+    # query_pairs keeps distances up to and including r
+    pairs = cKDTree(matrix).query_pairs(np.nextafter(threshold, 0), output_type='ndarray')
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    name = lambda circle: str(circle[1]) + '_' + str(circle[0]) + '_' + str(circle[2])
+    return [(name(circle_list[i]), name(circle_list[j])) for i, j in pairs]
+
+def remove_overlapping_circles(circle_list, threshold, seed=None):
+    """Remove circles until there are no pairs with distance below the threshold.
+
+    Circles are visited once by decreasing radius, in random order on equal radius,
+    and every kept circle removes the circles closer than the threshold to it.
+    """
+    if len(circle_list) < 2:
+        return circle_list
+    matrix = np.array([circle[:2] for circle in circle_list], dtype=float)
+    radius = np.array([circle[2] for circle in circle_list])
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(circle_list)), -radius))
+    scores = np.empty(len(circle_list))
+    scores[order] = -np.arange(len(circle_list))
+    keep = suppress_close_points(matrix, scores, np.nextafter(threshold, 0))
+    return [circle for circle, k in zip(circle_list, keep) if k]
 
 def save_image(array,filename,format="RGB"):
     if array.max()<1.1:
@@ -0,0 +1,40 @@
+import urllib.request
+import numpy as np
+import torch
+from inference_queue import pack_arrays, unpack_arrays
+
+DEFAULT_SERVER = 'http://127.0.0.1:8765'
+
+
+def post_arrays(url, **arrays):
+    request = urllib.request.Request(url, data=pack_arrays(**arrays),
+                                     headers={'Content-Type': 'application/octet-stream'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return unpack_arrays(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError("Inference server error: " + e.read().decode('utf-8', 'replace'))
+
+
+# Stand-in for the generator returned by get_combined_Generator: takes the
+# normalized image batch and returns the same tuple of output tensors.
+class RemoteGenerator:
+    def __init__(self, server=DEFAULT_SERVER):
+        self.url = server.rstrip('/') + '/generator'
+
+    def __call__(self, img_var):
+        result = post_arrays(self.url, image=img_var.detach().cpu().numpy().astype(np.float32))
+        outputs = tuple(torch.from_numpy(result['output_%d' % i]).to(img_var.device) for i in range(len(result)))
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+# Stand-in for the LaMa inpainter, inpainter(dict(image=..., mask=...))['inpainted'].
+class RemoteInpainter:
+    def __init__(self, server=DEFAULT_SERVER):
+        self.url = server.rstrip('/') + '/inpainter'
+
+    def __call__(self, batch):
+        image = batch['image']
+        result = post_arrays(self.url, image=image.detach().cpu().numpy().astype(np.float32),
+                             mask=batch['mask'].detach().cpu().numpy().astype(np.float32))
+        return dict(batch, inpainted=torch.from_numpy(result['inpainted']).to(image.device))
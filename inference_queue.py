@@ -0,0 +1,112 @@
+import io
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+import numpy as np
+
+
+# Arrays travel as uncompressed npz in both directions.
+def pack_arrays(**arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def unpack_arrays(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return {key: arrays[key] for key in arrays.files}
+
+
+class Job:
+    def __init__(self, kind, arrays):
+        self.kind = kind
+        self.arrays = arrays
+        # only jobs with the same kind and input shapes are batched together
+        self.key = (kind,) + tuple((name, arrays[name].shape[1:]) for name in sorted(arrays))
+        self.size = next(iter(arrays.values())).shape[0]
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# One worker thread owns the models. It takes the oldest job, waits up to
+# max_wait seconds for more jobs with the same key and runs them as one batch.
+class InferenceQueue:
+    def __init__(self, runners, max_batch=8, max_wait=0.01):
+        self.runners = runners
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.jobs = queue.Queue()
+        self.pending = []
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.worker.start()
+
+    def submit(self, kind, arrays):
+        if kind not in self.runners:
+            raise KeyError("Unknown job " + kind)
+        job = Job(kind, arrays)
+        self.jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def next_batch(self):
+        first = self.pending.pop(0) if self.pending else self.jobs.get()
+        batch = [job for job in self.pending if job.key == first.key][:self.max_batch - 1]
+        self.pending = [job for job in self.pending if job not in batch]
+        batch.insert(0, first)
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                job = self.jobs.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if job.key == first.key:
+                batch.append(job)
+            else:
+                self.pending.append(job)
+        return batch
+
+    def work(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                arrays = {name: np.concatenate([job.arrays[name] for job in batch]) for name in batch[0].arrays}
+                outputs = self.runners[batch[0].kind](**arrays)
+                start = 0
+                for job in batch:
+                    job.result = {name: output[start:start + job.size] for name, output in outputs.items()}
+                    start += job.size
+            except Exception as e:
+                for job in batch:
+                    job.error = e
+            for job in batch:
+                job.done.set()
+
+
+def get_handler(inference_queue):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.reply(200, b'ok', 'text/plain')
+
+        def do_POST(self):
+            try:
+                arrays = unpack_arrays(self.rfile.read(int(self.headers['Content-Length'])))
+                result = inference_queue.submit(self.path.strip('/'), arrays)
+            except Exception as e:
+                self.reply(500, repr(e).encode('utf-8'), 'text/plain')
+                return
+            self.reply(200, pack_arrays(**result), 'application/octet-stream')
+
+        def reply(self, code, body, content_type):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return InferenceHandler
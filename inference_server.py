@@ -0,0 +1,47 @@
+import argparse
+from http.server import ThreadingHTTPServer
+import torch
+from cnn_io import get_combined_Generator, get_lama_inpainter, LAMA_PATH
+from inference_queue import InferenceQueue, get_handler
+
+
+def get_generator_runner(generator, device):
+    def run_generator(image):
+        with torch.no_grad():
+            outputs = generator(torch.from_numpy(image).to(device))
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        return {'output_%d' % i: output.cpu().numpy() for i, output in enumerate(outputs)}
+    return run_generator
+
+
+def get_inpainter_runner(inpainter, device):
+    def run_inpainter(image, mask):
+        with torch.no_grad():
+            batch = inpainter(dict(image=torch.from_numpy(image).to(device), mask=torch.from_numpy(mask).to(device)))
+        return {'inpainted': batch['inpainted'].cpu().numpy()}
+    return run_inpainter
+
+
+# Loads the combined generator and the LaMa inpainter once and serves
+# POST /generator and POST /inpainter on localhost, see inference_client.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--max_batch', type=int, default=8, help='largest number of jobs run together')
+    parser.add_argument('--max_wait', type=float, default=0.01, help='seconds to wait for more jobs of a batch')
+    parser.add_argument('--lama_path', type=str, default=LAMA_PATH, help='big-lama model directory')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    generator = get_combined_Generator()
+    generator.eval()
+    generator.to(device)
+    inpainter = get_lama_inpainter(device, args.lama_path)
+
+    runners = {'generator': get_generator_runner(generator, device),
+               'inpainter': get_inpainter_runner(inpainter, device)}
+    inference_queue = InferenceQueue(runners, args.max_batch, args.max_wait)
+    server = ThreadingHTTPServer((args.host, args.port), get_handler(inference_queue))
+    print('Serving on http://%s:%d' % (args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,32 @@
+import numpy as np
+import cv2
+from pix2pix.patch_annotation import upsample_blocks, multiply_blocks
+
+
+def get_image_mask_from_annotation(image_size,annotation,step):
+    return upsample_blocks(annotation, step, image_size, dtype=float)
+
+def get_binary_mask(network_mask):
+ #   Apply Gaussian blur
+    blurred_mask = cv2.GaussianBlur(network_mask, (3, 3), 0)
+
+    threshold = 0.2  # This can be adjusted based on your observations
+    _, binary_mask = cv2.threshold(blurred_mask, threshold, 1, cv2.THRESH_BINARY)
+    binary_mask = binary_mask.astype(np.uint8)
+    return binary_mask
+
+def get_cnn_position_mask(cnn_mask,position,patch_size):
+    # position is the patch grid, a mask of the image size still works
+    if position.shape[:2] != cnn_mask.shape[:2]:
+        cnn_position_mask = multiply_blocks(cnn_mask, position, patch_size)
+    else:
+        cnn_position_mask = cnn_mask*position
+    return get_binary_mask(cnn_position_mask)
+
+# The masks handed back to the callers are all of the image size, the position
+# grid is only upsampled here, after get_cnn_position_mask used it block-wise
+def get_image_masks(cnn_mask,position,patch_size):
+    cnn_position_mask = get_cnn_position_mask(cnn_mask, position, patch_size)
+    if position.shape[:2] != cnn_mask.shape[:2]:
+        position = get_image_mask_from_annotation(cnn_mask.shape[:2], position, patch_size)
+    return cnn_mask, position, cnn_position_mask
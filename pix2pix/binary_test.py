@@ -7,20 +7,14 @@ from torchvision.utils import save_image
 
 from models import *
 from datasets import *
+from patch_annotation import upsample_blocks
 import torch
 from matplotlib import pyplot as plt
 
 
 
 def get_image_mask_from_annotation(image_size,annotation,step):
-    image_mask = np.zeros(image_size)
-
-    for i in range(annotation.shape[0]):
-        for j in range(annotation.shape[1]):
-            patch_x = i * step
-            patch_y = j * step
-            image_mask[patch_x:patch_x + step, patch_y:patch_y + step] = annotation[i, j]
-    return image_mask
+    return upsample_blocks(annotation, step, image_size, dtype=float)
 
 
 parser = argparse.ArgumentParser()
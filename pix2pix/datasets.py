@@ -12,6 +12,7 @@ import numpy as np
 import cv2
 from matplotlib import pyplot as plt
 import random
+from patch_annotation import annotate_patches as rasterize_patches
 SAVE_ROOT = '/media/huifang/data/fiducial/annotation/'
 
 def get_augmentation_parameters():
@@ -119,31 +120,7 @@ def get_annotated_circles(annotation_path):
     return in_circle_meta, out_circle_meta
 
 def annotate_patches(image_size, step, circles):
-    w,h = image_size
-    num_patches_w = w // step
-    num_patches_h = h // step
-
-    annotation = np.zeros((num_patches_w, num_patches_h), dtype=float)
-    for i in range(num_patches_w):
-        for j in range(num_patches_h):
-            patch_x = i * step
-            patch_y = j * step
-            patch_rect = (patch_x, patch_y, step, step)
-
-            for circle in circles:
-                circle_x, circle_y, circle_radius = circle[:3]
-                circle_radius = circle_radius+2
-                circle_rect = (circle_y - circle_radius,circle_x - circle_radius,  2 * circle_radius, 2 * circle_radius)
-                if rectangles_intersect(patch_rect, circle_rect):
-                    annotation[i, j] = 1.0
-                    break
-    return annotation
-
-def rectangles_intersect(rect1, rect2):
-    x1, y1, w1, h1 = rect1
-    x2, y2, w2, h2 = rect2
-
-    return not (x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1)
+    return rasterize_patches(image_size, step, circles, padding=2, dtype=float)
 
 def annotate_dots(image_size, circles):
     w,h = image_size
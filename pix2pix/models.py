@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 from utils import trunc_normal_
 import math
+import collections
+import functools
 
 def weights_init_normal(m):
     classname = m.__class__.__name__
@@ -158,6 +160,80 @@ class Block(nn.Module):
 
 
 
+POS_ENCODING_CACHE_SIZE = 8
+
+def get_pos_encoding_cache(generator):
+    pos_embed = generator.pos_embed
+    version = (pos_embed.data_ptr(), pos_embed._version, pos_embed.device, pos_embed.dtype)
+    if getattr(generator, 'pos_encoding_version', None) != version:
+        generator.pos_encoding_cache = collections.OrderedDict()
+        generator.pos_encoding_version = version
+    return generator.pos_encoding_cache
+
+
+# Memoizes interpolate_pos_encoding per image size (w, h) in eval mode, most
+# slides share a few sizes. The cache is dropped when pos_embed is updated in
+# place, loaded or moved. Training always interpolates, so gradients still reach
+# pos_embed.
+def cached_pos_encoding(interpolate_pos_encoding):
+    @functools.wraps(interpolate_pos_encoding)
+    def wrapper(self, patches, w, h):
+        if self.training:
+            return interpolate_pos_encoding(self, patches, w, h)
+        cache = get_pos_encoding_cache(self)
+        key = (int(w), int(h))
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            with torch.no_grad():
+                cache[key] = interpolate_pos_encoding(self, patches, w, h)
+            while len(cache) > getattr(self, 'pos_encoding_cache_size', POS_ENCODING_CACHE_SIZE):
+                cache.popitem(last=False)
+        return cache[key]
+    return wrapper
+
+
+# Position encoding the generator adds for a w x h input. The patches argument
+# is replaced by a broadcast view with the right patch grid.
+def get_pos_encoding(generator, w, h, patch_size=32):
+    w0, h0 = w // patch_size, h // patch_size
+    patches = torch.empty(1, 1, 1, 1, device=generator.pos_embed.device).expand(1, w0 * h0, w0, h0)
+    return generator.interpolate_pos_encoding(patches, w, h)
+
+
+# Interpolates the encodings of the given (w, h) image sizes into the cache.
+def precompute_pos_encodings(generator, sizes, patch_size=32):
+    training = generator.training
+    generator.eval()
+    sizes = [(int(w), int(h)) for w, h in sizes]
+    generator.pos_encoding_cache_size = max(getattr(generator, 'pos_encoding_cache_size', POS_ENCODING_CACHE_SIZE),
+                                            len(sizes))
+    for w, h in sizes:
+        get_pos_encoding(generator, w, h, patch_size)
+    generator.train(training)
+    return {size: get_pos_encoding_cache(generator)[size] for size in sizes}
+
+
+def save_pos_encodings(generator, sizes, path):
+    encodings = precompute_pos_encodings(generator, sizes)
+    torch.save({'pos_embed': generator.pos_embed.detach().cpu(),
+                'encodings': {size: encoding.cpu() for size, encoding in encodings.items()}}, path)
+
+
+# Fills the cache from save_pos_encodings. Returns False and leaves the cache
+# alone when the file was made for other weights.
+def load_pos_encodings(generator, path):
+    saved = torch.load(path, map_location='cpu')
+    if not torch.equal(saved['pos_embed'], generator.pos_embed.detach().cpu()):
+        return False
+    generator.pos_encoding_cache_size = max(getattr(generator, 'pos_encoding_cache_size', POS_ENCODING_CACHE_SIZE),
+                                            len(saved['encodings']))
+    cache = get_pos_encoding_cache(generator)
+    for size, encoding in saved['encodings'].items():
+        cache[size] = encoding.to(generator.pos_embed.device, generator.pos_embed.dtype)
+    return True
+
+
 ##############################
 #           attention Generators
 ##############################
@@ -254,6 +330,7 @@ class Patch_Binary_Generator(nn.Module):
 
         # self.apply(self._init_weights)
 
+    @cached_pos_encoding
     def interpolate_pos_encoding(self, patches, w, h):
 
         npatch = patches.shape[1]
@@ -275,20 +352,24 @@ class Patch_Binary_Generator(nn.Module):
         return  patch_pos_embed
 
 
-    def forward(self, x):
+    # pos_embed can be passed in, e.g. by the exported graphs which cannot interpolate it
+    def forward(self, x, pos_embed=None):
 
         B, nc, w, h = x.shape
 
         patches = divide_batch_into_patches(x, self.patch_size)
-        pos_embed = self.interpolate_pos_encoding(patches, w, h)
+        if pos_embed is None:
+            pos_embed = self.interpolate_pos_encoding(patches, w, h)
 
 
-        patches = patches.squeeze()
+        # B x N x C x p x p -> B*N x C x p x p
+        num_patches = patches.shape[1]
+        patches = patches.view(B * num_patches, *patches.shape[2:])
         d1 = self.down1(patches)
         d2 = self.down2(d1)
         d3 = self.down3(d2)
         d4 = self.down4(d3)
-        d4_flatten = d4.flatten(1).unsqueeze(0)
+        d4_flatten = d4.flatten(1).view(B, num_patches, -1)
 
         d4_flatten_with_pe = d4_flatten + 5*pos_embed
         for blk in self.blocks:
@@ -298,7 +379,7 @@ class Patch_Binary_Generator(nn.Module):
         y = self.head(d4_flatten_with_pe)
         num_patches_w = w // self.patch_size
         num_patches_h = h // self.patch_size
-        y = y.view(1,num_patches_w,num_patches_h)
+        y = y.view(B,num_patches_w,num_patches_h)
 
         # d4_attention = d4_flatten_with_pe.squeeze().view(d4.shape)
         # u1 = self.up1(d4_attention, d3)
@@ -353,6 +434,7 @@ class Attention_Generator(nn.Module):
 
 
 
+    @cached_pos_encoding
     def interpolate_pos_encoding(self, patches, w, h):
 
         npatch = patches.shape[-2]*patches.shape[-1]
@@ -389,7 +471,7 @@ class Attention_Generator(nn.Module):
             d5_flatten_with_pe = blk(d5_flatten_with_pe)
         d5_flatten_with_pe = self.norm(d5_flatten_with_pe)
 
-        d5_attention = d5_flatten_with_pe.transpose(1,2).squeeze().view(d5.shape)
+        d5_attention = d5_flatten_with_pe.transpose(1,2).reshape(d5.shape)
         if self.with_skip_connection:
             u1 = self.up1(d5_attention, d4)
             u2 = self.up2(u1, d3)
@@ -452,6 +534,7 @@ class Parrel_Attention_Generator(nn.Module):
             )
 
 
+    @cached_pos_encoding
     def interpolate_pos_encoding(self, patches, w, h):
 
         npatch = patches.shape[1]
@@ -496,14 +579,16 @@ class Parrel_Attention_Generator(nn.Module):
         B, nc, w, h = x.shape
         patches = divide_batch_into_patches(x, self.patch_size)
         pos_embed = self.interpolate_pos_encoding(patches, w, h)
-        patches = patches.squeeze()
+        # B x N x C x p x p -> B*N x C x p x p
+        num_patches = patches.shape[1]
+        patches = patches.view(B * num_patches, *patches.shape[2:])
         d1 = self.down1(patches)
         d2 = self.down2(d1)
         d3 = self.down3(d2)
         d4 = self.down4(d3)
         d5 = self.down5(d4)
 
-        d5_flatten = d5.flatten(1).unsqueeze(0)
+        d5_flatten = d5.flatten(1).view(B, num_patches, -1)
 
         d5_flatten_with_pe = d5_flatten + 5 * pos_embed
         for blk in self.blocks:
@@ -513,7 +598,7 @@ class Parrel_Attention_Generator(nn.Module):
         y = self.head(d5_flatten_with_pe)
         num_patches_w = w // self.patch_size
         num_patches_h = h // self.patch_size
-        transformer_output = y.view(1, num_patches_w, num_patches_h)
+        transformer_output = y.view(B, num_patches_w, num_patches_h)
         return unet_output,transformer_output
 
 
@@ -558,6 +643,7 @@ class Rich_Parrel_Attention_Generator(nn.Module):
                 nn.Sigmoid()
             )
 
+    @cached_pos_encoding
     def interpolate_pos_encoding(self, patches, w, h):
         npatch = patches.shape[1]
         N = self.pos_embed.shape[1]
@@ -577,7 +663,8 @@ class Rich_Parrel_Attention_Generator(nn.Module):
         patch_pos_embed = patch_pos_embed.permute(0, 2, 3, 1).view(1, -1, dim)
         return patch_pos_embed
 
-    def forward(self, x):
+    # pos_embed can be passed in, e.g. by the exported graphs which cannot interpolate it
+    def forward(self, x, pos_embed=None):
         # circle mask output
         d1 = self.down1(x)
         d2 = self.down2(d1)
@@ -597,14 +684,17 @@ class Rich_Parrel_Attention_Generator(nn.Module):
         # binary transformer output
         B, nc, w, h = x.shape
         patches = divide_batch_into_patches(x, self.patch_size)
-        pos_embed = self.interpolate_pos_encoding(patches, w, h)
-        patches = patches.squeeze()
+        if pos_embed is None:
+            pos_embed = self.interpolate_pos_encoding(patches, w, h)
+        # patches of all images go through the encoder together, B x N x C x p x p -> B*N x C x p x p
+        num_patches = patches.shape[1]
+        patches = patches.view(B * num_patches, *patches.shape[2:])
         d1 = self.down1(patches)
         d2 = self.down2(d1)
         d3 = self.down3(d2)
         d4 = self.down4(d3)
 
-        d4_flatten = d4.flatten(1).unsqueeze(0)
+        d4_flatten = d4.flatten(1).view(B, num_patches, -1)
 
         d4_flatten_with_pe = d4_flatten + 5 * pos_embed
         for blk in self.blocks:
@@ -613,7 +703,7 @@ class Rich_Parrel_Attention_Generator(nn.Module):
         y = self.head(d4_flatten_with_pe)
         num_patches_w = w // self.patch_size
         num_patches_h = h // self.patch_size
-        transformer_output = y.view(1, num_patches_w, num_patches_h)
+        transformer_output = y.view(B, num_patches_w, num_patches_h)
         return unet_output, transformer_output
 
 
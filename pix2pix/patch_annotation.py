@@ -0,0 +1,81 @@
+import numpy as np
+
+
+# Boolean grid with the cells [r0, r1) x [c0, c1) of every box set. The boxes are
+# added as +1/-1 corners and summed up once, instead of being drawn one by one.
+def fill_boxes(shape, r0, r1, c0, c1):
+    rows, cols = shape
+    r0 = np.clip(r0, 0, rows)
+    r1 = np.clip(r1, 0, rows)
+    c0 = np.clip(c0, 0, cols)
+    c1 = np.clip(c1, 0, cols)
+    valid = (r1 > r0) & (c1 > c0)
+    r0, r1, c0, c1 = r0[valid], r1[valid], c0[valid], c1[valid]
+    index = np.concatenate((r0 * (cols + 1) + c0, r0 * (cols + 1) + c1, r1 * (cols + 1) + c0, r1 * (cols + 1) + c1))
+    weight = np.repeat([1, -1, -1, 1], r0.shape[0])
+    corners = np.bincount(index, weights=weight, minlength=(rows + 1) * (cols + 1)).reshape(rows + 1, cols + 1)
+    return corners.cumsum(axis=0).cumsum(axis=1)[:rows, :cols] > 0
+
+
+def get_circle_array(circles):
+    return np.array([circle[:3] for circle in circles], dtype=float).reshape(-1, 3)
+
+
+# Patch (i, j) covers rows [i * step, (i + 1) * step) and columns [j * step, (j + 1) * step),
+# it is set when it overlaps the bounding box of a circle grown by padding.
+def annotate_patches(image_size, step, circles, padding=1, dtype=int):
+    circles = get_circle_array(circles)
+    radius = circles[:, 2] + padding
+    r0 = np.floor((circles[:, 1] - radius) / step).astype(np.int64)
+    r1 = np.ceil((circles[:, 1] + radius) / step).astype(np.int64)
+    c0 = np.floor((circles[:, 0] - radius) / step).astype(np.int64)
+    c1 = np.ceil((circles[:, 0] + radius) / step).astype(np.int64)
+    annotation = fill_boxes((image_size[0] // step, image_size[1] // step), r0, r1, c0, c1)
+    return annotation.astype(dtype)
+
+
+# Pixel mask with a patch_size square around every circle center.
+def annotate_continuous_patches(image_size, patch_size, circles):
+    circles = get_circle_array(circles)
+    half_patch = patch_size // 2
+    r0 = np.trunc(circles[:, 1] - half_patch).astype(np.int64)
+    r1 = np.trunc(circles[:, 1] + half_patch).astype(np.int64)
+    c0 = np.trunc(circles[:, 0] - half_patch).astype(np.int64)
+    c1 = np.trunc(circles[:, 0] + half_patch).astype(np.int64)
+    return fill_boxes(tuple(image_size[:2]), r0, r1, c0, c1).astype(np.uint8)
+
+
+# Read-only view of shape (rows, step, cols, step, ...) where every grid cell is
+# repeated over its block, nothing is copied.
+def get_block_view(grid, step):
+    grid = np.asarray(grid)
+    block_grid = grid[:, np.newaxis, :, np.newaxis]
+    return np.broadcast_to(block_grid, (grid.shape[0], step, grid.shape[1], step) + grid.shape[2:])
+
+
+# Pixel mask where every grid cell fills its step x step block, extra axes such as
+# channels are kept. With image_size the mask is cropped or zero padded to it,
+# like the nested loops it replaces.
+def upsample_blocks(grid, step, image_size=None, dtype=None):
+    grid = np.asarray(grid, dtype=dtype)
+    mask = get_block_view(grid, step).reshape((grid.shape[0] * step, grid.shape[1] * step) + grid.shape[2:])
+    if image_size is None or tuple(image_size[:2]) == mask.shape[:2]:
+        return mask
+    image_mask = np.zeros(tuple(image_size[:2]) + grid.shape[2:], dtype=grid.dtype)
+    h = min(image_mask.shape[0], mask.shape[0])
+    w = min(image_mask.shape[1], mask.shape[1])
+    image_mask[:h, :w] = mask[:h, :w]
+    return image_mask
+
+
+# image * upsample_blocks(grid, step, image.shape) without the upsampled mask. The
+# image is viewed as blocks and multiplied with the grid view, falling back to the
+# upsampled mask when the grid does not tile the image exactly.
+def multiply_blocks(image, grid, step):
+    image = np.asarray(image)
+    grid = np.asarray(grid)
+    rows, cols = image.shape[0] // step, image.shape[1] // step
+    if image.shape[0] % step or image.shape[1] % step or grid.shape[:2] != (rows, cols):
+        return image * upsample_blocks(grid, step, image.shape)
+    blocks = image.reshape((rows, step, cols, step) + image.shape[2:])
+    return (blocks * get_block_view(grid, step)).reshape(image.shape)
@@ -0,0 +1,104 @@
+import argparse
+import io
+import os
+import time
+import numpy as np
+import torch
+from PIL import Image
+import torchvision.transforms as transforms
+from cnn_io import get_circle_Generator, get_position_Generator, get_combined_Generator, get_exported_path, \
+    prepare_int8_generator, convert_int8_generator
+from pix2pix.datasets import find_nearest_multiple_of_32
+
+GENERATORS = {'circle': get_circle_Generator, 'position': get_position_Generator, 'combined': get_combined_Generator}
+transforms_rgb = transforms.Compose([transforms.ToTensor(),
+                                     transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
+
+
+# Same input as get_image_var in the remover scripts
+def get_image_var(image_name):
+    img_pil = Image.open(image_name).convert('RGB')
+    h, w = img_pil.size
+    img_pil = img_pil.resize((find_nearest_multiple_of_32(h), find_nearest_multiple_of_32(w)), Image.LANCZOS)
+    return torch.unsqueeze(transforms_rgb(img_pil), dim=0)
+
+
+def read_image_list(image_list_path):
+    f = open(image_list_path, 'r')
+    files = [line.split(' ')[0].rstrip('\n') for line in f.readlines()]
+    f.close()
+    return files
+
+
+def run_generator(generator, img_var):
+    with torch.no_grad():
+        outputs = generator(img_var)
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+def calculate_iou(mask1, mask2):
+    union = np.logical_or(mask1, mask2).sum()
+    return np.logical_and(mask1, mask2).sum() / union if union else 1.0
+
+
+def get_model_size(generator):
+    buffer = io.BytesIO()
+    torch.save(generator.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def calibrate(generator, image_names):
+    prepared = prepare_int8_generator(generator)
+    for image_name in image_names:
+        run_generator(prepared, get_image_var(image_name))
+    return convert_int8_generator(prepared)
+
+
+# IoU of the binarized fp32 and int8 outputs (fiducial circle mask first) and
+# the seconds per image of both models
+def compare(generator, quantized, image_names, threshold=0.5):
+    ious = []
+    timings = []
+    for image_name in image_names:
+        img_var = get_image_var(image_name)
+        timing = []
+        outputs = []
+        for model in (generator, quantized):
+            start_time = time.time()
+            outputs.append(run_generator(model, img_var))
+            timing.append(time.time() - start_time)
+        ious.append([calculate_iou(a.numpy() > threshold, b.numpy() > threshold) for a, b in zip(*outputs)])
+        timings.append(timing)
+    return np.array(ious), np.array(timings)
+
+
+# Calibrates the static int8 UNet layers on the first images of a list, saves the
+# weights for get_*_Generator(backend="int8") and reports the accuracy on the next ones
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='combined', choices=sorted(GENERATORS), help='generator to quantize')
+    parser.add_argument('--image_list', type=str,
+                        default='/home/huifang/workspace/data/imagelists/st_trainable_images_final.txt',
+                        help='image list, the first path of every line is used')
+    parser.add_argument('--n_calibration', type=int, default=32, help='images used for calibration')
+    parser.add_argument('--n_evaluation', type=int, default=16, help='images used for the accuracy report')
+    parser.add_argument('--num_threads', type=int, default=None, help='CPU threads, all cores by default')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads or os.cpu_count())
+    image_names = read_image_list(args.image_list)
+    calibration_names = image_names[:args.n_calibration]
+    evaluation_names = image_names[args.n_calibration:args.n_calibration + args.n_evaluation] or calibration_names
+
+    generator = GENERATORS[args.model]().eval()
+    quantized = calibrate(generator, calibration_names)
+    path = get_exported_path(args.model, 'int8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(quantized.state_dict(), path)
+    print('Saved ' + path)
+
+    ious, timings = compare(generator, quantized, evaluation_names)
+    for i in range(ious.shape[1]):
+        print('output %d IoU fp32 vs int8: mean %.4f min %.4f' % (i, ious[:, i].mean(), ious[:, i].min()))
+    print('seconds per image: fp32 %.3f int8 %.3f' % (timings[:, 0].mean(), timings[:, 1].mean()))
+    print('weights: fp32 %.1f MB int8 %.1f MB' % (get_model_size(generator) / 2 ** 20, get_model_size(quantized) / 2 ** 20))
@@ -0,0 +1,90 @@
+from __future__ import division
+import numpy as np
+
+# Visium v1/v2 capture area: 78 rows of 64 spots on a hexagonal lattice with a
+# 100 um pitch, array_col runs over 0..127 with the parity of array_row.
+SPOT_ROWS = 78
+SPOT_COLS = 128
+SPOT_PITCH = 100
+# Approximate distance in um between the outer fiducial centers, the template
+# square_scale spans the same distance in template pixels.
+FRAME_SIZE = 8000
+TISSUE_POSITIONS_HEADER = 'barcode,in_tissue,array_row,array_col,pxl_row_in_fullres,pxl_col_in_fullres'
+
+
+# Spot centers in template pixels (x, y), centered on the template frame.
+# hexagonal=False gives a square lattice such as the HD bins, e.g. pitch=2.
+def get_spot_lattice(template, n_rows=SPOT_ROWS, n_cols=SPOT_COLS, pitch=SPOT_PITCH, hexagonal=True,
+                     frame_size=FRAME_SIZE):
+    pixel_size = template.square_scale / frame_size
+    array_row, array_col = np.mgrid[0:n_rows, 0:n_cols]
+    if hexagonal:
+        keep = (array_row % 2) == (array_col % 2)
+        array_row, array_col = array_row[keep], array_col[keep]
+        x = (array_col - (n_cols - 1) / 2) * pitch / 2
+        y = (array_row - (n_rows - 1) / 2) * pitch * np.sqrt(3) / 2
+    else:
+        array_row, array_col = array_row.ravel(), array_col.ravel()
+        x = (array_col - (n_cols - 1) / 2) * pitch
+        y = (array_row - (n_rows - 1) / 2) * pitch
+    xy = np.stack((template.framecenter_x + x * pixel_size, template.framecenter_y + y * pixel_size), axis=1)
+    return array_row, array_col, xy
+
+
+# Least squares affine transform mapping src points onto dst points, returned
+# as a 3 x 3 homogeneous matrix like the icp transforms.
+def fit_affine(src, dst):
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    A = np.hstack((src, np.ones((src.shape[0], 1))))
+    M = np.linalg.lstsq(A, dst, rcond=None)[0]
+    T = np.identity(3)
+    T[:2, :] = M.T
+    return T
+
+
+def apply_transform(T, points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ T[:2, :2].T + T[:2, 2]
+
+
+# Template frame corners in the order of fit_points_to_square.
+def get_frame_corners(template):
+    half = template.square_scale / 2
+    cx, cy = template.framecenter_x, template.framecenter_y
+    return np.array([[cx - half, cy - half], [cx + half, cy - half], [cx + half, cy + half], [cx - half, cy + half]])
+
+
+# Spot grid in image pixels. image_points are the template circles after
+# get_transposed_fiducials (same order as template.circles), or the four corners
+# returned by fit_points_to_square when frame=True.
+def get_spot_grid(template, image_points, frame=False, **lattice_args):
+    src = get_frame_corners(template) if frame else template.circles[:, :2]
+    T = fit_affine(src, np.asarray(image_points)[:, :2])
+    array_row, array_col, xy = get_spot_lattice(template, **lattice_args)
+    return array_row, array_col, apply_transform(T, xy)
+
+
+# In-tissue flags of all spots in one gather. scale maps image pixels to mask
+# pixels, e.g. the ratios returned by tissue_segmentation.get_image, spots
+# outside the mask are out of tissue.
+def sample_tissue_mask(mask, xy, scale=1):
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), (2,))
+    rows = np.round(xy[:, 1] * scale[0]).astype(np.int64)
+    cols = np.round(xy[:, 0] * scale[1]).astype(np.int64)
+    inside = (rows >= 0) & (rows < mask.shape[0]) & (cols >= 0) & (cols < mask.shape[1])
+    in_tissue = np.zeros(xy.shape[0], dtype=np.uint8)
+    in_tissue[inside] = np.asarray(mask)[rows[inside], cols[inside]] > 0
+    return in_tissue
+
+
+# tissue_positions.csv with the Space Ranger columns. Without the slide barcode
+# whitelist the spots are named by their array position.
+def save_tissue_positions(path, array_row, array_col, xy, in_tissue, barcodes=None):
+    if barcodes is None:
+        barcodes = np.char.add(np.char.add(np.asarray(array_row).astype(str), 'x'), np.asarray(array_col).astype(str))
+    table = np.stack((np.asarray(barcodes).astype(str), np.asarray(in_tissue).astype(str),
+                      np.asarray(array_row).astype(str), np.asarray(array_col).astype(str),
+                      np.round(xy[:, 1]).astype(np.int64).astype(str),
+                      np.round(xy[:, 0]).astype(np.int64).astype(str)), axis=1)
+    np.savetxt(path, table, fmt='%s', delimiter=',', header=TISSUE_POSITIONS_HEADER, comments='')
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules import each other as top level modules, pix2pix/models.py imports its own utils
+sys.path.insert(0, os.path.join(ROOT, 'pix2pix'))
+sys.path.insert(0, ROOT)
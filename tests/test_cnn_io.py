@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+torch = pytest.importorskip('torch')
+cnn_io = pytest.importorskip('cnn_io')
+
+
+def test_run_generator_buckets_matches_single_images():
+    torch.manual_seed(0)
+    generator = cnn_io.Rich_Parrel_Attention_Generator().eval()
+    # two sizes, the first bucket is split into batches of two and one
+    sizes = [(64, 96), (96, 64), (64, 96), (64, 96), (96, 64)]
+    image_vars = [torch.rand(1, 3, w, h) * 2 - 1 for w, h in sizes]
+    outputs = cnn_io.run_generator_buckets(generator, image_vars, max_batch=2)
+    assert len(outputs) == len(image_vars)
+    with torch.no_grad():
+        for image_var, output in zip(image_vars, outputs):
+            expected = generator(image_var)
+            assert len(output) == len(expected)
+            for a, b in zip(output, expected):
+                assert a.shape == b.shape
+                assert torch.allclose(a, b, atol=1e-5)
+
+
+def test_run_generator_buckets_one_call_per_batch():
+    calls = []
+
+    def generator(x):
+        calls.append(tuple(x.shape))
+        return x * 2, x.mean(dim=1)
+    sizes = [(64, 96), (96, 64), (64, 96), (64, 96), (96, 64), (64, 96), (64, 96)]
+    image_vars = [torch.full((1, 3, w, h), float(i)) for i, (w, h) in enumerate(sizes)]
+    outputs = cnn_io.run_generator_buckets(generator, image_vars, max_batch=2)
+    # buckets in order of their first image, split into batches of at most 2
+    assert calls == [(2, 3, 64, 96), (2, 3, 64, 96), (1, 3, 64, 96), (2, 3, 96, 64)]
+    for image_var, output in zip(image_vars, outputs):
+        assert torch.equal(output[0], image_var * 2)
+        assert torch.equal(output[1], image_var.mean(dim=1))
+
+
+def test_int8_generator_matches_fp32(tmp_path, monkeypatch):
+    if 'fbgemm' not in torch.backends.quantized.supported_engines:
+        pytest.skip('no fbgemm quantized engine')
+    torch.manual_seed(0)
+    generator = cnn_io.Rich_Parrel_Attention_Generator().eval()
+    calibration = [torch.rand(1, 3, 64, 64) * 2 - 1 for _ in range(4)]
+
+    # same steps as quantize_generators.py, the weights land in ./exported
+    prepared = cnn_io.prepare_int8_generator(generator)
+    with torch.no_grad():
+        for x in calibration:
+            prepared(x)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(cnn_io.EXPORT_DIR)
+    torch.save(cnn_io.convert_int8_generator(prepared).state_dict(), cnn_io.get_exported_path('test', 'int8'))
+
+    quantized = cnn_io.get_generator_backend(generator, 'test', 'int8')
+    # the scripts move every backend to their device, the int8 model stays on the CPU
+    assert quantized.to('cuda') is quantized
+    assert quantized.cuda() is quantized
+    quantized.eval()
+
+    x = torch.cat(calibration[:2])
+    with torch.no_grad():
+        expected = generator(x)
+    outputs = quantized(x)
+    assert len(outputs) == len(expected)
+    for a, b in zip(outputs, expected):
+        assert a.shape == b.shape
+        assert a.device == x.device
+        assert float((a - b).abs().mean()) < 0.05
+
+
+def test_int8_calibration_and_comparison(tmp_path):
+    if 'fbgemm' not in torch.backends.quantized.supported_engines:
+        pytest.skip('no fbgemm quantized engine')
+    quantize_generators = pytest.importorskip('quantize_generators')
+    rng = np.random.default_rng(0)
+    image_names = []
+    for i in range(3):
+        image_names.append(str(tmp_path / ('%d.png' % i)))
+        Image.fromarray(rng.integers(0, 256, (96, 128, 3), dtype=np.uint8)).save(image_names[-1])
+    torch.manual_seed(0)
+    generator = cnn_io.Rich_Parrel_Attention_Generator().eval()
+    quantized = quantize_generators.calibrate(generator, image_names[:2])
+    ious, timings = quantize_generators.compare(generator, quantized, image_names[2:])
+    n_outputs = len(quantize_generators.run_generator(generator, quantize_generators.get_image_var(image_names[2])))
+    assert ious.shape == (1, n_outputs)
+    assert np.all((ious >= 0) & (ious <= 1))
+    assert timings.shape == (1, 2)
+
+
+# The accuracy bound needs the trained weights and the slide images, it only runs
+# where they are
+def test_int8_iou_of_the_trained_generator():
+    if 'fbgemm' not in torch.backends.quantized.supported_engines:
+        pytest.skip('no fbgemm quantized engine')
+    quantize_generators = pytest.importorskip('quantize_generators')
+    image_list = '/home/huifang/workspace/data/imagelists/st_trainable_images_final.txt'
+    if not os.path.exists(image_list):
+        pytest.skip('no image list')
+    try:
+        generator = cnn_io.get_combined_Generator().eval()
+    except FileNotFoundError:
+        pytest.skip('no trained weights')
+    image_names = quantize_generators.read_image_list(image_list)[:24]
+    quantized = quantize_generators.calibrate(generator, image_names[:16])
+    ious, _ = quantize_generators.compare(generator, quantized, image_names[16:])
+    # the fiducial circle mask comes first
+    assert ious[:, 0].mean() >= 0.95
+    assert ious[:, 0].min() >= 0.9
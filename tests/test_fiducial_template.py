@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import fiducial_template
+import fiducial_utils
+
+
+def test_get_template_does_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    template = fiducial_utils.get_template('mouse')
+    legacy = np.loadtxt(os.path.join(fiducial_template.TEMPLATE_DIR, 'mouse_circles_f.txt'))
+    assert np.array_equal(template.circles, legacy)
+
+
+def test_legacy_text_template_is_read_from_the_template_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fiducial_template, 'TEMPLATE_DIR', str(tmp_path))
+    fiducial_template.load_template.cache_clear()
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[0:8, 0:8]
+    circles = np.stack((cols.ravel() * 20.0, rows.ravel() * 20.0, np.full(64, 5.0)), axis=1)
+    circles[:, :2] += rng.uniform(-1, 1, (64, 2))
+    np.savetxt(str(tmp_path / 'legacy_circles_f.txt'), circles)
+    np.savetxt(str(tmp_path / 'legacy_square_f.txt'), [70.0, 70.0, 140.0])
+    # run from elsewhere, the relative ./template/ would not find the files
+    monkeypatch.chdir(os.path.dirname(str(tmp_path)))
+    try:
+        template = fiducial_utils.get_template('legacy')
+        assert os.path.exists(str(tmp_path / 'legacy.npz'))
+        assert np.allclose(template.circles, circles)
+        assert (template.framecenter_x, template.framecenter_y, template.square_scale) == (70.0, 70.0, 140.0)
+    finally:
+        fiducial_template.load_template.cache_clear()
+
+
+def test_template_tree_is_built_once():
+    template = fiducial_utils.get_template('mouse')
+    tree = template.tree
+    assert fiducial_utils.get_template('mouse').tree is tree
+    _, index = tree.query(template.circles[:5, :2])
+    assert np.array_equal(index, np.arange(5))
@@ -0,0 +1,198 @@
+import numpy as np
+import cv2
+import pytest
+from hough_accumulator import suppress_close_points, get_peak_positions, get_candidate_planes, accumulate_votes, \
+    accumulate_votes_batch, get_radius_stencils, _scatter_votes, quantize_weights, get_vote_dtype, get_circle_stencil
+
+
+def test_suppress_close_points_without_points():
+    keep = suppress_close_points(np.zeros((0, 2)), np.zeros(0), 3)
+    assert keep.shape == (0,)
+    assert keep.dtype == bool
+
+
+def test_get_peak_positions_without_peaks():
+    rows, cols = get_peak_positions(np.zeros((50, 50)), 5, 10)
+    assert rows.shape == (0,) and cols.shape == (0,)
+
+
+def test_get_peak_positions_keeps_first_of_plateau():
+    plane = np.zeros((50, 50))
+    plane[10, 10:13] = 8
+    plane[40, 40] = 9
+    rows, cols = get_peak_positions(plane, 5, 5)
+    assert list(zip(rows, cols)) == [(10, 10), (40, 40)]
+
+
+# maxpooling_in_position as it was before get_peak_positions, the reference
+def maxpooling_in_position(image,position,kernel_size):
+    height, width = image.shape
+    for i in range(position[0].shape[0]):
+        x = position[0][i]
+        y = position[1][i]
+        lower_bound_x = x-kernel_size if x>kernel_size else 0
+        lower_bound_y = y-kernel_size if y>kernel_size else 0
+
+        bound_x = x+kernel_size if x<height-kernel_size else height
+        bound_y = y+kernel_size if y<width-kernel_size else width
+
+        temp = image[lower_bound_x:bound_x,lower_bound_y:bound_y]
+
+        circle_temp = np.where(temp == temp.max())
+        if len(circle_temp[0]) > 1:
+            circle_center = (np.array([circle_temp[0][0]]), np.array([circle_temp[1][0]]))
+        else:
+            circle_center = circle_temp
+
+        temp2 = np.zeros(temp.shape)
+        temp2[circle_center] = temp.max()
+        image[lower_bound_x:bound_x, lower_bound_y:bound_y] = temp2
+
+
+def get_reference_peaks(candidate_centers, circle_threshold, kernel_size):
+    image = candidate_centers.copy()
+    maxpooling_in_position(image, np.where(image > circle_threshold), kernel_size)
+    return np.where(image > circle_threshold)
+
+
+def get_vote_plane_of_circles():
+    image = np.zeros((160, 200), dtype=np.uint8)
+    for x, y in [(30, 30), (90, 35), (150, 40), (40, 110), (100, 120), (170, 125)]:
+        cv2.circle(image, (x, y), 9, 255, 2)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    edges = np.where(cv2.Canny(image, 200, 180) == 255)
+    weight = np.ones(image.shape)
+    candidate_centers, _ = get_candidate_planes(edges, weight, image.shape, np.arange(7, 12), reduction="stream")
+    return candidate_centers
+
+
+@pytest.mark.parametrize('circle_threshold', [2, 5, 10, 20, 30])
+def test_get_peak_positions_matches_maxpooling_on_votes(circle_threshold):
+    candidate_centers = get_vote_plane_of_circles()
+    before = candidate_centers.copy()
+    rows, cols = get_peak_positions(candidate_centers, circle_threshold, 10)
+    expected = get_reference_peaks(candidate_centers, circle_threshold, 10)
+    assert np.array_equal(rows, expected[0]) and np.array_equal(cols, expected[1])
+    assert np.array_equal(candidate_centers, before)
+
+
+@pytest.mark.parametrize('circle_threshold', [0.2, 0.5, 0.8])
+@pytest.mark.parametrize('kernel_size', [1, 4, 10])
+def test_get_peak_positions_matches_maxpooling_on_noise(circle_threshold, kernel_size):
+    rng = np.random.default_rng(kernel_size)
+    # rounded noise has many ties inside one window
+    candidate_centers = np.round(rng.random((80, 70)), 1)
+    rows, cols = get_peak_positions(candidate_centers, circle_threshold, kernel_size)
+    expected = get_reference_peaks(candidate_centers, circle_threshold, kernel_size)
+    assert np.array_equal(rows, expected[0]) and np.array_equal(cols, expected[1])
+
+
+# The octant loop fill_acc_array_with_weight had before the stencils, with the
+# lower bounds checked too
+def fill_acc_array_with_loop(acc_array, edges, height, width, radius_range, weight):
+    for i in range(len(edges[0])):
+        x0, y0 = edges[0][i], edges[1][i]
+        w0 = weight[x0, y0]
+        for j in range(len(radius_range)):
+            x, y = radius_range[j], 0
+            while y < x:
+                for dx, dy in [(x, y), (y, x), (-x, y), (-y, x), (-x, -y), (-y, -x), (x, -y), (y, -x)]:
+                    if 0 <= x0 + dx < height and 0 <= y0 + dy < width:
+                        acc_array[x0 + dx, y0 + dy, j] += w0
+                if x * x + (y + 1) * (y + 1) > radius_range[j] * radius_range[j]:
+                    x = x - 1
+                y = y + 1
+
+
+def get_random_edges(shape, n, seed):
+    rng = np.random.default_rng(seed)
+    weight = rng.random(shape)
+    index = rng.choice(shape[0] * shape[1], n, replace=False)
+    rows, cols = np.unravel_index(np.sort(index), shape)
+    return (rows, cols), weight
+
+
+def test_stencil_scatter_matches_octant_loop():
+    shape = (40, 50)
+    edges, weight = get_random_edges(shape, 120, 0)
+    radius_range = np.arange(3, 9)
+    expected = np.zeros(shape + (len(radius_range),))
+    fill_acc_array_with_loop(expected, edges, shape[0], shape[1], radius_range, weight)
+    assert np.allclose(accumulate_votes(edges, weight, shape, radius_range), expected)
+
+
+@pytest.mark.parametrize('n_chunks', [2, 3, 7])
+def test_parallel_scatter_bands_match_serial(n_chunks):
+    shape = (60, 45)
+    edges, weight = get_random_edges(shape, 300, 1)
+    radius_range = np.arange(4, 10)
+    expected = accumulate_votes(edges, weight, shape, radius_range)
+    acc_array = np.zeros_like(expected)
+    rows, cols = edges[0].astype(np.int64), edges[1].astype(np.int64)
+    offsets, starts = get_radius_stencils(radius_range)
+    _scatter_votes(acc_array, rows, cols, weight[rows, cols], offsets, starts, n_chunks)
+    assert np.allclose(acc_array, expected)
+
+
+def test_batch_votes_match_single_maps():
+    rng = np.random.default_rng(2)
+    weight_maps = rng.random((3, 30, 36)) * (rng.random((3, 30, 36)) > 0.8)
+    radius_range = np.arange(5, 9)
+    acc_array = accumulate_votes_batch(weight_maps, radius_range)
+    for weight_map, votes in zip(weight_maps, acc_array):
+        assert np.allclose(votes, accumulate_votes(np.nonzero(weight_map), weight_map, weight_map.shape, radius_range))
+
+
+def test_fft_votes_match_scatter():
+    shape = (64, 70)
+    edges, weight = get_random_edges(shape, 400, 3)
+    radius_range = np.arange(3, 15)
+    expected = accumulate_votes(edges, weight, shape, radius_range)
+    assert np.allclose(accumulate_votes(edges, weight, shape, radius_range, method="fft"), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('method', ['scatter', 'fft'])
+def test_stream_reduction_matches_full(method):
+    shape = (50, 60)
+    edges, weight = get_random_edges(shape, 300, 4)
+    radius_range = np.arange(4, 11)
+    # binary weights give integer votes with many ties between radii
+    binary = np.ones(shape)
+    full = get_candidate_planes(edges, binary, shape, radius_range, method=method)
+    stream = get_candidate_planes(edges, binary, shape, radius_range, method=method, reduction="stream")
+    assert np.array_equal(stream[0], full[0])
+    assert np.array_equal(stream[1], full[1])
+
+    full = get_candidate_planes(edges, weight, shape, radius_range, method=method)
+    stream = get_candidate_planes(edges, weight, shape, radius_range, method=method, reduction="stream")
+    assert stream[0].dtype == np.float32
+    assert np.allclose(stream[0], full[0], atol=1e-4)
+
+
+def test_quantized_votes_match_float_votes():
+    shape = (48, 56)
+    edges, weight = get_random_edges(shape, 300, 5)
+    radius_range = np.arange(3, 12)
+    dtype = get_vote_dtype(radius_range)
+    expected = accumulate_votes(edges, weight, shape, radius_range)
+    votes = accumulate_votes(edges, quantize_weights(weight), shape, radius_range, dtype=dtype)
+    assert votes.dtype == dtype
+    # every vote is off by at most 0.5 levels, a center gets one vote per stencil offset
+    bound = 0.5 * np.array([get_circle_stencil(r).shape[0] for r in radius_range])
+    assert np.all(np.abs(votes / 255.0 - expected) * 255 <= bound + 1e-6)
+
+    # binary weights are exact
+    binary = np.ones(shape)
+    expected = accumulate_votes(edges, binary, shape, radius_range)
+    votes = accumulate_votes(edges, quantize_weights(binary), shape, radius_range, dtype=dtype)
+    assert np.array_equal(votes, expected * 255)
+
+
+@pytest.mark.parametrize('radius', [5, 40, 41, 80])
+def test_vote_dtype_holds_the_largest_vote(radius):
+    # every pixel of the image is an edge of full weight
+    size = 2 * radius + 1
+    weight = np.full((size, size), 255, dtype=np.uint8)
+    dtype = get_vote_dtype([radius])
+    votes = accumulate_votes(np.nonzero(weight), weight, weight.shape, [radius], dtype=dtype)
+    assert votes[radius, radius, 0] == 255 * get_circle_stencil(radius).shape[0]
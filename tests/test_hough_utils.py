@@ -0,0 +1,286 @@
+import statistics
+import numpy as np
+import cv2
+from scipy.spatial import cKDTree
+from hough_utils import run_circle_threhold, run_circle_threhold_tiled, get_fiducial_circles, HoughSession, \
+    get_padded_crop, run_circle_max_batch, run_circle_pyramid, run_circle_lattice, find_nearest_points, find_points_within, \
+    unique_pairs_below_threshold, remove_overlapping_circles
+
+
+def test_run_circle_threhold_on_blank_image():
+    circles = run_circle_threhold(np.zeros((64, 64)), 10, circle_threshold=20, step=2)
+    assert circles.shape == (0, 3)
+
+
+def draw_circles(shape, centers, radius):
+    image = np.zeros(shape, dtype=np.uint8)
+    for x, y in centers:
+        cv2.circle(image, (int(x), int(y)), radius, 255, 2)
+    return image
+
+
+def test_get_fiducial_circles_default_threshold():
+    centers = np.array([[40, 40], [120, 40], [40, 120], [120, 120]])
+    image = draw_circles((200, 200), centers, 9)
+    # four empty positions, one of them on the image border
+    positions = np.vstack((centers + 2, [[80, 80], [160, 160], [0, 100], [190, 5]]))
+    circles = get_fiducial_circles(image, positions, 16, 9)
+    assert circles.shape == (4, 3)
+    assert np.abs(circles[:, :2] - centers).max() <= 1
+
+
+def test_get_fiducial_circles_without_positions():
+    assert get_fiducial_circles(np.zeros((64, 64)), np.zeros((0, 3)), 16, 9).shape == (0, 3)
+
+
+def test_run_circle_threhold_tiled_with_blank_tile():
+    centers = [(30, 30), (90, 40), (40, 100)]
+    image = draw_circles((128, 256), centers, 9)
+    # the right half of the image is background only
+    circles = run_circle_threhold_tiled(image, 9, circle_threshold=20, step=2, tile_size=128, max_workers=1)
+    expected = run_circle_threhold(image, 9, circle_threshold=20, step=2, reduction="stream")
+    assert circles.shape[0] == len(centers)
+    assert np.array_equal(circles, expected)
+
+
+def test_run_circle_threhold_tiled_on_blank_image():
+    circles = run_circle_threhold_tiled(np.zeros((64, 128)), 9, circle_threshold=20, tile_size=64, max_workers=1)
+    assert circles.shape == (0, 3)
+
+
+def test_hough_session_plane_cache_is_bounded():
+    centers = [(30, 30), (90, 40), (40, 100)]
+    image = draw_circles((128, 128), centers, 9)
+    expected = run_circle_threhold(image, 9, circle_threshold=20, step=2, reduction="stream")
+    streamed = HoughSession(image)
+    assert np.array_equal(streamed.detect(9, circle_threshold=20, step=2), expected)
+    assert len(streamed.planes) == 0
+
+    cached = HoughSession(image, max_planes=3)
+    cached.detect(10, circle_threshold=20, step=3)
+    assert sorted(cached.planes) == [10, 11, 12]
+    assert np.array_equal(cached.detect(9, circle_threshold=20, step=2), expected)
+    assert len(cached.planes) == 3
+
+
+def test_get_padded_crop_at_the_border():
+    image = np.arange(40 * 50 * 3).reshape(40, 50, 3)
+    assert np.array_equal(get_padded_crop(image, 20, 20, 8), image[12:28, 12:28])
+    crop = get_padded_crop(image, 3, 36, 8)
+    assert crop.shape == (16, 16, 3)
+    # the crop starts at (x - 8, y - 8), the missing part repeats the border
+    assert np.array_equal(crop[:12, 5:], image[28:40, 0:11])
+    assert np.array_equal(crop[:12, :5], np.repeat(image[28:40, :1], 5, axis=1))
+    assert np.array_equal(crop[12:], np.repeat(crop[11:12], 4, axis=0))
+    assert get_padded_crop(image, -20, 20, 8) is None
+    assert get_padded_crop(image, 20, 60, 8) is None
+
+
+def test_border_circle_is_refined_from_padded_crop():
+    image = draw_circles((100, 100), [(5, 50)], 9)
+    crop = get_padded_crop(image, 4, 51, 16)
+    circles, likelihoods = run_circle_max_batch([crop], radius=9, step=2)
+    assert likelihoods[0] > 0
+    assert abs(circles[0, 0] + 4 - 16 - 5) <= 1 and abs(circles[0, 1] + 51 - 16 - 50) <= 1
+
+
+def test_run_circle_threhold_fft_finds_the_scatter_circles():
+    image = draw_circles((160, 200), [(30, 30), (90, 35), (150, 40), (40, 110), (100, 120), (170, 125)], 9)
+    expected = run_circle_threhold(image, 9, circle_threshold=20, step=2)
+    assert expected.shape[0] == 6
+    assert np.array_equal(run_circle_threhold(image, 9, circle_threshold=20, step=2, method="fft"), expected)
+
+
+def test_run_circle_threhold_stream_matches_full():
+    image = draw_circles((160, 200), [(30, 30), (90, 35), (150, 40), (40, 110), (100, 120), (170, 125)], 9)
+    for threshold in [5, 20, 35]:
+        expected = run_circle_threhold(image, 9, circle_threshold=threshold, step=3)
+        assert np.array_equal(run_circle_threhold(image, 9, circle_threshold=threshold, step=3, reduction="stream"),
+                              expected)
+
+
+# a fiducial frame around a textured tissue area, like run_geometric gets it
+def get_frame_image():
+    image = np.full((420, 420), 30, np.uint8)
+    centers = [(x, y) for x in range(40, 400, 34) for y in (40, 380)]
+    centers += [(x, y) for y in range(74, 380, 34) for x in (40, 380)]
+    for x, y in centers:
+        cv2.circle(image, (x, y), 10, 220, 3)
+    texture = (np.random.default_rng(0).random((200, 200)) * 255).astype(np.uint8)
+    image[110:310, 110:310] = cv2.GaussianBlur(texture, (5, 5), 0)
+    return image
+
+
+def get_frame_circles(circles):
+    return np.array(sorted(tuple(c) for c in circles.tolist() if not (100 < c[0] < 320 and 100 < c[1] < 320)))
+
+
+# the two passes of run_geometric without the pyramid
+def run_full_passes(image):
+    session = HoughSession(image, max_planes=10)
+    circles = session.detect(10, circle_threshold=20, step=5)
+    re_r = statistics.mode(circles[:, 2])
+    return session.detect(re_r, circle_threshold=int(2 * re_r), step=3), re_r
+
+
+def test_pyramid_half_scale_matches_full_passes_on_the_frame():
+    image = get_frame_image()
+    expected, expected_radius = run_full_passes(image)
+    circles, radius = run_circle_pyramid(image, 10, circle_threshold=20, step=5, scale=0.5)
+    assert radius == expected_radius
+    assert len(get_frame_circles(expected)) == 40
+    assert np.array_equal(get_frame_circles(circles), get_frame_circles(expected))
+    # the tissue detections of the full passes are outside the roi
+    assert len(circles) < len(expected)
+
+
+def test_pyramid_quarter_scale_stays_within_a_pixel():
+    image = get_frame_image()
+    expected = get_frame_circles(run_full_passes(image)[0])
+    circles = get_frame_circles(run_circle_pyramid(image, 10, circle_threshold=20, step=5, scale=0.25)[0])
+    assert len(circles) >= 0.9 * len(expected)
+    distance, index = cKDTree(expected[:, :2]).query(circles[:, :2])
+    assert distance.max() <= 1
+    assert np.array_equal(circles[:, 2], expected[index, 2])
+
+
+# square frame of n x n fiducials on the border, like the slide templates
+def get_frame_template(n=12, spacing=30.0, radius=8.0):
+    border = [(i, j) for i in range(n) for j in range(n) if i in (0, n - 1) or j in (0, n - 1)]
+    return np.array([[i * spacing, j * spacing, radius] for i, j in border])
+
+
+def test_lattice_search_finds_every_template_circle():
+    circles_f = get_frame_template()
+    angle = np.deg2rad(2.0)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    expected = circles_f[:, :2] @ rotation.T + [70.0, 55.0]
+    image = np.full((480, 480), 20, np.uint8)
+    for x, y in np.round(expected).astype(int):
+        cv2.circle(image, (int(x), int(y)), 8, 230, 2)
+    circles, likelihoods, predicted = run_circle_lattice(image, 8, circles_f, 16, scale=0.5)
+    # one row per template circle, in template order
+    assert circles.shape == (len(circles_f), 3)
+    assert np.linalg.norm(circles[:, :2] - expected, axis=1).max() <= 2
+    # the windows around the predicted fiducials contain the circles
+    assert np.abs(predicted[:, :2] - expected).max() < 2 * 8
+    assert likelihoods.min() >= 5
+
+
+def test_quantized_detection_matches_float():
+    image = draw_circles((160, 200), [(30, 30), (90, 35), (150, 40), (40, 110), (100, 120), (170, 125)], 9)
+    expected = run_circle_threhold(image, 9, circle_threshold=20, step=2)
+    assert np.array_equal(run_circle_threhold(image, 9, circle_threshold=20, step=2, quantize=True), expected)
+    session = HoughSession(image, quantize=True)
+    assert np.array_equal(session.detect(9, circle_threshold=20, step=2), expected)
+
+
+# find_nearest_points as it was before the KD-tree, from the dense distance matrix
+def find_nearest_points_dense(src, dst, is_same=False):
+    distance = np.linalg.norm(dst[:, np.newaxis, :2] - src[np.newaxis, :, :2], axis=2)
+    if is_same:
+        distance[np.arange(distance.shape[0]), np.arange(distance.shape[0])] = distance.max()
+    return np.argmin(distance, axis=1), np.min(distance, axis=1)
+
+
+def test_find_nearest_points_matches_dense_distances():
+    rng = np.random.default_rng(0)
+    src = rng.uniform(0, 100, (200, 2))
+    dst = rng.uniform(0, 100, (150, 2))
+    indices, distance = find_nearest_points(src, dst)
+    expected_indices, expected_distance = find_nearest_points_dense(src, dst)
+    assert np.array_equal(indices, expected_indices)
+    assert np.allclose(distance, expected_distance)
+
+    # integer points are often equally near, any of them is a nearest point
+    grid_src, grid_dst = np.round(src), np.round(dst)
+    indices, distance = find_nearest_points(grid_src, grid_dst)
+    _, expected_distance = find_nearest_points_dense(grid_src, grid_dst)
+    assert np.allclose(distance, expected_distance)
+    assert np.allclose(np.linalg.norm(grid_src[indices] - grid_dst, axis=1), expected_distance)
+
+    indices, distance = find_nearest_points(src, src, is_same=True)
+    expected_indices, expected_distance = find_nearest_points_dense(src, src, is_same=True)
+    assert np.array_equal(indices, expected_indices)
+    assert np.allclose(distance, expected_distance)
+
+
+def test_find_nearest_points_within_bound():
+    rng = np.random.default_rng(1)
+    src = rng.uniform(0, 100, (50, 2))
+    dst = rng.uniform(0, 100, (80, 2))
+    indices, distance = find_nearest_points(src, dst, distance_upper_bound=5)
+    expected_indices, expected_distance = find_nearest_points_dense(src, dst)
+    near = expected_distance < 5
+    assert np.array_equal(indices[near], expected_indices[near])
+    assert np.all(indices[~near] == src.shape[0]) and np.all(np.isinf(distance[~near]))
+    within = find_points_within(src, dst, 5)
+    dense = np.linalg.norm(dst[:, np.newaxis] - src[np.newaxis], axis=2)
+    for i in range(dst.shape[0]):
+        assert sorted(within[i]) == list(np.nonzero(dense[i] <= 5)[0])
+
+
+def get_random_circles(n, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(0, 300, (n, 2))
+    radius = rng.integers(8, 12, n)
+    return [[int(x), int(y), int(r)] for (x, y), r in zip(centers, radius)]
+
+
+# unique_pairs_below_threshold as it was, a double loop over the circles
+def unique_pairs_below_threshold_loop(circle_list, threshold):
+    result = []
+    for i in range(len(circle_list)):
+        for j in range(i + 1, len(circle_list)):
+            distance = np.hypot(circle_list[i][0] - circle_list[j][0], circle_list[i][1] - circle_list[j][1])
+            if distance < threshold:
+                result.append((str(circle_list[i][1]) + '_' + str(circle_list[i][0]) + '_' + str(circle_list[i][2]),
+                               str(circle_list[j][1]) + '_' + str(circle_list[j][0]) + '_' + str(circle_list[j][2])))
+    return result
+
+
+def test_unique_pairs_match_the_double_loop():
+    for seed in range(3):
+        circles = get_random_circles(400, seed)
+        # integer centers, some pairs are exactly at the threshold
+        for threshold in [5, 10]:
+            assert unique_pairs_below_threshold(circles, threshold) == \
+                   unique_pairs_below_threshold_loop(circles, threshold)
+
+
+# the greedy pass written out with the dense distance matrix: circles by decreasing
+# radius, a circle is kept when no kept circle is closer than the threshold
+def remove_overlapping_circles_loop(circle_list, threshold, order):
+    centers = np.array([circle[:2] for circle in circle_list], dtype=float)
+    distances = np.linalg.norm(centers[:, np.newaxis] - centers[np.newaxis], axis=2)
+    kept = []
+    for i in order:
+        if all(distances[i, j] >= threshold for j in kept):
+            kept.append(i)
+    return [circle_list[i] for i in sorted(kept)]
+
+
+def test_remove_overlapping_circles_matches_the_greedy_loop():
+    for seed in range(3):
+        circles = get_random_circles(400, seed)
+        # distinct radii make the visiting order unique
+        for i, circle in enumerate(circles):
+            circle[2] = circle[2] * 1000 + i
+        order = np.argsort([-circle[2] for circle in circles], kind='stable')
+        kept = remove_overlapping_circles(list(circles), 10, seed=seed)
+        assert kept == remove_overlapping_circles_loop(circles, 10, order)
+        assert unique_pairs_below_threshold(kept, 10) == []
+
+
+def test_remove_overlapping_circles_prefers_larger_radius():
+    circles = get_random_circles(600, 4)
+    kept = remove_overlapping_circles(list(circles), 10, seed=0)
+    assert unique_pairs_below_threshold(kept, 10) == []
+    centers = np.array([circle[:2] for circle in kept], dtype=float)
+    radius = np.array([circle[2] for circle in kept])
+    # every removed circle is close to a kept circle at least as large
+    for x, y, r in circles:
+        if [x, y, r] not in kept:
+            near = np.hypot(centers[:, 0] - x, centers[:, 1] - y) < 10
+            assert np.any(near & (radius >= r))
+    assert kept == remove_overlapping_circles(list(circles), 10, seed=0)
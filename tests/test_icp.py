@@ -0,0 +1,98 @@
+import numpy as np
+from scipy.spatial import cKDTree
+import geo_utils.icp as icp
+
+
+# icp as it was before the KD-tree, with the nearest neighbours from the dense
+# distance matrix
+def icp_brute_force(A, B, max_iterations=100, tolerance=0.000001):
+    src = np.ones((3, A.shape[0]))
+    src[:2, :] = A.T
+    prev_error = 0
+    for i in range(max_iterations):
+        distance_matrix = np.linalg.norm(src[:2, :].T[:, np.newaxis] - B[np.newaxis], axis=2)
+        indices = distance_matrix.argmin(axis=1)
+        distances = distance_matrix[np.arange(A.shape[0]), indices]
+        T, _, _ = icp.best_fit_transform(src[:2, :].T, B[indices])
+        src = np.dot(T, src)
+        mean_error = np.mean(distances)
+        if np.abs(prev_error - mean_error) < tolerance:
+            break
+        prev_error = mean_error
+    T, _, _ = icp.best_fit_transform(A, src[:2, :].T)
+    return T, mean_error
+
+
+def get_rigid_transform(angle, shift):
+    T = np.identity(3)
+    T[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    T[:2, 2] = shift
+    return T
+
+
+def get_lattice(n, spacing):
+    rows, cols = np.mgrid[0:n, 0:n]
+    return np.stack((cols.ravel(), rows.ravel()), axis=1) * spacing
+
+
+def test_kdtree_icp_matches_brute_force():
+    rng = np.random.default_rng(0)
+    B = get_lattice(10, 20.0) + rng.normal(0, 0.5, (100, 2))
+    T_true = get_rigid_transform(0.05, [3.0, -2.0])
+    A = (B - T_true[:2, 2]) @ T_true[:2, :2]
+    A = A + rng.normal(0, 0.3, A.shape)
+    expected, expected_error = icp_brute_force(A, B)
+    T, mean_error = icp.icp(A, B, max_iterations=100, tolerance=0.000001)
+    # the moved points are kept in float32 now
+    assert np.allclose(T, expected, atol=1e-3)
+    assert abs(mean_error - expected_error) < 1e-3
+    assert np.allclose(T, T_true, atol=0.05)
+
+
+def test_icp_with_a_shared_tree():
+    rng = np.random.default_rng(1)
+    B = get_lattice(8, 25.0)
+    tree = cKDTree(B)
+    for _ in range(3):
+        A = B[rng.permutation(64)[:40]] + rng.normal(0, 1.0, (40, 2)) + [2.0, 1.0]
+        T, error = icp.icp(A, B, max_iterations=100, tolerance=0.000001, tree=tree)
+        expected, expected_error = icp.icp(A, B, max_iterations=100, tolerance=0.000001)
+        assert np.array_equal(T, expected)
+        assert error == expected_error
+
+
+# frame of fiducials on the border of an n x n lattice
+def get_frame(n, spacing):
+    points = get_lattice(n, spacing)
+    border = (points.min(axis=1) == 0) | (points.max(axis=1) == (n - 1) * spacing)
+    return points[border]
+
+
+def test_ransac_pose_recovers_a_known_transform():
+    rng = np.random.default_rng(2)
+    A = get_frame(20, 15.0)
+    T_true = get_rigid_transform(0.08, [47.0, -31.0])
+    B = A @ T_true[:2, :2].T + T_true[:2, 2] + rng.normal(0, 0.5, A.shape)
+    # false detections inside the frame
+    B = np.vstack((B, rng.uniform(60, 240, (150, 2))))
+    T, inliers = icp.ransac_pose(A, B, 7.5)
+    assert inliers >= 0.95 * A.shape[0]
+    moved = A @ T[:2, :2].T + T[:2, 2]
+    # a hypothesis from one point pair, only good up to the inlier distance
+    assert np.linalg.norm(moved - B[:A.shape[0]], axis=1).max() < 7.5
+    assert np.array_equal(T, icp.ransac_pose(A, B, 7.5)[0])
+
+
+def test_icp_from_ransac_pose_beats_a_lattice_shift():
+    rng = np.random.default_rng(3)
+    A = get_lattice(12, 15.0)
+    # shifted by more than one lattice step, a plain ICP locks onto the wrong shift
+    T_true = get_rigid_transform(0.02, [40.0, 25.0])
+    B = A @ T_true[:2, :2].T + T_true[:2, 2] + rng.normal(0, 0.3, A.shape)
+    tree = cKDTree(B)
+    init_pose, _ = icp.ransac_pose(A, B, 7.5, tree=tree)
+    T, _ = icp.get_icp_transformation(B, A, tree=tree, init_pose=init_pose)
+    moved = A @ T[:2, :2].T + T[:2, 2]
+    assert np.linalg.norm(moved - B, axis=1).max() < 1.5
+    T_plain, _ = icp.get_icp_transformation(B, A, tree=tree)
+    assert np.linalg.norm(A @ T_plain[:2, :2].T + T_plain[:2, 2] - B, axis=1).max() > 5
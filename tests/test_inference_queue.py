@@ -0,0 +1,91 @@
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer
+import numpy as np
+from inference_queue import InferenceQueue, get_handler, pack_arrays, unpack_arrays
+
+
+# Stands in for the generator runner: numpy only, records the rows of every call.
+# The first call waits for the gate, so the following jobs pile up in the queue.
+class StubRunner:
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+
+    def __call__(self, image):
+        self.calls.append(image[:, 0, 0].tolist())
+        self.gate.wait(10)
+        return {'output_0': image * 2, 'output_1': image.sum(axis=(1, 2))}
+
+
+def submit_in_thread(inference_queue, kind, image, results):
+    def submit():
+        results[int(image[0, 0, 0])] = inference_queue.submit(kind, {'image': image})
+    thread = threading.Thread(target=submit)
+    thread.start()
+    return thread
+
+
+def wait_for(condition):
+    deadline = time.time() + 10
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    assert condition()
+
+
+def test_one_call_per_micro_batch():
+    runner = StubRunner()
+    inference_queue = InferenceQueue({'generator': runner}, max_batch=4, max_wait=0.05)
+    results = {}
+    threads = [submit_in_thread(inference_queue, 'generator', np.zeros((1, 2, 3)), results)]
+    wait_for(lambda: len(runner.calls) == 1)
+    # 5 jobs of one shape, 2 of another, interleaved
+    shapes = [(2, 3), (2, 3), (4, 5), (2, 3), (4, 5), (2, 3), (2, 3)]
+    for i, shape in enumerate(shapes):
+        size = 2 if i == 3 else 1
+        threads.append(submit_in_thread(inference_queue, 'generator', np.full((size,) + shape, i + 1.0), results))
+        wait_for(lambda: inference_queue.jobs.qsize() == i + 1)
+    runner.gate.set()
+    for thread in threads:
+        thread.join(10)
+
+    # the first job alone, then at most max_batch jobs of the same shape in arrival order
+    assert runner.calls == [[0.0], [1.0, 2.0, 4.0, 4.0, 6.0], [3.0, 5.0], [7.0]]
+    for i, shape in enumerate(shapes):
+        size = 2 if i == 3 else 1
+        image = np.full((size,) + shape, i + 1.0)
+        assert np.array_equal(results[i + 1]['output_0'], image * 2)
+        assert np.array_equal(results[i + 1]['output_1'], image.sum(axis=(1, 2)))
+
+
+def test_errors_reach_every_job_of_the_batch():
+    def failing_runner(image):
+        raise ValueError("bad batch")
+    inference_queue = InferenceQueue({'generator': failing_runner}, max_batch=4, max_wait=0.01)
+    try:
+        inference_queue.submit('generator', {'image': np.zeros((1, 2))})
+    except ValueError as e:
+        assert str(e) == "bad batch"
+    else:
+        assert False
+
+
+def test_handler_round_trip():
+    def runner(image, mask):
+        return {'inpainted': image * (1 - mask)}
+    inference_queue = InferenceQueue({'inpainter': runner}, max_batch=4, max_wait=0.01)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), get_handler(inference_queue))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        image = np.random.default_rng(0).random((1, 3, 8, 8)).astype(np.float32)
+        mask = (image[:, :1] > 0.5).astype(np.float32)
+        url = 'http://127.0.0.1:%d/inpainter' % server.server_address[1]
+        request = urllib.request.Request(url, data=pack_arrays(image=image, mask=mask))
+        with urllib.request.urlopen(request) as response:
+            result = unpack_arrays(response.read())
+        assert np.array_equal(result['inpainted'], image * (1 - mask))
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,42 @@
+import numpy as np
+import cv2
+from mask_utils import get_image_masks, get_cnn_position_mask, get_image_mask_from_annotation
+
+
+def get_masks(height, width, patch_size, seed):
+    rng = np.random.default_rng(seed)
+    cnn_mask = np.zeros((height, width), dtype=np.uint8)
+    for x, y in rng.integers(0, [width, height], (12, 2)):
+        cv2.circle(cnn_mask, (int(x), int(y)), 5, 1, -1)
+    # binarize_array returns an int mask
+    cnn_mask = cnn_mask.astype(int)
+    grid = rng.random((height // patch_size, width // patch_size))
+    return cnn_mask, grid
+
+
+def test_image_masks_have_the_image_size():
+    cnn_mask, grid = get_masks(96, 160, 32, 0)
+    masks = get_image_masks(cnn_mask, grid, 32)
+    for mask in masks:
+        assert mask.shape == cnn_mask.shape
+    position = get_image_mask_from_annotation(cnn_mask.shape, grid, 32)
+    assert np.array_equal(masks[1], position)
+    assert np.array_equal(masks[2], get_cnn_position_mask(cnn_mask, position, 32))
+
+
+def test_image_masks_of_quarters_stitch_to_the_image():
+    # divide_cytassist_and_process stacks the masks of the four quarters
+    cnn_mask, grid = get_masks(128, 192, 32, 1)
+    quarters = [(slice(0, 64), slice(0, 96)), (slice(0, 64), slice(96, 192)),
+                (slice(64, 128), slice(0, 96)), (slice(64, 128), slice(96, 192))]
+    grid_quarters = [(slice(0, 2), slice(0, 3)), (slice(0, 2), slice(3, 6)),
+                     (slice(2, 4), slice(0, 3)), (slice(2, 4), slice(3, 6))]
+    results = [get_image_masks(cnn_mask[q], grid[g], 32) for q, g in zip(quarters, grid_quarters)]
+    whole = get_image_masks(cnn_mask, grid, 32)
+    for i in range(3):
+        top = np.hstack((results[0][i], results[1][i]))
+        bottom = np.hstack((results[2][i], results[3][i]))
+        combined = np.vstack((top, bottom))
+        assert combined.shape == cnn_mask.shape
+        if i < 2:
+            assert np.array_equal(combined, whole[i])
@@ -0,0 +1,111 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+from models import Patch_Binary_Generator, Rich_Parrel_Attention_Generator, get_pos_encoding
+
+
+def get_outputs(outputs):
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+def assert_batch_matches_single_images(run, x, atol=1e-5):
+    batch = get_outputs(run(x))
+    for i in range(x.shape[0]):
+        single = get_outputs(run(x[i:i + 1]))
+        assert len(single) == len(batch)
+        for a, b in zip(batch, single):
+            assert a.shape[0] == x.shape[0]
+            assert torch.allclose(a[i:i + 1], b, atol=atol)
+
+
+@pytest.mark.parametrize('model', [Patch_Binary_Generator, Rich_Parrel_Attention_Generator])
+def test_generator_batch_of_two(model):
+    torch.manual_seed(0)
+    generator = model().eval()
+    x = torch.rand(2, 3, 128, 96) * 2 - 1
+    with torch.no_grad():
+        assert_batch_matches_single_images(generator, x)
+        outputs = get_outputs(generator(x))
+    # the patch head gives one value per 32 x 32 patch
+    assert outputs[-1].shape == (2, 4, 3)
+
+
+# training mode always interpolates, so it gives the uncached encoding
+def get_interpolated_pos_encoding(generator, w, h):
+    generator.train()
+    with torch.no_grad():
+        encoding = get_pos_encoding(generator, w, h)
+    generator.eval()
+    return encoding
+
+
+@pytest.mark.parametrize('model', [Patch_Binary_Generator, Rich_Parrel_Attention_Generator])
+def test_cached_pos_encoding_matches_interpolation(model):
+    torch.manual_seed(0)
+    generator = model().eval()
+    with torch.no_grad():
+        generator.pos_embed.normal_()
+    for w, h in [(96, 160), (160, 96), (128, 128), (96, 160)]:
+        cached = get_pos_encoding(generator, w, h)
+        assert torch.equal(cached, get_interpolated_pos_encoding(generator, w, h))
+        assert get_pos_encoding(generator, w, h) is cached
+
+    # updating pos_embed in place drops the cached encodings
+    with torch.no_grad():
+        generator.pos_embed.mul_(2)
+    assert torch.equal(get_pos_encoding(generator, 96, 160), get_interpolated_pos_encoding(generator, 96, 160))
+
+    # and the forward gives the same outputs with and without the cache
+    x = torch.rand(1, 3, 96, 160) * 2 - 1
+    with torch.no_grad():
+        cached_outputs = get_outputs(generator(x))
+        generator.pos_encoding_cache.clear()
+        outputs = get_outputs(generator(x))
+    for a, b in zip(cached_outputs, outputs):
+        assert torch.equal(a, b)
+
+
+@pytest.mark.parametrize('backend', ['torchscript', 'onnx'])
+@pytest.mark.parametrize('model', [Patch_Binary_Generator, Rich_Parrel_Attention_Generator])
+def test_exported_generator_round_trip(tmp_path, backend, model):
+    if backend == 'onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    cnn_io = pytest.importorskip('cnn_io')
+    export_generators = pytest.importorskip('export_generators')
+    torch.manual_seed(0)
+    generator = model().eval()
+    path = export_generators.export_generator(generator, 'test', backend, (128, 128), export_dir=str(tmp_path))
+    runtime = cnn_io.ExportedGenerator(generator, path, backend, num_threads=1)
+
+    # traced on one 128 x 128 image, run on a batch of two at another size
+    x = torch.rand(2, 3, 96, 160) * 2 - 1
+    with torch.no_grad():
+        eager = get_outputs(generator(x))
+    exported = get_outputs(runtime(x))
+    assert len(eager) == len(exported)
+    for a, b in zip(eager, exported):
+        assert a.shape == b.shape
+        assert torch.allclose(a, b, atol=1e-4)
+    assert_batch_matches_single_images(runtime, x, atol=1e-4)
+
+
+@pytest.mark.parametrize('model', [Patch_Binary_Generator, Rich_Parrel_Attention_Generator])
+def test_onnx_export_declares_dynamic_axes(tmp_path, model):
+    onnx = pytest.importorskip('onnx')
+    export_generators = pytest.importorskip('export_generators')
+    torch.manual_seed(0)
+    generator = model().eval()
+    path = export_generators.export_generator(generator, 'test', 'onnx', (128, 128), export_dir=str(tmp_path))
+    graph = onnx.load(path).graph
+    dims = {value.name: [dim.dim_param for dim in value.type.tensor_type.shape.dim]
+            for value in list(graph.input) + list(graph.output)}
+    assert dims['image'][0] == 'batch'
+    assert dims['image'][2:] == ['height', 'width']
+    if 'pos_embed' in dims:
+        assert dims['pos_embed'][1] == 'patches'
+    # every output axis follows the input, none is fixed to the traced 128 x 128
+    outputs = [value.name for value in graph.output]
+    assert outputs
+    for name in outputs:
+        assert all(dims[name])
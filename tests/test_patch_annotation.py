@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from pix2pix.patch_annotation import upsample_blocks, multiply_blocks, annotate_patches, \
+    annotate_continuous_patches
+
+
+def test_multiply_blocks_matches_upsampled_grid():
+    rng = np.random.default_rng(0)
+    grid = rng.random((4, 3)).astype(np.float32)
+    image = rng.integers(0, 2, (128, 96))
+    assert np.allclose(multiply_blocks(image, grid, 32), image * upsample_blocks(grid, 32, image.shape))
+
+
+def test_multiply_blocks_pads_grid_that_does_not_tile_the_image():
+    rng = np.random.default_rng(1)
+    grid = rng.random((4, 3))
+    image = rng.random((140, 90))
+    expected = image * upsample_blocks(grid, 32, image.shape, dtype=float)
+    assert np.allclose(multiply_blocks(image, grid, 32), expected)
+    assert np.all(multiply_blocks(image, grid, 32)[128:] == 0)
+
+
+def rectangles_intersect(rect1, rect2):
+    x1, y1, w1, h1 = rect1
+    x2, y2, w2, h2 = rect2
+    return not (x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1)
+
+
+# annotate_patches as it was in pix2pix/datasets.py and the scripts, with their padding
+def annotate_patches_loop(image_size, step, circles, padding):
+    w, h = image_size
+    annotation = np.zeros((w // step, h // step), dtype=int)
+    for i in range(w // step):
+        for j in range(h // step):
+            patch_rect = (i * step, j * step, step, step)
+            for circle in circles:
+                circle_x, circle_y, circle_radius = circle[:3]
+                circle_radius = circle_radius + padding
+                circle_rect = (circle_y - circle_radius, circle_x - circle_radius, 2 * circle_radius, 2 * circle_radius)
+                if rectangles_intersect(patch_rect, circle_rect):
+                    annotation[i, j] = 1
+                    break
+    return annotation
+
+
+# annotate_continuous_patches as it was in check_annotation.py
+def annotate_continuous_patches_loop(image_size, patch_size, circles):
+    mask = np.zeros(image_size, dtype=np.uint8)
+    half_patch = patch_size // 2
+    for circle in circles:
+        x, y = circle[:2]
+        top_left_x = max(0, int(x - half_patch))
+        top_left_y = max(0, int(y - half_patch))
+        bottom_right_x = min(image_size[1], int(x + half_patch))
+        bottom_right_y = min(image_size[0], int(y + half_patch))
+        mask[top_left_y:bottom_right_y, top_left_x:bottom_right_x] = 1
+    return mask
+
+
+def get_random_circles(n, image_size, seed, fractional):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-20, [image_size[1] + 20, image_size[0] + 20], (n, 2))
+    if not fractional:
+        centers = np.round(centers)
+    radius = rng.integers(3, 14, n)
+    return [[x, y, r, 0] for (x, y), r in zip(centers, radius)]
+
+
+@pytest.mark.parametrize('padding', [1, 2, 4])
+@pytest.mark.parametrize('step', [8, 32])
+@pytest.mark.parametrize('fractional', [False, True])
+def test_annotate_patches_matches_the_loop(padding, step, fractional):
+    # the image size is not a multiple of the step
+    image_size = (200, 150)
+    circles = get_random_circles(40, image_size, padding * step, fractional)
+    expected = annotate_patches_loop(image_size, step, circles, padding)
+    assert np.array_equal(annotate_patches(image_size, step, circles, padding=padding), expected)
+
+
+def test_annotate_patches_without_circles():
+    assert np.array_equal(annotate_patches((64, 96), 32, []), np.zeros((2, 3), dtype=int))
+
+
+def test_annotate_continuous_patches_matches_the_loop():
+    image_size = (200, 150)
+    rng = np.random.default_rng(0)
+    # centers inside the image, or at most half a patch outside of it
+    centers = rng.uniform(-8, [158, 208], (60, 2))
+    circles = [[x, y, 5, 0] for x, y in centers]
+    expected = annotate_continuous_patches_loop(image_size, 16, circles)
+    assert np.array_equal(annotate_continuous_patches(image_size, 16, circles), expected)
@@ -0,0 +1,47 @@
+import numpy as np
+from geo_utils.rectangle import largest_empty_rectangle
+
+
+# largest empty rectangle from every pair of corners, with the summed area table
+def largest_empty_rectangle_brute_force(occupied):
+    rows, cols = occupied.shape
+    table = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    table[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+    best_area = 0
+    for r0 in range(rows):
+        for r1 in range(r0, rows):
+            for c0 in range(cols):
+                for c1 in range(c0, cols):
+                    count = table[r1 + 1, c1 + 1] - table[r0, c1 + 1] - table[r1 + 1, c0] + table[r0, c0]
+                    if count == 0:
+                        best_area = max(best_area, (r1 - r0 + 1) * (c1 - c0 + 1))
+    return best_area
+
+
+def check_rectangle(occupied):
+    r0, c0, r1, c1 = largest_empty_rectangle(occupied)
+    expected_area = largest_empty_rectangle_brute_force(occupied)
+    if expected_area == 0:
+        assert r1 < r0
+        return
+    # ties may pick another rectangle of the same area
+    assert (r1 - r0 + 1) * (c1 - c0 + 1) == expected_area
+    assert not occupied[r0:r1 + 1, c0:c1 + 1].any()
+
+
+def test_largest_empty_rectangle_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for density in [0.05, 0.2, 0.5, 0.8]:
+        for _ in range(10):
+            shape = tuple(rng.integers(1, 14, 2))
+            check_rectangle(rng.random(shape) < density)
+
+
+def test_largest_empty_rectangle_edge_cases():
+    check_rectangle(np.zeros((7, 5), dtype=bool))
+    check_rectangle(np.ones((4, 6), dtype=bool))
+    occupied = np.zeros((9, 9), dtype=bool)
+    occupied[4, :] = True
+    occupied[:, 4] = True
+    check_rectangle(occupied)
+    assert largest_empty_rectangle(np.zeros((3, 8), dtype=bool)) == (0, 0, 2, 7)
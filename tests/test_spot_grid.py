@@ -0,0 +1,70 @@
+import numpy as np
+from scipy.spatial import cKDTree
+import fiducial_utils
+import spot_grid
+
+
+def get_transform(angle, scale, shift):
+    T = np.identity(3)
+    T[:2, :2] = scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    T[:2, 2] = shift
+    return T
+
+
+def test_fit_affine_round_trip():
+    rng = np.random.default_rng(0)
+    T = get_transform(0.3, 1.7, [120.0, -45.0])
+    T[0, 1] += 0.1
+    src = rng.uniform(0, 500, (30, 2))
+    dst = spot_grid.apply_transform(T, src)
+    assert np.allclose(spot_grid.fit_affine(src, dst), T)
+    inverse = spot_grid.fit_affine(dst, src)
+    assert np.allclose(spot_grid.apply_transform(inverse, dst), src)
+
+
+def test_spot_lattice_layout():
+    template = fiducial_utils.get_template('mouse')
+    array_row, array_col, xy = spot_grid.get_spot_lattice(template)
+    assert xy.shape == (4992, 2)
+    assert np.all(array_row % 2 == array_col % 2)
+    assert np.allclose(xy.mean(axis=0), [template.framecenter_x, template.framecenter_y])
+    # the nearest neighbours of a hexagonal lattice are one pitch apart
+    pitch = spot_grid.SPOT_PITCH * template.square_scale / spot_grid.FRAME_SIZE
+    distances, _ = cKDTree(xy).query(xy, k=2)
+    assert np.allclose(distances[:, 1], pitch)
+
+
+def test_spot_grid_from_the_circles_and_the_frame():
+    template = fiducial_utils.get_template('mouse')
+    T = get_transform(0.05, 0.8, [300.0, 200.0])
+    _, _, expected = spot_grid.get_spot_lattice(template)
+    expected = spot_grid.apply_transform(T, expected)
+    image_circles = spot_grid.apply_transform(T, template.circles[:, :2])
+    _, _, xy = spot_grid.get_spot_grid(template, image_circles)
+    assert np.allclose(xy, expected)
+    corners = spot_grid.apply_transform(T, spot_grid.get_frame_corners(template))
+    _, _, xy = spot_grid.get_spot_grid(template, corners, frame=True)
+    assert np.allclose(xy, expected)
+
+
+def test_sample_tissue_mask_matches_a_loop():
+    rng = np.random.default_rng(1)
+    mask = rng.random((40, 60)) < 0.5
+    xy = rng.uniform(-20, 260, (500, 2))
+    scale = (0.25, 0.2)
+    expected = np.zeros(500, dtype=np.uint8)
+    for i, (x, y) in enumerate(xy):
+        row, col = int(np.round(y * scale[0])), int(np.round(x * scale[1]))
+        if 0 <= row < mask.shape[0] and 0 <= col < mask.shape[1]:
+            expected[i] = mask[row, col]
+    assert np.array_equal(spot_grid.sample_tissue_mask(mask, xy, scale), expected)
+    assert np.array_equal(spot_grid.sample_tissue_mask(mask, xy * 0.2, 1), spot_grid.sample_tissue_mask(mask, xy, 0.2))
+
+
+def test_save_tissue_positions(tmp_path):
+    xy = np.array([[10.4, 20.6], [30.0, 40.0]])
+    path = str(tmp_path / 'tissue_positions.csv')
+    spot_grid.save_tissue_positions(path, [0, 1], [0, 1], xy, [1, 0])
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines == [spot_grid.TISSUE_POSITIONS_HEADER, '0x0,1,0,0,21,10', '1x1,0,1,1,40,30']
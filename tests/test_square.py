@@ -0,0 +1,48 @@
+import numpy as np
+import cv2
+import pytest
+from scipy.ndimage import gaussian_filter
+from geo_utils.square import fit_square_to_mask, fit_square_with_integral
+
+
+# soft frame like the position generator output, the ridge follows the border of
+# the square with center (cx, cy) in (row, column) and side s
+def get_ridge_mask(size, cx, cy, s, sigma):
+    rows, cols = np.mgrid[0:size, 0:size].astype(float)
+    dr = np.abs(rows - cx) - s / 2
+    dc = np.abs(cols - cy) - s / 2
+    outside = np.hypot(np.maximum(dr, 0), np.maximum(dc, 0))
+    inside = np.minimum(np.maximum(dr, dc), 0)
+    distance = outside + inside
+    return np.exp(-distance ** 2 / (2 * sigma ** 2)).astype(np.float32)
+
+
+def test_fit_square_with_integral_optimum_on_search_boundary():
+    s = 200
+    # extent of the coarse search for s = 200, the true square is at its far corner
+    extent = int(np.ceil(0.2 * s)) + s // 50
+    for offset in range(extent - 2, extent + 3):
+        x0, side = 100 + offset, s + offset
+        mask = np.zeros((600, 600))
+        cv2.rectangle(mask, (x0, x0), (x0 + side, x0 + side), 1, 3)
+        # smoothed like in fit_square_to_mask
+        cx, cy, fitted_side = fit_square_with_integral(gaussian_filter(mask, sigma=1.5), (100 + s / 2, 100 + s / 2, s))
+        assert fitted_side == side
+        assert cx == cy == x0 + side / 2
+
+
+def test_fit_square_to_mask_defaults_to_nelder_mead():
+    mask = get_ridge_mask(400, 201.3, 198.6, 240.4, 8)
+    assert fit_square_to_mask(mask) == fit_square_to_mask(mask, method="nelder-mead")
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_integral_fit_stays_within_a_pixel_of_nelder_mead(seed):
+    rng = np.random.default_rng(seed)
+    size = int(rng.integers(300, 500))
+    s = rng.uniform(120, size - 100)
+    center = rng.uniform(s / 2 + 40, size - s / 2 - 40)
+    mask = get_ridge_mask(size, center + rng.uniform(-3, 3), center + rng.uniform(-3, 3), s, rng.uniform(6, 10))
+    nelder_mead = np.array(fit_square_to_mask(mask))
+    integral = np.array(fit_square_to_mask(mask, method="integral"))
+    assert np.abs(nelder_mead - integral).max() <= 1